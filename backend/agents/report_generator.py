@@ -1,14 +1,59 @@
 """
 Generatore report di conformità urbanistica.
 """
-from typing import Dict, Any, Optional
+from typing import Callable, Dict, Any, Iterator, Optional, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
+import orjson
 from loguru import logger
 
 from backend.models.llm_router import LLMRouter, TaskType
 from backend.models.prompt_templates import PromptTemplates
 
+try:
+    from markdown_it import MarkdownIt
+    # Parser CommonMark (include i fenced code block) con estensione tabelle,
+    # istanziato una sola volta a livello di modulo
+    _MD = MarkdownIt("commonmark", {"html": False}).enable(["table"])
+except ImportError:
+    _MD = None
+
+
+# Scritture su disco dei report in background (save_report(background=True))
+_WRITE_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix="report-writer")
+
+
+_HTML_TEMPLATE = """
+<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <title>Report Conformità Urbanistica</title>
+    <style>
+        body {{
+            font-family: Arial, sans-serif;
+            max-width: 900px;
+            margin: 0 auto;
+            padding: 20px;
+            line-height: 1.6;
+        }}
+        h1 {{ color: #2c3e50; border-bottom: 3px solid #3498db; padding-bottom: 10px; }}
+        h2 {{ color: #34495e; margin-top: 30px; }}
+        h3 {{ color: #7f8c8d; }}
+        table {{ border-collapse: collapse; width: 100%; margin: 20px 0; }}
+        th, td {{ border: 1px solid #ddd; padding: 12px; text-align: left; }}
+        th {{ background-color: #3498db; color: white; }}
+        .warning {{ background-color: #fff3cd; padding: 15px; border-left: 4px solid #ffc107; }}
+        .info {{ background-color: #d1ecf1; padding: 15px; border-left: 4px solid #17a2b8; }}
+    </style>
+</head>
+<body>
+{html}
+</body>
+</html>
+"""
+
 
 class ReportGenerator:
     """Generatore report professionali di conformità."""
@@ -30,8 +75,10 @@ class ReportGenerator:
         normative_context: str,
         municipality: str,
         region: str,
-        output_format: str = "markdown"
-    ) -> Dict[str, Any]:
+        output_format: str = "markdown",
+        stream: bool = False,
+        on_complete: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Union[Dict[str, Any], Iterator[str]]:
         """
         Genera report completo di conformità.
         
@@ -42,12 +89,65 @@ class ReportGenerator:
             municipality: Comune
             region: Regione
             output_format: Formato output (markdown, html, pdf)
+            stream: Se True, restituisce un iteratore di chunk markdown
+            on_complete: Con stream=True, chiamata con il report finale a
+                fine stream (il generatore è condiviso tra le richieste:
+                il report non viene salvato sull'istanza)
             
         Returns:
-            Report generato
+            Report generato (o iteratore di chunk se stream=True)
         """
         logger.info(f"Generazione report per {municipality}")
         
+        # Un solo timestamp per data del report e metadati
+        now = datetime.now()
+        
+        prompt, llm_kwargs = self._prepare_report_prompt(
+            compliance_result,
+            document_analysis,
+            normative_context,
+            municipality,
+            region,
+            now
+        )
+        
+        if stream:
+            return self._stream_report(
+                prompt,
+                llm_kwargs,
+                compliance_result,
+                municipality,
+                region,
+                output_format,
+                now,
+                on_complete
+            )
+        
+        # Genera report con LLM
+        report_content = self.router.analyze_with_best_model(prompt, **llm_kwargs)
+        
+        report = self._build_report(
+            report_content,
+            compliance_result,
+            municipality,
+            region,
+            output_format,
+            now
+        )
+        
+        logger.success("Report generato")
+        return report
+    
+    def _prepare_report_prompt(
+        self,
+        compliance_result: Dict[str, Any],
+        document_analysis: Dict[str, Any],
+        normative_context: str,
+        municipality: str,
+        region: str,
+        now: datetime
+    ) -> Tuple[str, Dict[str, Any]]:
+        """Prepara prompt e parametri LLM per la generazione del report."""
         # Prepara dati per il report
         analysis_data = {
             "municipality": municipality,
@@ -55,24 +155,67 @@ class ReportGenerator:
             "compliance_analysis": compliance_result.get("analysis", ""),
             "difformita": compliance_result.get("difformita", []),
             "document_analysis": document_analysis,
-            "normative_context": normative_context,
-            "date": datetime.now().strftime("%d/%m/%Y")
+            "date": now.strftime("%d/%m/%Y")
         }
         
         # Usa prompt template per generazione
         prompt = PromptTemplates.format_prompt(
             PromptTemplates.REPORT_GENERATION,
-            analysis_data=str(analysis_data),
+            analysis_data=PromptTemplates.to_prompt_json(analysis_data),
             date=analysis_data["date"]
         )
         
-        # Genera report con LLM
-        report_content = self.router.analyze_with_best_model(
-            prompt,
-            TaskType.REPORT_GENERATION,
-            system_message=PromptTemplates.get_system_message("report_writer")
+        llm_kwargs = {
+            "task_type": TaskType.REPORT_GENERATION,
+            "system_message": PromptTemplates.get_system_message("report_writer"),
+            "cached_context": PromptTemplates.format_prompt(
+                PromptTemplates.NORMATIVE_CONTEXT,
+                context=normative_context
+            )
+        }
+        return prompt, llm_kwargs
+    
+    def _stream_report(
+        self,
+        prompt: str,
+        llm_kwargs: Dict[str, Any],
+        compliance_result: Dict[str, Any],
+        municipality: str,
+        region: str,
+        output_format: str,
+        now: datetime,
+        on_complete: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Iterator[str]:
+        """Emette il report in streaming e passa il report finale a `on_complete`."""
+        parts = []
+        for chunk in self.router.analyze_with_best_model_stream(prompt, **llm_kwargs):
+            parts.append(chunk)
+            yield chunk
+        
+        # La formattazione (es. HTML) è applicata sul contenuto completo
+        report = self._build_report(
+            "".join(parts),
+            compliance_result,
+            municipality,
+            region,
+            output_format,
+            now
         )
+        logger.success("Report generato (streaming)")
         
+        if on_complete is not None:
+            on_complete(report)
+    
+    def _build_report(
+        self,
+        report_content: str,
+        compliance_result: Dict[str, Any],
+        municipality: str,
+        region: str,
+        output_format: str,
+        now: datetime
+    ) -> Dict[str, Any]:
+        """Formatta il contenuto e aggiunge i metadati del report."""
         # Formatta secondo il formato richiesto
         if output_format == "markdown":
             formatted_report = self._format_markdown(report_content)
@@ -81,19 +224,16 @@ class ReportGenerator:
         else:
             formatted_report = report_content
         
-        report = {
+        return {
             "content": formatted_report,
             "format": output_format,
             "metadata": {
                 "municipality": municipality,
                 "region": region,
-                "generation_date": datetime.now().isoformat(),
+                "generation_date": now.isoformat(),
                 "difformita_count": len(compliance_result.get("difformita", []))
             }
         }
-        
-        logger.success("Report generato")
-        return report
     
     def _format_markdown(self, content: str) -> str:
         """Formatta report in Markdown."""
@@ -102,49 +242,20 @@ class ReportGenerator:
     
     def _format_html(self, content: str) -> str:
         """Converte report Markdown in HTML."""
-        try:
-            import markdown
-            html = markdown.markdown(content, extensions=['tables', 'fenced_code'])
-            
-            # Aggiungi CSS
-            styled_html = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <title>Report Conformità Urbanistica</title>
-    <style>
-        body {{
-            font-family: Arial, sans-serif;
-            max-width: 900px;
-            margin: 0 auto;
-            padding: 20px;
-            line-height: 1.6;
-        }}
-        h1 {{ color: #2c3e50; border-bottom: 3px solid #3498db; padding-bottom: 10px; }}
-        h2 {{ color: #34495e; margin-top: 30px; }}
-        h3 {{ color: #7f8c8d; }}
-        table {{ border-collapse: collapse; width: 100%; margin: 20px 0; }}
-        th, td {{ border: 1px solid #ddd; padding: 12px; text-align: left; }}
-        th {{ background-color: #3498db; color: white; }}
-        .warning {{ background-color: #fff3cd; padding: 15px; border-left: 4px solid #ffc107; }}
-        .info {{ background-color: #d1ecf1; padding: 15px; border-left: 4px solid #17a2b8; }}
-    </style>
-</head>
-<body>
-{html}
-</body>
-</html>
-"""
-            return styled_html
-        except ImportError:
-            logger.warning("Modulo markdown non disponibile, ritorno testo plain")
+        if _MD is None:
+            logger.warning("Modulo markdown-it-py non disponibile, ritorno testo plain")
             return content
+        
+        html = _MD.render(content)
+        
+        # Aggiungi CSS
+        return _HTML_TEMPLATE.format(html=html)
     
     def save_report(
         self,
         report: Dict[str, Any],
-        output_path: Path
+        output_path: Path,
+        background: bool = False
     ) -> Path:
         """
         Salva report su file.
@@ -152,6 +263,8 @@ class ReportGenerator:
         Args:
             report: Report da salvare
             output_path: Path output
+            background: Se True, la scrittura avviene in un thread separato
+                e il metodo ritorna subito
             
         Returns:
             Path al file salvato
@@ -164,16 +277,27 @@ class ReportGenerator:
         else:
             output_path = output_path.with_suffix(".md")
         
-        # Salva
-        output_path.write_text(report["content"], encoding="utf-8")
+        # Serializza una sola volta, poi scrive i byte
+        content = report["content"].encode("utf-8")
+        metadata = orjson.dumps(report["metadata"], option=orjson.OPT_INDENT_2)
         
-        # Salva anche metadati
-        import json
-        metadata_path = output_path.with_suffix(".meta.json")
-        metadata_path.write_text(
-            json.dumps(report["metadata"], indent=2),
-            encoding="utf-8"
-        )
+        if background:
+            _WRITE_EXECUTOR.submit(self._write_report_files, output_path, content, metadata)
+        else:
+            self._write_report_files(output_path, content, metadata)
         
-        logger.success(f"Report salvato: {output_path}")
         return output_path
+    
+    @staticmethod
+    def _write_report_files(output_path: Path, content: bytes, metadata: bytes):
+        """Scrive report e metadati su disco."""
+        try:
+            output_path.write_bytes(content)
+            
+            # Salva anche metadati
+            output_path.with_suffix(".meta.json").write_bytes(metadata)
+            
+            logger.success(f"Report salvato: {output_path}")
+        except Exception as e:
+            logger.error(f"Errore nel salvataggio del report {output_path}: {e}")
+            raise
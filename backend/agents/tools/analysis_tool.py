@@ -64,7 +64,9 @@ class AnalysisTool:
         
         if analysis.get("difformita"):
             result += f"Difformità rilevate: {len(analysis['difformita'])}\n"
-            for i, diff in enumerate(analysis['difformita'][:5], 1):  # Max 5
-                result += f"{i}. {diff.get('descrizione', 'N/A')[:200]}...\n"
+            result += "".join(
+                f"{i}. {diff.get('descrizione', 'N/A')[:200]}...\n"
+                for i, diff in enumerate(analysis['difformita'][:5], 1)  # Max 5
+            )
         
         return result
@@ -4,6 +4,7 @@ Tool per verifica conformità.
 from typing import Dict, Any
 from loguru import logger
 
+from backend.models.prompt_templates import PromptTemplates
 from backend.rag.retriever import NormativeRetriever
 from backend.vision.comparator import DocumentComparator
 
@@ -56,7 +57,8 @@ class ComplianceChecker:
         result = f"=== VERIFICA CONFORMITÀ ===\n\n"
         result += f"Comune: {municipality}\n"
         result += f"Regione: {region}\n\n"
-        result += f"Normative applicabili:\n{normative_context[:500]}...\n\n"
+        normative_preview = PromptTemplates.truncate_tokens(normative_context, 400)
+        result += f"Normative applicabili:\n{normative_preview}...\n\n"
         result += "Per una verifica completa, fornire planimetrie e foto dell'immobile.\n"
         
         return result
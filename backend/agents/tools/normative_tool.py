@@ -54,8 +54,10 @@ class NormativeTool:
         
         # Aggiungi citazioni
         citations = self.retriever.get_citations(docs)
-        citations_text = "\n\nCitazioni:\n"
-        for i, cit in enumerate(citations, 1):
-            citations_text += f"{i}. {cit.get('law', 'N/A')} - {cit.get('level', 'N/A')}\n"
+        parts = [result, "\n\nCitazioni:\n"]
+        parts.extend(
+            f"{i}. {cit.get('law', 'N/A')} - {cit.get('level', 'N/A')}\n"
+            for i, cit in enumerate(citations, 1)
+        )
         
-        return result + citations_text
+        return "".join(parts)
@@ -1,21 +1,63 @@
-import json
-from typing import Dict, Any, List, Optional
+import asyncio
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 from pathlib import Path
+from cachetools import LRUCache
 from loguru import logger
+import orjson
+from jinja2 import Environment, FileSystemLoader
 
+from langchain_core.documents import Document
 from langchain_core.messages import HumanMessage, SystemMessage
 
 from backend.models.llm_router import LLMRouter, TaskType
 from backend.models.prompt_templates import PromptTemplates
 from backend.rag.vector_store import MultiLevelVectorStore
 from backend.rag.retriever import NormativeRetriever
+from backend.rag.semantic_cache import SemanticCache
 from backend.vision.comparator import DocumentComparator
 from backend.agents.report_generator import ReportGenerator
+from backend.config import get_settings
+
+
+# Intent "verifica conformità": un'unica scansione case-insensitive del messaggio
+_INTENT_CONFORMITA_RE = re.compile(
+    r"conforme|conformità|verifica|analizza l'immobile",
+    re.IGNORECASE
+)
+
+# Template dei report statici (senza chiamate LLM)
+_TEMPLATES_ENV = Environment(
+    loader=FileSystemLoader(Path(__file__).parent / "templates"),
+    trim_blocks=True,
+    lstrip_blocks=True
+)
+
+# Primo oggetto JSON (piatto) nella risposta del modello, con o senza fence ```json
+_JSON_RE = re.compile(r"\{.*?\}", re.DOTALL)
 
 
 class UrbanComplianceAgent:
     """Agente AI principale per verifica conformità urbanistica."""
     
+    # Query per normative rilevanti in ogni analisi immobile
+    _APPLICABLE_QUERIES = (
+        "distanze minime dai confini",
+        "altezze massime edifici",
+        "indici urbanistici",
+        "destinazioni d'uso",
+        "regolamento edilizio"
+    )
+    # Numero massimo di chunk normativi nel contesto dopo la deduplicazione
+    _MAX_APPLICABLE_DOCS = 8
+    # Limite (token) del contesto normativo passato agli LLM
+    _MAX_CONTEXT_TOKENS = 6000
+    # Immobili elaborati in parallelo nelle analisi batch
+    _BATCH_WORKERS = 4
+    
     def __init__(self):
         """Inizializza l'agente."""
         self.router = LLMRouter()
@@ -24,6 +66,24 @@ class UrbanComplianceAgent:
         self.comparator = DocumentComparator()
         self.report_generator = ReportGenerator(self.router)
         
+        # Cache semantica delle risposte (riusa il modello embeddings del vector store)
+        settings = get_settings()
+        # Le risposte scadono dopo un TTL e vengono scartate quando le
+        # normative indicizzate cambiano (generazione del vector store)
+        self.semantic_cache = SemanticCache(
+            self.vector_store.stores["nazionale"].embeddings,
+            cache_file=settings.cache_path / "semantic_cache.pkl",
+            ttl=settings.semantic_cache_ttl,
+            generation=lambda: self.vector_store.generation
+        )
+        
+        # Location estratte dalle query, per istanza (chiave: query normalizzata)
+        self._location_cache: LRUCache = LRUCache(maxsize=1024)
+        self._location_cache_lock = threading.Lock()
+        
+        # Esito "conforme" per i casi senza difformità
+        self._compliant_report_template = _TEMPLATES_ENV.get_template("compliant.md.j2")
+        
         logger.info("Urban Compliance Agent inizializzato")
     
     def analyze_property(
@@ -51,17 +111,13 @@ class UrbanComplianceAgent:
         """
         logger.info(f"Analisi immobile - {municipality}, {region}")
         
-        # 1. Recupera normative applicabili
-        logger.info("Recupero normative applicabili")
-        normative_context = self._get_applicable_normative(municipality, region)
-        
-        # 2. Analizza documenti
-        logger.info("Analisi documenti")
-        document_analysis = self.comparator.compare_all_documents(
-            planimetria_catastale=planimetria_catastale,
-            progetto_urbanistico=progetto_urbanistico,
-            foto_immobile=foto_immobile,
-            normative_context=normative_context
+        # 1-2. Recupero normative e analisi documenti
+        normative_context, document_analysis = self._collect_property_data(
+            municipality,
+            region,
+            planimetria_catastale,
+            progetto_urbanistico,
+            foto_immobile
         )
         
         # 3. Verifica conformità
@@ -96,34 +152,167 @@ class UrbanComplianceAgent:
         logger.success("Analisi immobile completata")
         return result
     
+    async def aanalyze_property(self, *args, **kwargs) -> Dict[str, Any]:
+        """
+        Variante asincrona di `analyze_property` per l'uso da endpoint async.
+        
+        L'analisi (bloccante) viene eseguita in un thread separato, senza
+        occupare l'event loop.
+        """
+        return await asyncio.to_thread(self.analyze_property, *args, **kwargs)
+    
+    def analyze_properties_batch(
+        self,
+        properties: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """
+        Analizza più immobili in blocco (job di backoffice, valutazioni massive).
+        
+        Normative e documenti vengono elaborati per immobile; le verifiche di
+        conformità sono inviate insieme con `LLMRouter.analyze_batch`, che usa
+        la Batch API OpenAI se `use_batch_api` è abilitato.
+        
+        Args:
+            properties: Lista di dizionari con i parametri di `analyze_property`
+            
+        Returns:
+            Analisi complete, nello stesso ordine di `properties`
+        """
+        logger.info(f"Analisi batch di {len(properties)} immobili")
+        properties = [{"region": "Lazio", **prop} for prop in properties]
+        
+        with ThreadPoolExecutor(max_workers=self._BATCH_WORKERS) as executor:
+            collected = list(executor.map(
+                lambda prop: self._collect_property_data(
+                    prop["municipality"],
+                    prop["region"],
+                    prop.get("planimetria_catastale"),
+                    prop.get("progetto_urbanistico"),
+                    prop.get("foto_immobile")
+                ),
+                properties
+            ))
+        
+        # I casi senza difformità hanno l'esito statico; al batch LLM solo gli altri
+        analyses: List[Optional[str]] = [None] * len(properties)
+        pending = []
+        for i, (prop, (normative_context, document_analysis)) in enumerate(zip(properties, collected)):
+            if self._is_clean_analysis(document_analysis):
+                analyses[i] = self._render_compliant(
+                    document_analysis,
+                    prop["municipality"],
+                    prop["region"]
+                )
+            else:
+                pending.append(i)
+        
+        requests = [
+            self._build_compliance_prompt(
+                collected[i][1],
+                collected[i][0],
+                properties[i]["municipality"],
+                properties[i]["region"],
+                properties[i].get("property_info")
+            )
+            for i in pending
+        ]
+        
+        if requests:
+            batch_analyses = self.router.analyze_batch(
+                [prompt for prompt, _ in requests],
+                TaskType.COMPLIANCE_CHECK,
+                system_message=PromptTemplates.get_system_message("urbanistica_expert"),
+                cached_contexts=[cached_context for _, cached_context in requests]
+            )
+            for i, analysis in zip(pending, batch_analyses):
+                analyses[i] = analysis
+        
+        def finalize(args):
+            prop, (normative_context, document_analysis), analysis = args
+            compliance_result = self._compliance_result(
+                analysis,
+                document_analysis,
+                prop["municipality"],
+                prop["region"]
+            )
+            return {
+                "municipality": prop["municipality"],
+                "region": prop["region"],
+                "normative_context": normative_context,
+                "document_analysis": document_analysis,
+                "compliance_result": compliance_result,
+                "report": self.report_generator.generate_report(
+                    compliance_result,
+                    document_analysis,
+                    normative_context,
+                    prop["municipality"],
+                    prop["region"]
+                )
+            }
+        
+        with ThreadPoolExecutor(max_workers=self._BATCH_WORKERS) as executor:
+            results = list(executor.map(finalize, zip(properties, collected, analyses)))
+        
+        logger.success(f"Analisi batch completata: {len(results)} immobili")
+        return results
+    
+    def _collect_property_data(
+        self,
+        municipality: str,
+        region: str,
+        planimetria_catastale: Optional[Path] = None,
+        progetto_urbanistico: Optional[Path] = None,
+        foto_immobile: Optional[List[Path]] = None
+    ) -> Tuple[str, Dict[str, Any]]:
+        """Recupera le normative applicabili e analizza documenti e difformità."""
+        # Recupero normative e analisi documenti sono indipendenti:
+        # eseguiti in parallelo, poi le difformità usano entrambi
+        logger.info("Recupero normative applicabili e analisi documenti")
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            normative_future = executor.submit(
+                self._get_applicable_normative,
+                municipality,
+                region
+            )
+            documents_future = executor.submit(
+                self.comparator.analyze_documents,
+                planimetria_catastale=planimetria_catastale,
+                progetto_urbanistico=progetto_urbanistico,
+                foto_immobile=foto_immobile
+            )
+            normative_context = normative_future.result()
+            document_analysis = documents_future.result()
+        
+        document_analysis = self.comparator.detect_difformita(
+            document_analysis,
+            normative_context
+        )
+        return normative_context, document_analysis
+    
     def _get_applicable_normative(
         self,
         municipality: str,
         region: str
     ) -> str:
         """Recupera normative applicabili."""
-        # Query per normative rilevanti
-        queries = [
-            "distanze minime dai confini",
-            "altezze massime edifici",
-            "indici urbanistici",
-            "destinazioni d'uso",
-            "regolamento edilizio"
-        ]
+        # Un solo encoding batch per tutte le query, ricerche in parallelo
+        results = self.retriever.retrieve_batch(
+            self._APPLICABLE_QUERIES,
+            municipality=municipality,
+            region=region,
+            top_k=3
+        )
         
-        all_normative = []
-        for query in queries:
-            docs = self.retriever.retrieve(
-                query,
-                municipality=municipality,
-                region=region,
-                top_k=3
-            )
-            all_normative.extend(docs)
+        # Rimuove i chunk ripetuti tra le query (meno token nel prompt e
+        # contesto stabile per il prompt caching)
+        all_normative = self.retriever.merge_results(
+            results,
+            max_docs=self._MAX_APPLICABLE_DOCS
+        )
         
         # Formatta contesto
         context = self.retriever.format_context(all_normative)
-        return context
+        return PromptTemplates.truncate_tokens(context, self._MAX_CONTEXT_TOKENS)
     
     def _verify_compliance(
         self,
@@ -134,27 +323,104 @@ class UrbanComplianceAgent:
         property_info: Optional[Dict[str, Any]]
     ) -> Dict[str, Any]:
         """Verifica conformità usando LLM."""
+        # Caso pulito: esito statico, senza chiamata LLM
+        if self._is_clean_analysis(document_analysis):
+            logger.info("Nessuna difformità rilevata: esito conforme da template")
+            return self._compliance_result(
+                self._render_compliant(document_analysis, municipality, region),
+                document_analysis,
+                municipality,
+                region
+            )
+        
+        prompt, cached_context = self._build_compliance_prompt(
+            document_analysis,
+            normative_context,
+            municipality,
+            region,
+            property_info
+        )
+        
+        # Analisi con LLM
+        compliance_analysis = self.router.analyze_with_best_model(
+            prompt,
+            TaskType.COMPLIANCE_CHECK,
+            system_message=PromptTemplates.get_system_message("urbanistica_expert"),
+            cached_context=cached_context
+        )
+        
+        return self._compliance_result(
+            compliance_analysis,
+            document_analysis,
+            municipality,
+            region
+        )
+    
+    @staticmethod
+    def _is_clean_analysis(document_analysis: Dict[str, Any]) -> bool:
+        """True se i documenti sono stati analizzati senza difformità né avvisi."""
+        documents_analyzed = any(
+            document_analysis.get(key)
+            for key in (
+                "planimetria_catastale_analysis",
+                "progetto_urbanistico_analysis",
+                "foto_analysis"
+            )
+        )
+        return (
+            documents_analyzed
+            and not document_analysis.get("difformita")
+            and not document_analysis.get("warnings")
+        )
+    
+    def _render_compliant(
+        self,
+        document_analysis: Dict[str, Any],
+        municipality: str,
+        region: str
+    ) -> str:
+        """Esito di conformità dal template statico."""
+        return self._compliant_report_template.render(
+            municipality=municipality,
+            region=region,
+            data=document_analysis
+        )
+    
+    def _build_compliance_prompt(
+        self,
+        document_analysis: Dict[str, Any],
+        normative_context: str,
+        municipality: str,
+        region: str,
+        property_info: Optional[Dict[str, Any]]
+    ) -> Tuple[str, str]:
+        """Costruisce prompt e contesto normativo (cacheable) per la verifica."""
         # Prepara dati per verifica
         property_data = property_info or {}
         
         # Usa prompt template
         prompt = PromptTemplates.format_prompt(
             PromptTemplates.COMPLIANCE_CHECK,
-            normative=normative_context,
             municipality=municipality,
             region=region,
             property_type=property_data.get("type", "Residenziale"),
-            property_info=str(property_data),
-            documents=str(document_analysis)
+            property_info=PromptTemplates.to_prompt_json(property_data),
+            documents=PromptTemplates.to_prompt_json(document_analysis)
         )
-        
-        # Analisi con LLM
-        compliance_analysis = self.router.analyze_with_best_model(
-            prompt,
-            TaskType.COMPLIANCE_CHECK,
-            system_message=PromptTemplates.get_system_message("urbanistica_expert")
+        cached_context = PromptTemplates.format_prompt(
+            PromptTemplates.NORMATIVE_CONTEXT,
+            context=normative_context
         )
-        
+        return prompt, cached_context
+    
+    @staticmethod
+    def _compliance_result(
+        compliance_analysis: str,
+        document_analysis: Dict[str, Any],
+        municipality: str,
+        region: str
+    ) -> Dict[str, Any]:
+        """Risultato strutturato della verifica di conformità."""
         return {
             "analysis": compliance_analysis,
             "difformita": document_analysis.get("difformita", []),
@@ -165,26 +431,53 @@ class UrbanComplianceAgent:
     def _extract_location_from_query(self, query: str) -> Dict[str, Optional[str]]:
         """
         Estrae regione e comune dalla query utente usando LLM.
+        I risultati sono in cache (LRU) per query normalizzate.
         """
+        # La forma normalizzata è solo la chiave di cache: al modello va la
+        # query originale, così i nomi restano con le maiuscole usate nei
+        # metadati (filtri esatti su comune e regione)
+        key = " ".join(query.split()).lower()
+        with self._location_cache_lock:
+            cached = self._location_cache.get(key)
+        if cached is not None:
+            return dict(cached)
+        
         try:
-            prompt = f"""Analizza la seguente domanda tecnica e estrai il Comune e la Regione se menzionati esplicitamente o implicitamente.
-            Domanda: {query}
-            
-            Rispondi ESCLUSIVAMENTE con un oggetto JSON valido nel seguente formato:
-            {{"municipality": "Nome Comune" | null, "region": "Nome Regione" | null}}
-            """
-            
-            # Usa il modello veloce per questa estrazione
-            response = self.router.gpt35.invoke(prompt)
-            content = response.content.replace("```json", "").replace("```", "").strip()
-            
-            data = json.loads(content)
-            logger.info(f"Location estratta dalla query: {data}")
-            return data
-            
+            location = self._extract_location_llm(query.strip())
         except Exception as e:
+            # Le eccezioni non vengono messe in cache
             logger.warning(f"Errore estrazione location da query: {e}")
             return {"municipality": None, "region": None}
+        
+        with self._location_cache_lock:
+            self._location_cache[key] = location
+        return dict(location)
+    
+    def _extract_location_llm(self, query: str) -> Dict[str, Optional[str]]:
+        """Estrazione location via LLM (le eccezioni non vengono messe in cache)."""
+        prompt = f"""Analizza la seguente domanda tecnica e estrai il Comune e la Regione se menzionati esplicitamente o implicitamente.
+        Domanda: {query}
+        
+        Rispondi ESCLUSIVAMENTE con un oggetto JSON valido nel seguente formato:
+        {{"municipality": "Nome Comune" | null, "region": "Nome Regione" | null}}
+        """
+        
+        # Usa il modello veloce per questa estrazione, vincolato a JSON
+        # (chiamata diretta: rispetta comunque il rate limit del router)
+        self.router.rate_limiter.acquire()
+        response = self.router.gpt35.invoke(
+            prompt,
+            response_format={"type": "json_object"}
+        )
+        
+        match = _JSON_RE.search(response.content)
+        if not match:
+            logger.warning("Nessun JSON nella risposta di estrazione location")
+            return {"municipality": None, "region": None}
+        
+        data = orjson.loads(match.group(0))
+        logger.info(f"Location estratta dalla query: {data}")
+        return data
 
     def ask_question(
         self,
@@ -203,8 +496,102 @@ class UrbanComplianceAgent:
         Returns:
             Risposta con citazioni normative
         """
+        answer, _ = self.ask_question_with_sources(question, municipality, region)
+        return answer
+    
+    def ask_question_with_sources(
+        self,
+        question: str,
+        municipality: Optional[str] = None,
+        region: Optional[str] = None
+    ) -> Tuple[str, List[Document]]:
+        """
+        Come `ask_question`, ma restituisce anche i documenti usati come contesto.
+        
+        I documenti sono restituiti al chiamante e non salvati sul retriever
+        condiviso, così richieste concorrenti non si scambiano le fonti.
+        
+        Args:
+            question: Domanda dell'utente
+            municipality: Comune (opzionale)
+            region: Regione (opzionale)
+            
+        Returns:
+            Tupla (risposta, documenti recuperati); lista vuota se la
+            risposta arriva dalla cache semantica
+        """
         logger.info(f"Domanda: {question}")
         
+        municipality, region = self._resolve_location(question, municipality, region)
+        
+        # Domande semanticamente equivalenti già risposte
+        cached_answer = self.semantic_cache.lookup(question, municipality, region)
+        if cached_answer is not None:
+            return cached_answer, []
+        
+        prompt, cached_context, docs = self._build_question_prompt(question, municipality, region)
+        
+        # 4. Genera risposta usando un modello analitico (Claude opzionale o GPT-4)
+        answer = self.router.analyze_with_best_model(
+            prompt,
+            TaskType.NORMATIVE_ANALYSIS,
+            system_message=PromptTemplates.get_system_message("urbanistica_expert"),
+            cached_context=cached_context
+        )
+        
+        self.semantic_cache.add(question, answer, municipality, region)
+        
+        logger.success("Risposta generata")
+        return answer, docs
+    
+    def ask_question_stream(
+        self,
+        question: str,
+        municipality: Optional[str] = None,
+        region: Optional[str] = None
+    ) -> Iterator[str]:
+        """
+        Come `ask_question`, ma restituisce la risposta in streaming.
+        
+        Args:
+            question: Domanda dell'utente
+            municipality: Comune (opzionale)
+            region: Regione (opzionale)
+            
+        Yields:
+            Chunk di testo della risposta
+        """
+        logger.info(f"Domanda (streaming): {question}")
+        
+        municipality, region = self._resolve_location(question, municipality, region)
+        
+        cached_answer = self.semantic_cache.lookup(question, municipality, region)
+        if cached_answer is not None:
+            yield cached_answer
+            return
+        
+        prompt, cached_context, _ = self._build_question_prompt(question, municipality, region)
+        
+        parts = []
+        for chunk in self.router.analyze_with_best_model_stream(
+            prompt,
+            TaskType.NORMATIVE_ANALYSIS,
+            system_message=PromptTemplates.get_system_message("urbanistica_expert"),
+            cached_context=cached_context
+        ):
+            parts.append(chunk)
+            yield chunk
+        
+        self.semantic_cache.add(question, "".join(parts), municipality, region)
+        logger.success("Risposta generata (streaming)")
+    
+    def _resolve_location(
+        self,
+        question: str,
+        municipality: Optional[str],
+        region: Optional[str]
+    ) -> Tuple[Optional[str], Optional[str]]:
+        """Se la location non è fornita, prova ad estrarla dalla query."""
         # 1. Se location non fornita, prova ad estrarla dalla query
         if not municipality and not region:
             extracted_loc = self._extract_location_from_query(question)
@@ -212,7 +599,15 @@ class UrbanComplianceAgent:
             region = extracted_loc.get("region")
             
         logger.info(f"Contesto location: Comune={municipality}, Regione={region}")
-        
+        return municipality, region
+    
+    def _build_question_prompt(
+        self,
+        question: str,
+        municipality: Optional[str],
+        region: Optional[str]
+    ) -> Tuple[str, str, List[Document]]:
+        """Recupera le normative e costruisce prompt, contesto cacheable e fonti."""
         # 2. Recupera normative rilevanti (Gerarchico: Naz -> Reg -> Prov -> Com)
         # Il retriever gestisce la logica gerarchica se chiamiamo retrieve senza specificare un livello forzato
         # ma passando i parametri di location
@@ -223,24 +618,21 @@ class UrbanComplianceAgent:
             top_k=6  # Aumentiamo il context window per avere più livelli
         )
         
-        context = self.retriever.format_context(docs)
+        context = PromptTemplates.truncate_tokens(
+            self.retriever.format_context(docs),
+            self._MAX_CONTEXT_TOKENS
+        )
         
         # 3. Usa prompt template per analisi comparativa
         prompt = PromptTemplates.format_prompt(
             PromptTemplates.COMPARATIVE_NORMATIVE_ANALYSIS,
-            context=context,
             question=question
         )
-        
-        # 4. Genera risposta usando un modello analitico (Claude opzionale o GPT-4)
-        answer = self.router.analyze_with_best_model(
-            prompt,
-            TaskType.NORMATIVE_ANALYSIS,
-            system_message=PromptTemplates.get_system_message("urbanistica_expert")
+        cached_context = PromptTemplates.format_prompt(
+            PromptTemplates.NORMATIVE_CONTEXT,
+            context=context
         )
-        
-        logger.success("Risposta generata")
-        return answer
+        return prompt, cached_context, docs
     
     def chat(self, message: str, context: Optional[Dict[str, Any]] = None) -> str:
         """
@@ -253,19 +645,48 @@ class UrbanComplianceAgent:
         Returns:
             Risposta dell'agente
         """
+        response, _ = self.chat_with_sources(message, context)
+        return response
+    
+    def chat_with_sources(
+        self,
+        message: str,
+        context: Optional[Dict[str, Any]] = None
+    ) -> Tuple[str, List[Document]]:
+        """
+        Come `chat`, ma restituisce anche le fonti normative usate.
+        
+        Args:
+            message: Messaggio utente
+            context: Contesto opzionale (comune, regione, ecc.)
+            
+        Returns:
+            Tupla (risposta dell'agente, documenti citati)
+        """
         logger.info(f"Chat message: {message}")
         
         # Normalizza context
         ctx = context or {}
         
         # Determina intent
-        if any(word in message.lower() for word in ["conforme", "conformità", "verifica", "analizza l'immobile"]):
+        if _INTENT_CONFORMITA_RE.search(message):
             # Intent: verifica conformità (richiede documenti)
             if ctx.get("documents"):
-                return "Per verificare la conformità, usa il metodo analyze_property con i documenti."
+                return "Per verificare la conformità, usa il metodo analyze_property con i documenti.", []
             else:
                 # Se l'utente chiede verifica ma è una domanda generale
-                return self.ask_question(message, ctx.get("municipality"), ctx.get("region"))
+                return self.ask_question_with_sources(message, ctx.get("municipality"), ctx.get("region"))
         else:
             # Intent: domanda normativa / analisi comparata
-            return self.ask_question(message, ctx.get("municipality"), ctx.get("region"))
+            return self.ask_question_with_sources(message, ctx.get("municipality"), ctx.get("region"))
+
+
+@lru_cache(maxsize=1)
+def get_agent() -> UrbanComplianceAgent:
+    """
+    Restituisce l'istanza condivisa dell'agente.
+
+    LLM, vector store e modelli vision vengono caricati una sola volta
+    per processo invece che a ogni istanziazione.
+    """
+    return UrbanComplianceAgent()
@@ -1,18 +1,21 @@
-from datetime import timedelta
 from typing import Annotated
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from backend.core.security import create_access_token, get_password_hash, verify_password
+from backend.core.security import averify_password, create_access_token
 from backend.config import get_settings
 from backend.models.user import Token, User, UserInDB
 
 router = APIRouter()
 
+# Hash bcrypt precalcolato della password di default "admin": evita di
+# eseguire i round bcrypt a ogni import (avvio di ogni worker, test).
+_ADMIN_HASH = "$2b$12$lbOkRv6Nj5a4Si0vHkPVJuwVE0nzAXvBrWN5a5WPNqMOqu6HoRet6"
+
 # Mock DB - sostituire con vero DB
 users_db = {
     "admin": {
         "username": "admin",
-        "hashed_password": get_password_hash("admin"), # Default pwd: admin
+        "hashed_password": _ADMIN_HASH, # Default pwd: admin
         "disabled": False
     }
 }
@@ -20,7 +23,7 @@ users_db = {
 def get_user(db, username: str):
     if username in db:
         user_dict = db[username]
-        return UserInDB(**user_dict)
+        return UserInDB.model_construct(**user_dict)
 
 @router.post("/token", response_model=Token)
 async def login_for_access_token(
@@ -33,7 +36,8 @@ async def login_for_access_token(
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    if not verify_password(form_data.password, user.hashed_password):
+    # bcrypt è volutamente lento (~100ms+): verifica fuori dall'event loop
+    if not await averify_password(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -41,9 +45,9 @@ async def login_for_access_token(
         )
     
     settings = get_settings()
-    access_token_expires = timedelta(minutes=settings.access_token_expire_minutes)
     access_token = create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
+        data={"sub": user.username},
+        expires_seconds=settings.access_token_expire_minutes * 60
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
@@ -0,0 +1,101 @@
+"""
+Micro-batching degli embedding delle query per le ricerche concorrenti.
+"""
+import asyncio
+from typing import Callable, List, Optional, Tuple
+
+from loguru import logger
+
+
+class QueryEmbeddingBatcher:
+    """
+    Raggruppa le query che arrivano insieme in un unico forward pass.
+
+    Ogni richiesta accoda la propria query e attende il risultato; un task in
+    background raccoglie le query arrivate entro `max_wait` secondi (fino a
+    `max_batch`), le ordina per lunghezza (padding minimo nel batch) e le
+    codifica con una sola chiamata al modello, fuori dall'event loop.
+    """
+
+    def __init__(
+        self,
+        embed_fn: Callable[[List[str]], List[List[float]]],
+        max_batch: int = 32,
+        max_wait: float = 0.01
+    ):
+        """
+        Inizializza il batcher.
+
+        Args:
+            embed_fn: Funzione bloccante che codifica una lista di query
+            max_batch: Numero massimo di query per forward pass
+            max_wait: Finestra di raccolta delle query (secondi)
+        """
+        self._embed_fn = embed_fn
+        self._max_batch = max_batch
+        self._max_wait = max_wait
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+    async def embed(self, query: str) -> List[float]:
+        """
+        Calcola l'embedding di una query, insieme a quelle concorrenti.
+
+        Args:
+            query: Query da codificare
+
+        Returns:
+            Embedding della query
+        """
+        # Coda e worker creati nell'event loop in esecuzione (uno per worker uvicorn)
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((query, future))
+        return await future
+
+    async def _collect(self) -> List[Tuple[str, asyncio.Future]]:
+        """Attende la prima query e raccoglie le successive entro la finestra."""
+        loop = asyncio.get_running_loop()
+        items = [await self._queue.get()]
+        deadline = loop.time() + self._max_wait
+
+        while len(items) < self._max_batch:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                items.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return items
+
+    async def _run(self):
+        """Loop del worker: un forward pass per ogni gruppo di query raccolte."""
+        while True:
+            items = await self._collect()
+
+            # Ordine per lunghezza: query simili nello stesso batch
+            order = sorted(range(len(items)), key=lambda i: len(items[i][0]))
+
+            try:
+                embeddings = await asyncio.to_thread(
+                    self._embed_fn, [items[i][0] for i in order]
+                )
+            except Exception as e:
+                logger.error(f"Errore nell'encoding batch delle query: {e}")
+                for _, future in items:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            if len(items) > 1:
+                logger.debug(f"Encoding batch di {len(items)} query")
+
+            for i, embedding in zip(order, embeddings):
+                future = items[i][1]
+                if not future.done():
+                    future.set_result(embedding)
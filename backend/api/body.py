@@ -0,0 +1,68 @@
+"""
+Parsing dei body JSON delle richieste direttamente dai byte.
+"""
+from typing import Any, Callable, Dict, Type, TypeVar
+
+from fastapi import Request
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, ValidationError
+
+
+M = TypeVar("M", bound=BaseModel)
+
+
+def json_body(model: Type[M]) -> Callable:
+    """
+    Dipendenza che valida il body JSON con `model_validate_json`.
+    
+    Pydantic decodifica e valida i byte in un solo passaggio (in Rust),
+    senza il `json.loads` intermedio di FastAPI né il dict Python che ne
+    deriva. Gli errori producono lo stesso 422 della validazione standard.
+    
+    Args:
+        model: Modello Pydantic della richiesta
+        
+    Returns:
+        Dipendenza da usare con `Depends`
+    """
+    async def parse(request: Request) -> M:
+        try:
+            return model.model_validate_json(await request.body())
+        except ValidationError as e:
+            raise RequestValidationError(
+                [{**error, "loc": ("body", *error["loc"])} for error in e.errors()]
+            )
+    
+    return parse
+
+
+def json_body_openapi(model: Type[BaseModel]) -> Dict[str, Any]:
+    """
+    `openapi_extra` che documenta il body di una route che usa `json_body`.
+    
+    Args:
+        model: Modello Pydantic della richiesta
+        
+    Returns:
+        Definizione OpenAPI del request body
+    """
+    schema = model.model_json_schema()
+    defs = schema.pop("$defs", {})
+    return {
+        "requestBody": {
+            "required": True,
+            "content": {"application/json": {"schema": _inline_refs(schema, defs)}}
+        }
+    }
+
+
+def _inline_refs(node: Any, defs: Dict[str, Any]) -> Any:
+    """Sostituisce i riferimenti locali `#/$defs/...` con lo schema referenziato."""
+    if isinstance(node, dict):
+        ref = node.get("$ref", "")
+        if ref.startswith("#/$defs/"):
+            return _inline_refs(defs[ref.rsplit("/", 1)[-1]], defs)
+        return {key: _inline_refs(value, defs) for key, value in node.items()}
+    if isinstance(node, list):
+        return [_inline_refs(value, defs) for value in node]
+    return node
@@ -1,7 +1,11 @@
+import threading
+import time
+from functools import lru_cache
 from typing import Annotated
+from cachetools import TTLCache
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
+import jwt
 from backend.config import get_settings
 from backend.models.user import TokenData, User
 
@@ -17,34 +21,71 @@ users_db = {
     }
 }
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
+# Token già verificati: token -> (username, exp). Evita di ripetere la
+# verifica della firma per richieste ripetute entro il TTL.
+# Le dipendenze sono sincrone (eseguite nel threadpool): accesso sotto lock.
+_token_cache = TTLCache(maxsize=10_000, ttl=60)
+_token_cache_lock = threading.Lock()
+
+def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
     settings = get_settings()
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
-        username: str = payload.get("sub")
-        if username is None:
+    with _token_cache_lock:
+        cached = _token_cache.get(token)
+    if cached is not None and (cached[1] is None or cached[1] > time.time()):
+        token_data = TokenData.model_construct(username=cached[0])
+    else:
+        try:
+            payload = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+            username: str = payload.get("sub")
+            if username is None:
+                raise credentials_exception
+            token_data = TokenData.model_construct(username=username)
+        except jwt.PyJWTError:
             raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
+        with _token_cache_lock:
+            _token_cache[token] = (username, payload.get("exp"))
     
     user_dict = users_db.get(token_data.username)
     if user_dict is None:
         raise credentials_exception
         
-    user = User(**user_dict)
+    # Dati interni e già validi: nessuna validazione Pydantic
+    user = User.model_construct(**user_dict)
     if user.disabled:
         raise HTTPException(status_code=400, detail="Inactive user")
     return user
 
-async def get_current_active_user(
+def get_current_active_user(
     current_user: Annotated[User, Depends(get_current_user)]
 ):
     if current_user.disabled:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
+
+
+def get_agent():
+    """
+    Agente condiviso da tutte le route (singleton di processo).
+    
+    Import differito: l'agente carica LLM, vector store e modelli vision,
+    quindi l'avvio dell'app (e /health) non ne paga il costo.
+    """
+    from backend.agents.urban_compliance_agent import get_agent as _get_agent
+    return _get_agent()
+
+
+@lru_cache()
+def get_vector_store():
+    """
+    Vector store condiviso dalle route di ricerca e ingestion.
+    
+    Import differito: embeddings e collection Chroma vengono caricati alla
+    prima richiesta che li usa, non all'avvio dei worker.
+    """
+    from backend.rag.vector_store import MultiLevelVectorStore
+    return MultiLevelVectorStore()
@@ -3,9 +3,12 @@ FastAPI application principale.
 """
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from loguru import logger
+import anyio
 import sys
 
+from backend.api.responses import AppJSONResponse
 from backend.config import get_settings
 
 # Configura logging
@@ -42,7 +45,8 @@ def setup_logging():
 app = FastAPI(
     title="Urbanistica AI Agent API",
     description="API Gateway for Urban Compliance Agent",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=AppJSONResponse
 )
 
 # CORS Configuration
@@ -56,10 +60,15 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
+    # Solo metodi e header usati dal frontend (niente wildcard da espandere)
+    allow_methods=["GET", "POST"],
+    allow_headers=["authorization", "content-type"],
 )
 
+# Compressione delle risposte JSON grandi (report, fonti); gli stream SSE
+# (text/event-stream) sono esclusi da Starlette
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 
 @app.on_event("startup")
 async def startup_event():
@@ -68,11 +77,18 @@ async def startup_event():
     logger.info("🚀 Avvio Urbanistica AI Agent API")
     settings = get_settings()
     logger.info(f"Ambiente: {settings.log_level}")
+    
+    # Le chiamate LLM occupano un thread per secondi: più thread del default (40)
+    anyio.to_thread.current_default_thread_limiter().total_tokens = 64
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Cleanup allo shutdown."""
+    from backend.models.prompt_templates import PromptTemplates
+    from backend.models.llm_router import aclose_http_clients
+    logger.info(f"Cache prompt: {PromptTemplates.cache_info()}")
+    await aclose_http_clients()
     logger.info("👋 Shutdown Urbanistica AI Agent API")
 
 
@@ -106,9 +122,13 @@ app.include_router(normative.router, prefix="/api/normative", tags=["normative"]
 
 if __name__ == "__main__":
     import uvicorn
+    settings = get_settings()
+    # uvloop + httptools (requirements): event loop e parser HTTP in C
     uvicorn.run(
         "backend.api.main:app",
         host=settings.api_host,
         port=settings.api_port,
-        reload=True
+        loop="uvloop",
+        http="httptools",
+        reload=settings.api_reload
     )
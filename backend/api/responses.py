@@ -0,0 +1,33 @@
+"""
+Risposte JSON serializzate con orjson.
+"""
+from pathlib import PurePath
+from typing import Any
+
+import orjson
+from fastapi.responses import ORJSONResponse
+
+
+def _json_default(obj: Any) -> Any:
+    """Serializzazione dei tipi non supportati nativamente da orjson."""
+    if isinstance(obj, PurePath):
+        return str(obj)
+    if isinstance(obj, (set, frozenset)):
+        return list(obj)
+    raise TypeError(f"Tipo non serializzabile in JSON: {type(obj).__name__}")
+
+
+class AppJSONResponse(ORJSONResponse):
+    """
+    Risposta JSON di default dell'app.
+    
+    Come `ORJSONResponse`, ma serializza anche Path e set (es. i path dei
+    documenti caricati nei risultati delle analisi).
+    """
+    
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(
+            content,
+            default=_json_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        )
@@ -1,31 +1,50 @@
 """
 Routes per analisi immobili.
 """
-from fastapi import APIRouter, UploadFile, File, Form, HTTPException
-from typing import List, Optional
-from pathlib import Path
+from fastapi import APIRouter, Depends, UploadFile, File, Form, HTTPException
+from typing import Any, Dict, List, Optional
+from dataclasses import dataclass, field
+import asyncio
 import uuid
+import aiofiles.os
+from cachetools import TTLCache
 from loguru import logger
 
-from backend.agents.urban_compliance_agent import UrbanComplianceAgent
+from backend.api.body import json_body, json_body_openapi
+from backend.api.deps import get_agent
 from backend.api.models.schemas import AnalysisRequest, AnalysisResponse
+from backend.api.responses import AppJSONResponse
+from backend.api.streaming import sse_response
+from backend.api.uploads import save_upload
 from backend.config import get_settings
 
 router = APIRouter()
 
-from functools import lru_cache
-from fastapi import Depends
 
-@lru_cache()
-def get_agent():
-    return UrbanComplianceAgent()
+@dataclass(slots=True)
+class AnalysisRecord:
+    """Stato di un'analisi in corso o completata."""
+    id: str
+    municipality: str
+    region: str
+    status: str = "created"
+    documents: Dict[str, Any] = field(default_factory=dict)
+    result: Optional[Dict[str, Any]] = None
+    error: Optional[str] = None
 
-# Storage analisi in corso
-analyses = {}
 
+# Storage analisi: limitato e con scadenza (24h) per non crescere indefinitamente
+analyses: TTLCache = TTLCache(maxsize=10_000, ttl=86_400)
+# Serializza le transizioni di stato (es. due /run concorrenti)
+_analyses_lock = asyncio.Lock()
 
-@router.post("/new", response_model=AnalysisResponse)
-async def create_analysis(request: AnalysisRequest):
+
+@router.post(
+    "/new",
+    responses={200: {"model": AnalysisResponse}},
+    openapi_extra=json_body_openapi(AnalysisRequest)
+)
+async def create_analysis(request: AnalysisRequest = Depends(json_body(AnalysisRequest))):
     """
     Crea una nuova analisi di conformità.
     
@@ -41,20 +60,19 @@ async def create_analysis(request: AnalysisRequest):
     analysis_id = str(uuid.uuid4())
     
     # Salva in storage
-    analyses[analysis_id] = {
-        "id": analysis_id,
-        "municipality": request.municipality,
-        "region": request.region,
-        "status": "created",
-        "documents": {},
-        "result": None
-    }
+    async with _analyses_lock:
+        analyses[analysis_id] = AnalysisRecord(
+            id=analysis_id,
+            municipality=request.municipality,
+            region=request.region
+        )
     
-    return AnalysisResponse(
-        analysis_id=analysis_id,
-        status="created",
-        message="Analisi creata. Carica i documenti per procedere."
-    )
+    # Payload generato dal server: nessuna validazione in uscita
+    return AppJSONResponse({
+        "analysis_id": analysis_id,
+        "status": "created",
+        "message": "Analisi creata. Carica i documenti per procedere."
+    })
 
 
 @router.post("/{analysis_id}/upload")
@@ -76,7 +94,8 @@ async def upload_documents(
     Returns:
         Stato upload
     """
-    if analysis_id not in analyses:
+    analysis = analyses.get(analysis_id)
+    if analysis is None:
         raise HTTPException(status_code=404, detail="Analisi non trovata")
     
     logger.info(f"Upload documenti per analisi {analysis_id}")
@@ -84,43 +103,38 @@ async def upload_documents(
     # Directory upload per questa analisi
     settings = get_settings()
     upload_dir = settings.upload_path / analysis_id
-    upload_dir.mkdir(parents=True, exist_ok=True)
+    await aiofiles.os.makedirs(upload_dir, exist_ok=True)
     
     uploaded_files = {}
     
     # Salva planimetria catastale
     if planimetria_catastale:
         plan_path = upload_dir / f"planimetria_catastale_{planimetria_catastale.filename}"
-        with plan_path.open("wb") as f:
-            content = await planimetria_catastale.read()
-            f.write(content)
-        uploaded_files["planimetria_catastale"] = str(plan_path)
+        await save_upload(planimetria_catastale, plan_path)
+        uploaded_files["planimetria_catastale"] = plan_path
         logger.info(f"Salvata planimetria: {plan_path}")
     
     # Salva progetto
     if progetto_urbanistico:
         prog_path = upload_dir / f"progetto_{progetto_urbanistico.filename}"
-        with prog_path.open("wb") as f:
-            content = await progetto_urbanistico.read()
-            f.write(content)
-        uploaded_files["progetto_urbanistico"] = str(prog_path)
+        await save_upload(progetto_urbanistico, prog_path)
+        uploaded_files["progetto_urbanistico"] = prog_path
         logger.info(f"Salvato progetto: {prog_path}")
     
     # Salva foto
     if foto_immobile:
-        foto_paths = []
-        for i, foto in enumerate(foto_immobile):
-            foto_path = upload_dir / f"foto_{i}_{foto.filename}"
-            with foto_path.open("wb") as f:
-                content = await foto.read()
-                f.write(content)
-            foto_paths.append(str(foto_path))
+        # Salvataggi indipendenti: eseguiti in parallelo
+        foto_paths = await asyncio.gather(*[
+            save_upload(foto, upload_dir / f"foto_{i}_{foto.filename}")
+            for i, foto in enumerate(foto_immobile)
+        ])
         uploaded_files["foto_immobile"] = foto_paths
         logger.info(f"Salvate {len(foto_paths)} foto")
     
     # Aggiorna analisi
-    analyses[analysis_id]["documents"] = uploaded_files
-    analyses[analysis_id]["status"] = "documents_uploaded"
+    async with _analyses_lock:
+        analysis.documents = uploaded_files
+        analysis.status = "documents_uploaded"
     
     return {
         "analysis_id": analysis_id,
@@ -132,7 +146,7 @@ async def upload_documents(
 @router.post("/{analysis_id}/run")
 async def run_analysis(
     analysis_id: str,
-    agent: UrbanComplianceAgent = Depends(get_agent)
+    agent=Depends(get_agent)
 ):
     """
     Esegue l'analisi.
@@ -143,41 +157,38 @@ async def run_analysis(
     Returns:
         Risultati analisi
     """
-    if analysis_id not in analyses:
+    analysis_data = analyses.get(analysis_id)
+    if analysis_data is None:
         raise HTTPException(status_code=404, detail="Analisi non trovata")
     
-    analysis_data = analyses[analysis_id]
-    
-    if analysis_data["status"] != "documents_uploaded":
-        raise HTTPException(
-            status_code=400,
-            detail="Documenti non ancora caricati"
-        )
+    async with _analyses_lock:
+        if analysis_data.status != "documents_uploaded":
+            raise HTTPException(
+                status_code=400,
+                detail="Documenti non ancora caricati"
+            )
+        
+        # Aggiorna stato
+        analysis_data.status = "running"
     
     logger.info(f"Esecuzione analisi {analysis_id}")
     
-    # Aggiorna stato
-    analyses[analysis_id]["status"] = "running"
-    
     try:
-        # Prepara path documenti
-        docs = analysis_data["documents"]
-        planimetria = Path(docs["planimetria_catastale"]) if "planimetria_catastale" in docs else None
-        progetto = Path(docs["progetto_urbanistico"]) if "progetto_urbanistico" in docs else None
-        foto = [Path(f) for f in docs.get("foto_immobile", [])]
+        # Path dei documenti (salvati come Path all'upload)
+        docs = analysis_data.documents
         
         # Esegui analisi
-        result = agent.analyze_property(
-            municipality=analysis_data["municipality"],
-            region=analysis_data["region"],
-            planimetria_catastale=planimetria,
-            progetto_urbanistico=progetto,
-            foto_immobile=foto if foto else None
+        result = await agent.aanalyze_property(
+            municipality=analysis_data.municipality,
+            region=analysis_data.region,
+            planimetria_catastale=docs.get("planimetria_catastale"),
+            progetto_urbanistico=docs.get("progetto_urbanistico"),
+            foto_immobile=docs.get("foto_immobile") or None
         )
         
         # Salva risultato
-        analyses[analysis_id]["result"] = result
-        analyses[analysis_id]["status"] = "completed"
+        analysis_data.result = result
+        analysis_data.status = "completed"
         
         logger.success(f"Analisi {analysis_id} completata")
         
@@ -189,8 +200,8 @@ async def run_analysis(
         
     except Exception as e:
         logger.error(f"Errore nell'analisi {analysis_id}: {e}")
-        analyses[analysis_id]["status"] = "error"
-        analyses[analysis_id]["error"] = str(e)
+        analysis_data.status = "error"
+        analysis_data.error = str(e)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -205,17 +216,16 @@ async def get_analysis_status(analysis_id: str):
     Returns:
         Stato analisi
     """
-    if analysis_id not in analyses:
+    analysis = analyses.get(analysis_id)
+    if analysis is None:
         raise HTTPException(status_code=404, detail="Analisi non trovata")
     
-    analysis = analyses[analysis_id]
-    
-    return {
+    return AppJSONResponse({
         "analysis_id": analysis_id,
-        "status": analysis["status"],
-        "municipality": analysis["municipality"],
-        "region": analysis["region"]
-    }
+        "status": analysis.status,
+        "municipality": analysis.municipality,
+        "region": analysis.region
+    })
 
 
 @router.get("/{analysis_id}/report")
@@ -229,15 +239,59 @@ async def get_analysis_report(analysis_id: str):
     Returns:
         Report completo
     """
-    if analysis_id not in analyses:
+    analysis = analyses.get(analysis_id)
+    if analysis is None:
         raise HTTPException(status_code=404, detail="Analisi non trovata")
     
-    analysis = analyses[analysis_id]
+    if analysis.status != "completed":
+        raise HTTPException(
+            status_code=400,
+            detail=f"Analisi non completata (stato: {analysis.status})"
+        )
+    
+    # Report grande e già serializzabile: niente jsonable_encoder
+    return AppJSONResponse(analysis.result["report"])
+
+
+@router.get("/{analysis_id}/report/stream")
+async def stream_analysis_report(
+    analysis_id: str,
+    output_format: str = "markdown",
+    agent=Depends(get_agent)
+):
+    """
+    Rigenera il report di un'analisi completata in streaming (Server-Sent Events).
+    
+    Args:
+        analysis_id: ID analisi
+        output_format: Formato del report salvato a fine stream (markdown, html)
+        
+    Returns:
+        Stream dei chunk markdown del report
+    """
+    analysis = analyses.get(analysis_id)
+    if analysis is None:
+        raise HTTPException(status_code=404, detail="Analisi non trovata")
     
-    if analysis["status"] != "completed":
+    if analysis.status != "completed":
         raise HTTPException(
             status_code=400,
-            detail=f"Analisi non completata (stato: {analysis['status']})"
+            detail=f"Analisi non completata (stato: {analysis.status})"
         )
     
-    return analysis["result"]["report"]
+    result = analysis.result
+    
+    def _save_report(report):
+        # Aggiorna il report salvato con la versione appena generata
+        result["report"] = report
+    
+    return sse_response(agent.report_generator.generate_report(
+        result["compliance_result"],
+        result["document_analysis"],
+        result["normative_context"],
+        result["municipality"],
+        result["region"],
+        output_format=output_format,
+        stream=True,
+        on_complete=_save_report
+    ))
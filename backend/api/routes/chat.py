@@ -1,23 +1,17 @@
 from fastapi import APIRouter, HTTPException, Depends
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from typing import List, Optional, Dict, Any
 from loguru import logger
 
-from backend.api.deps import get_current_active_user
+from backend.api.body import json_body, json_body_openapi
+from backend.api.deps import get_agent, get_current_active_user
+from backend.api.responses import AppJSONResponse
+from backend.api.streaming import sse_response
 from backend.models.user import User
-from backend.rag.retriever import NormativeRetriever
-from backend.rag.vector_store import MultiLevelVectorStore
-from backend.models.llm_router import LLMRouter, TaskType
-from backend.config import PROMPT_TEMPLATES
-
-from backend.agents.urban_compliance_agent import UrbanComplianceAgent
-from functools import lru_cache
 
 router = APIRouter()
 
-@lru_cache()
-def get_agent():
-    return UrbanComplianceAgent()
 
 class ChatMessage(BaseModel):
     role: str # "user" or "assistant"
@@ -34,11 +28,30 @@ class ChatResponse(BaseModel):
     response: str
     sources: List[Dict[str, Any]] = []
 
-@router.post("/message", response_model=ChatResponse)
+def _source_entry(metadata: Dict[str, Any], content: str) -> Dict[str, Any]:
+    """Fonte normativa citata nella risposta (metadati letti una sola volta)."""
+    get = metadata.get
+    return {
+        "filename": get("filename", "Sconosciuto"),
+        "page": get("page", 0),
+        "normative_level": get("normative_level", "Generico"),
+        "content_preview": content[:200] + "..."
+    }
+
+
+# Body validato direttamente dai byte (la history cresce a ogni messaggio)
+_parse_chat_request = json_body(ChatRequest)
+
+
+@router.post(
+    "/message",
+    responses={200: {"model": ChatResponse}},
+    openapi_extra=json_body_openapi(ChatRequest)
+)
 async def chat_message(
-    request: ChatRequest,
+    request: ChatRequest = Depends(_parse_chat_request),
     current_user: User = Depends(get_current_active_user),
-    agent: UrbanComplianceAgent = Depends(get_agent)
+    agent=Depends(get_agent)
 ):
     """
     Endpoint per chat con assistente urbanistico.
@@ -47,8 +60,12 @@ async def chat_message(
     
     try:
         # Usa l'agente per gestire la richiesta
-        # L'agente gestisce internamente retrieval, location extraction e prompt comparativo
-        response_text = agent.chat(
+        # L'agente gestisce internamente retrieval, location extraction e prompt comparativo.
+        # Chiamata bloccante (LLM, RAG): eseguita nel threadpool, non nell'event loop
+        # Le fonti sono restituite insieme alla risposta: nessuno stato
+        # condiviso letto dopo la chiamata (richieste concorrenti)
+        response_text, docs = await run_in_threadpool(
+            agent.chat_with_sources,
             request.message,
             context={
                 "municipality": request.municipality,
@@ -57,26 +74,36 @@ async def chat_message(
             }
         )
         
-        # Recupera le fonti usate dall'ultima query del retriever dell'agente
-        # Nota: Idealmente l'agente dovrebbe restituire anche le fonti. 
-        # Per ora recuperiamo dal retriever dell'agente (l'ultima query)
-        # TODO: Refactor agente per restituire oggetto strutturato con fonti
-        sources = []
-        # Questo è un accesso "sporco" allo stato, ma per ora funzionale
-        if hasattr(agent, 'retriever') and hasattr(agent.retriever, 'last_retrieved_docs'):
-             for doc in agent.retriever.last_retrieved_docs:
-                sources.append({
-                    "filename": doc.metadata.get("filename", "Sconosciuto"),
-                    "page": doc.metadata.get("page", 0),
-                    "normative_level": doc.metadata.get("normative_level", "Generico"),
-                    "content_preview": doc.page_content[:200] + "..."
-                })
+        sources = [
+            _source_entry(doc.metadata, doc.page_content)
+            for doc in docs
+        ]
                 
     except Exception as e:
         logger.error(f"Errore chat: {e}")
         raise HTTPException(status_code=500, detail=str(e))
         
-    return ChatResponse(
-        response=response_text,
-        sources=sources
+    return AppJSONResponse({
+        "response": response_text,
+        "sources": sources
+    })
+
+
+@router.post("/message/stream", openapi_extra=json_body_openapi(ChatRequest))
+async def chat_message_stream(
+    request: ChatRequest = Depends(_parse_chat_request),
+    current_user: User = Depends(get_current_active_user),
+    agent=Depends(get_agent)
+):
+    """
+    Come `/message`, ma restituisce la risposta in streaming (Server-Sent Events).
+    """
+    logger.info(f"Chat stream request da {current_user.username}: {request.message}")
+    
+    return sse_response(
+        agent.ask_question_stream(
+            request.message,
+            municipality=request.municipality,
+            region=request.region
+        )
     )
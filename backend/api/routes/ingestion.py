@@ -1,39 +1,45 @@
+from functools import lru_cache
+import os
+import aiofiles.os
 from typing import List, Optional
 from fastapi import APIRouter, UploadFile, File, Form, Depends, HTTPException, status
-from pathlib import Path
-import shutil
 from loguru import logger
 
-from backend.api.deps import get_current_active_user
+from backend.api.deps import get_current_active_user, get_vector_store
+from backend.api.responses import AppJSONResponse
+from backend.api.routes.normative import invalidate_search_cache
+from backend.api.uploads import save_upload
 from backend.models.user import User
-from backend.rag.document_processor import NormativeDocumentProcessor
-from backend.rag.vector_store import MultiLevelVectorStore
 from backend.config import get_settings
 
 router = APIRouter()
 
-# Assicurati che la directory di upload esista
-UPLOAD_DIR = Path("data/uploads")
-UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
+
+@lru_cache()
+def get_processor():
+    """Processor dei documenti normativi condiviso tra le richieste."""
+    # Import differito: parser PDF/HTML caricati solo al primo upload
+    from backend.rag.document_processor import NormativeDocumentProcessor
+    return NormativeDocumentProcessor()
+
 
 @router.get("/files")
 async def list_files(current_user: User = Depends(get_current_active_user)):
     """Lista i file caricati."""
-    settings = get_settings() # Get settings inside the function
-    upload_dir = Path(settings.upload_path) # Use settings for upload_dir
-    upload_dir.mkdir(parents=True, exist_ok=True) # Ensure directory exists
+    # Directory creata all'avvio (get_settings)
+    upload_dir = get_settings().upload_path
     
-    files = []
-    if upload_dir.exists(): # Use upload_dir
-        # Ordina per data di modifica (più recenti prima)
-        paths = sorted(upload_dir.glob("*.pdf"), key=lambda f: f.stat().st_mtime, reverse=True)
-        for p in paths:
-            files.append({
-                "name": p.name,
-                "size": p.stat().st_size,
-                "date": p.stat().st_mtime
-            })
-    return files
+    # Una sola stat per file (scandir), riusata per ordinamento e risposta
+    with os.scandir(upload_dir) as it:
+        entries = [(entry.name, entry.stat()) for entry in it if entry.name.endswith(".pdf")]
+    
+    # Ordina per data di modifica (più recenti prima)
+    entries.sort(key=lambda item: item[1].st_mtime, reverse=True)
+    files = [
+        {"name": name, "size": stat.st_size, "date": stat.st_mtime}
+        for name, stat in entries
+    ]
+    return AppJSONResponse(files)
 
 @router.post("/upload")
 async def upload_files(
@@ -42,25 +48,24 @@ async def upload_files(
     region: Optional[str] = Form(None),
     province: Optional[str] = Form(None),
     municipality: Optional[str] = Form(None),
-    current_user: User = Depends(get_current_active_user)
+    current_user: User = Depends(get_current_active_user),
+    processor=Depends(get_processor),
+    vector_store=Depends(get_vector_store)
 ):
     """
     Carica file normativi (PDF, HTML, TXT) e li indicizza.
     """
-    settings = get_settings() # Get settings inside the function
-    temp_upload_dir = Path(settings.temp_upload_path) # Use settings for temp_upload_path
-    temp_upload_dir.mkdir(exist_ok=True) # Ensure temp directory exists
+    # Directory creata all'avvio (get_settings)
+    temp_upload_dir = get_settings().temp_upload_path
     
     results = []
     
     for file in files:
         # Salva file temporaneamente
-        temp_path = Path("temp_uploads") / file.filename
-        temp_path.parent.mkdir(exist_ok=True)
+        temp_path = temp_upload_dir / file.filename
         
         try:
-            with temp_path.open("wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            await save_upload(file, temp_path)
             
             # Determina store level
             store_level = "nazionale"
@@ -70,7 +75,6 @@ async def upload_files(
                 store_level = "comunale"
             
             # Processa e indicizza
-            processor = NormativeDocumentProcessor()
             processed_chunks = processor.process_normative_file(
                 temp_path,
                 normative_level,
@@ -80,7 +84,6 @@ async def upload_files(
             )
             
             # Inserisci nel vector store appropriato
-            vector_store = MultiLevelVectorStore()
             ids = vector_store.add_documents(processed_chunks, store_level)
             
             results.append({
@@ -98,7 +101,14 @@ async def upload_files(
                 "message": str(e)
             })
         finally:
-            if temp_path.exists():
-                temp_path.unlink()
+            # Una sola syscall, fuori dall'event loop
+            try:
+                await aiofiles.os.remove(temp_path)
+            except FileNotFoundError:
+                pass
+    
+    # Nuovi documenti indicizzati: i risultati di ricerca in cache sono superati
+    if any(r["status"] == "success" for r in results):
+        invalidate_search_cache()
     
     return {"results": results}
@@ -1,12 +1,18 @@
 """
 Routes per normative.
 """
+import asyncio
+import hashlib
+import threading
 from fastapi import APIRouter, HTTPException, Query
 from typing import Optional
+from cachetools import TTLCache
 from loguru import logger
+from starlette.concurrency import run_in_threadpool
 
-from backend.rag.vector_store import MultiLevelVectorStore
-from backend.rag.retriever import NormativeRetriever
+from backend.api.batching import QueryEmbeddingBatcher
+from backend.api.deps import get_vector_store
+from backend.api.responses import AppJSONResponse
 
 router = APIRouter()
 
@@ -15,12 +21,35 @@ from functools import lru_cache
 from fastapi import Depends
 
 @lru_cache()
-def get_vector_store():
-    return MultiLevelVectorStore()
+def get_retriever(vector_store=Depends(get_vector_store)):
+    # Import differito: il retriever porta con sé i client LLM per il rerank
+    from backend.rag.retriever import NormativeRetriever
+    return NormativeRetriever(vector_store)
+
 
 @lru_cache()
-def get_retriever(vector_store: MultiLevelVectorStore = Depends(get_vector_store)):
-    return NormativeRetriever(vector_store)
+def get_embedding_batcher(vector_store=Depends(get_vector_store)):
+    # Ricerche concorrenti: un solo forward pass per le query in arrivo insieme
+    return QueryEmbeddingBatcher(vector_store.embed_queries)
+
+
+# Cache delle ricerche: le stesse query (comune + tema) si ripetono spesso,
+# una hit evita embedding e ricerca vettoriale
+_search_cache = TTLCache(maxsize=2000, ttl=300)
+_search_cache_lock = threading.RLock()
+
+
+def _search_cache_key(*parts: Optional[str | int]) -> bytes:
+    """Chiave compatta (digest a 16 byte) dei parametri di ricerca."""
+    return hashlib.blake2b(
+        "|".join(map(str, parts)).encode(), digest_size=16
+    ).digest()
+
+
+def invalidate_search_cache() -> None:
+    """Svuota la cache delle ricerche (da chiamare quando cambiano le normative)."""
+    with _search_cache_lock:
+        _search_cache.clear()
 
 
 @router.get("/search")
@@ -30,7 +59,8 @@ async def search_normative(
     province: Optional[str] = Query(None, description="Provincia"),
     region: Optional[str] = Query("Lazio", description="Regione"),
     top_k: int = Query(5, description="Numero risultati"),
-    retriever: NormativeRetriever = Depends(get_retriever)
+    retriever=Depends(get_retriever),
+    batcher=Depends(get_embedding_batcher)
 ):
     """
     Cerca normative urbanistiche.
@@ -47,14 +77,25 @@ async def search_normative(
     """
     logger.info(f"Ricerca normative: {query}")
     
+    cache_key = _search_cache_key(query, municipality, province, region, top_k)
+    with _search_cache_lock:
+        cached = _search_cache.get(cache_key)
+    if cached is not None:
+        return AppJSONResponse(cached)
+    
     try:
-        # Recupera documenti
-        docs = retriever.retrieve(
+        # Embedding della query (in batch con le richieste concorrenti)
+        query_embedding = await batcher.embed(query)
+        
+        # Recupera documenti (ricerca vettoriale bloccante: nel threadpool)
+        docs = await run_in_threadpool(
+            retriever.retrieve,
             query,
             municipality=municipality,
             region=region,
             province=province,
-            top_k=top_k
+            top_k=top_k,
+            query_embedding=query_embedding
         )
         
         # Formatta risultati
@@ -68,7 +109,7 @@ async def search_normative(
         # Citazioni
         citations = retriever.get_citations(docs)
         
-        return {
+        payload = {
             "query": query,
             "results": results,
             "citations": citations,
@@ -78,6 +119,11 @@ async def search_normative(
     except Exception as e:
         logger.error(f"Errore nella ricerca: {e}")
         raise HTTPException(status_code=500, detail=str(e))
+    
+    with _search_cache_lock:
+        _search_cache[cache_key] = payload
+    # Testi normativi lunghi: serializzati direttamente con orjson (niente jsonable_encoder)
+    return AppJSONResponse(payload)
 
 
 @router.get("/updates")
@@ -122,13 +168,22 @@ async def refresh_normative():
             create_montalto_scraper()
         ]
         
+        # Siti indipendenti: scraper eseguiti in parallelo (ognuno con la
+        # propria Session requests già in keep-alive)
+        outcomes = await asyncio.gather(
+            *(asyncio.to_thread(scraper.scrape) for scraper in scrapers),
+            return_exceptions=True
+        )
+        
         downloaded_files = []
-        for scraper in scrapers:
-            try:
-                files = scraper.scrape()
-                downloaded_files.extend(files)
-            except Exception as e:
-                logger.error(f"Errore con scraper {scraper.name}: {e}")
+        for scraper, outcome in zip(scrapers, outcomes):
+            if isinstance(outcome, Exception):
+                logger.error(f"Errore con scraper {scraper.name}: {outcome}")
+            else:
+                downloaded_files.extend(outcome)
+        
+        # Le normative possono essere cambiate: le ricerche in cache non valgono più
+        invalidate_search_cache()
         
         return {
             "status": "completed",
@@ -143,7 +198,7 @@ async def refresh_normative():
 
 @router.get("/stats")
 async def get_normative_stats(
-    vector_store: MultiLevelVectorStore = Depends(get_vector_store)
+    vector_store=Depends(get_vector_store)
 ):
     """
     Statistiche sul database normative.
@@ -152,14 +207,18 @@ async def get_normative_stats(
         Statistiche
     """
     try:
-        stats = {}
-        for level, store in vector_store.stores.items():
-            stats[level] = store.get_collection_stats()
+        # Conteggi indipendenti per livello: interrogati in parallelo
+        levels = list(vector_store.stores)
+        counts = await asyncio.gather(*(
+            asyncio.to_thread(vector_store.stores[level].get_collection_stats)
+            for level in levels
+        ))
+        stats = dict(zip(levels, counts))
         
-        return {
+        return AppJSONResponse({
             "stats": stats,
             "total_documents": sum(s["total_documents"] for s in stats.values())
-        }
+        })
         
     except Exception as e:
         logger.error(f"Errore nel recupero statistiche: {e}")
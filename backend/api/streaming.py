@@ -0,0 +1,47 @@
+"""
+Utility per risposte in streaming (Server-Sent Events).
+"""
+import json
+from typing import AsyncIterator, Iterator, Union
+
+from fastapi.responses import StreamingResponse
+from loguru import logger
+
+
+def _sse_events(chunks: Iterator[str]) -> Iterator[str]:
+    """Converte i chunk di testo in eventi SSE (payload JSON per preservare i newline)."""
+    try:
+        for chunk in chunks:
+            yield f"data: {json.dumps(chunk)}\n\n"
+    except Exception as e:
+        logger.error(f"Errore durante lo streaming: {e}")
+        yield f"event: error\ndata: {json.dumps(str(e))}\n\n"
+        return
+    
+    yield "event: done\ndata: {}\n\n"
+
+
+async def _asse_events(chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Come `_sse_events`, per iteratori asincroni (es. `astream_with_fallback`)."""
+    try:
+        async for chunk in chunks:
+            yield f"data: {json.dumps(chunk)}\n\n"
+    except Exception as e:
+        logger.error(f"Errore durante lo streaming: {e}")
+        yield f"event: error\ndata: {json.dumps(str(e))}\n\n"
+        return
+    
+    yield "event: done\ndata: {}\n\n"
+
+
+def sse_response(chunks: Union[Iterator[str], AsyncIterator[str]]) -> StreamingResponse:
+    """
+    Crea una StreamingResponse `text/event-stream` da un iteratore di chunk.
+    
+    L'iteratore sincrono viene consumato da Starlette in un threadpool,
+    quindi le chiamate LLM bloccanti non occupano l'event loop; quello
+    asincrono direttamente nell'event loop.
+    """
+    if hasattr(chunks, "__aiter__"):
+        return StreamingResponse(_asse_events(chunks), media_type="text/event-stream")
+    return StreamingResponse(_sse_events(chunks), media_type="text/event-stream")
@@ -0,0 +1,36 @@
+"""
+Utility per il salvataggio su disco dei file caricati.
+"""
+import shutil
+from pathlib import Path
+from typing import BinaryIO
+
+from fastapi import UploadFile
+from starlette.concurrency import run_in_threadpool
+
+
+# Dimensione dei blocchi copiati (memoria costante per upload)
+_CHUNK_SIZE = 1 << 20
+
+
+def _copy_to_disk(source: BinaryIO, path: Path):
+    """Copia uno stream su file a blocchi."""
+    with path.open("wb") as out:
+        shutil.copyfileobj(source, out, length=_CHUNK_SIZE)
+
+
+async def save_upload(upload: UploadFile, path: Path) -> Path:
+    """
+    Salva un file caricato senza leggerlo interamente in memoria.
+    
+    La copia (bloccante) avviene nel threadpool, senza occupare l'event loop.
+    
+    Args:
+        upload: File caricato
+        path: Path di destinazione
+        
+    Returns:
+        Path del file salvato
+    """
+    await run_in_threadpool(_copy_to_disk, upload.file, path)
+    return path
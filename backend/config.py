@@ -1,6 +1,7 @@
 """
 Configurazione centralizzata per l'agente AI di conformità urbanistica.
 """
+from functools import lru_cache
 from pydantic_settings import BaseSettings, SettingsConfigDict
 from typing import List, Optional
 from pydantic import Field
@@ -26,20 +27,31 @@ class AppSettings(BaseSettings):
     secret_key: str = "supersecretkeychangeinproduction"
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
+    bcrypt_cost: int = 12  # Round bcrypt (log2) per i nuovi hash
     
     # Database Configuration
     vector_db_path: Path = Path("./data/vectordb")
     vector_db_type: str = "chromadb"
+    chroma_host: Optional[str] = None  # Se impostato, usa un server Chroma remoto
+    chroma_port: int = 8001
+    flat_index_max_docs: int = 100_000  # Sotto questa soglia i livelli piccoli usano ricerca esatta in memoria
+    flat_index_quantization: str = "none"  # "fp16" / "int8": vettori quantizzati nell'indice FAISS in memoria
+    flat_index_ttl: int = 300  # Secondi dopo cui l'indice esatto viene ricostruito (modifiche di altri worker)
     embedding_model: str = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2"
+    embedding_backend: str = "torch"  # "onnx": ONNX Runtime con modello quantizzato int8
+    embedding_onnx_file: str = "onnx/model_qint8_avx512_vnni.onnx"
     
     # Data Paths
     normative_data_path: Path = Path("./data/normative")
     upload_path: Path = Path("./data/uploads")
+    temp_upload_path: Path = Path("./data/temp_uploads")
     cache_path: Path = Path("./data/cache")
+    semantic_cache_ttl: int = 86_400  # Durata (s) delle risposte nella cache semantica
     
     # API Configuration
     api_host: str = "0.0.0.0"
     api_port: int = Field(default=8000, alias="PORT")
+    api_reload: bool = False  # Auto-reload di uvicorn (solo sviluppo)
     cors_origins: str = "http://localhost:3000,http://localhost:5173,http://54.85.85.121:8081,http://34.203.191.130:8081"
     
     # Scraper Configuration
@@ -58,28 +70,29 @@ class AppSettings(BaseSettings):
     primary_llm: str = "gpt-4-vision-preview"
     secondary_llm: str = "gemini-pro-vision"
     tertiary_llm: str = "claude-3-sonnet-20240229"
+    llm_requests_per_minute: int = 500
+    use_batch_api: bool = False  # Batch API OpenAI per i job massivi (costo ridotto, latenza fino a 24h)
     
     # Logging
     log_level: str = "INFO"
     log_file: Path = Path("./logs/urbanistica-ai.log")
     
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        # Crea le directory necessarie
+    def ensure_dirs(self):
+        """Crea le directory necessarie (una volta, da `get_settings`)."""
         self.vector_db_path.mkdir(parents=True, exist_ok=True)
         self.normative_data_path.mkdir(parents=True, exist_ok=True)
         self.upload_path.mkdir(parents=True, exist_ok=True)
+        self.temp_upload_path.mkdir(parents=True, exist_ok=True)
         self.cache_path.mkdir(parents=True, exist_ok=True)
         self.log_file.parent.mkdir(parents=True, exist_ok=True)
 
 
-
-
-from functools import lru_cache
-
-@lru_cache
+@lru_cache(maxsize=1)
 def get_settings() -> AppSettings:
-    return AppSettings()
+    """Configurazione dell'applicazione (istanza unica, creata al primo uso)."""
+    settings = AppSettings()
+    settings.ensure_dirs()
+    return settings
 
 
 # Configurazioni specifiche per normative
@@ -127,7 +140,9 @@ CHUNKING_CONFIG = {
     "chunk_size": 1000,
     "chunk_overlap": 200,
     "separators": ["\n\nArt.", "\n\nArticolo", "\n\n", "\n", ". ", " ", ""],
-    "keep_separator": True
+    "keep_separator": True,
+    # Chunk per batch in `iter_chunks_batched` (un forward pass di embedding)
+    "batch_size": 64
 }
 
 
@@ -137,7 +152,14 @@ RETRIEVAL_CONFIG = {
     "score_threshold": 0.7,
     "rerank": True,
     "hybrid_search": True,
-    "keyword_weight": 0.3
+    "keyword_weight": 0.3,
+    # Fusione semantica/keyword: "weighted" (somma pesata degli score) o
+    # "rrf" (reciprocal rank fusion, pesata con keyword_weight)
+    "fusion": "weighted",
+    "rrf_k": 60,
+    # Match delle keyword nel testo: "substring" (anche dentro parole più
+    # lunghe, es. "edific" in "edificio") o "token" (solo parole intere)
+    "keyword_match": "substring"
 }
 
 
@@ -208,13 +230,3 @@ Per ogni difformità rilevata, specifica:
 - Possibile regolarizzazione
 """
 }
-
-
-from functools import lru_cache
-
-@lru_cache
-def get_settings() -> AppSettings:
-    return AppSettings()
-
-
-
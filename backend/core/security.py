@@ -1,7 +1,8 @@
+import asyncio
+import time
 import bcrypt
-from datetime import datetime, timedelta
 from typing import Optional, Union, Any
-from jose import jwt
+import jwt
 from backend.config import get_settings
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
@@ -9,19 +10,24 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
 def get_password_hash(password: str) -> str:
-    """Genera hash della password."""
+    """Genera hash della password (costo bcrypt da configurazione)."""
     pwd_bytes = password.encode('utf-8')
-    salt = bcrypt.gensalt()
+    salt = bcrypt.gensalt(rounds=get_settings().bcrypt_cost)
     return bcrypt.hashpw(pwd_bytes, salt).decode('utf-8')
 
-def create_access_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
-    """Crea un token JWT di accesso."""
-    to_encode = data.copy()
+async def averify_password(plain_password: str, hashed_password: str) -> bool:
+    """Come `verify_password`, eseguita in un thread per non bloccare l'event loop."""
+    return await asyncio.to_thread(verify_password, plain_password, hashed_password)
+
+async def aget_password_hash(password: str) -> str:
+    """Come `get_password_hash`, eseguita in un thread per non bloccare l'event loop."""
+    return await asyncio.to_thread(get_password_hash, password)
+
+def create_access_token(data: dict, expires_seconds: Optional[int] = None) -> str:
+    """Crea un token JWT di accesso (scadenza in secondi, default da configurazione)."""
     settings = get_settings()
-    if expires_delta:
-        expire = datetime.utcnow() + expires_delta
-    else:
-        expire = datetime.utcnow() + timedelta(minutes=settings.access_token_expire_minutes)
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
-    return encoded_jwt
+    if expires_seconds is None:
+        expires_seconds = settings.access_token_expire_minutes * 60
+    # Claim "exp" come timestamp intero: nessuna copia/update del dict, nessun datetime
+    to_encode = {**data, "exp": int(time.time()) + expires_seconds}
+    return jwt.encode(to_encode, settings.secret_key, algorithm=settings.algorithm)
@@ -1,10 +1,19 @@
 """
 Router intelligente per selezione LLM basata sul task.
 """
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Iterator, AsyncIterator
 from enum import Enum
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import asyncio
 import base64
+import threading
+import time
 from pathlib import Path
+import aiofiles
+import httpx
+import orjson
 from loguru import logger
 
 from langchain_core.messages import BaseMessage, HumanMessage, SystemMessage
@@ -14,6 +23,58 @@ from langchain_anthropic import ChatAnthropic
 
 from backend.config import get_settings
 
+try:
+    # Encoder base64 vettoriale (SIMD), API compatibile con la stdlib
+    from pybase64 import b64encode_as_string as _b64encode_str
+except ImportError:
+    def _b64encode_str(data: bytes) -> str:
+        return base64.b64encode(data).decode("ascii")
+
+
+@lru_cache(maxsize=1)
+def get_http_client() -> httpx.Client:
+    """
+    Client HTTP condiviso (keep-alive, HTTP/2) per le chiamate ai provider LLM.
+    
+    Tutti i router e i client LangChain del processo riusano lo stesso pool
+    di connessioni, ammortizzando handshake TLS e TCP slow-start.
+    """
+    return httpx.Client(
+        http2=True,
+        timeout=60.0,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20)
+    )
+
+
+@lru_cache(maxsize=1)
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Controparte asincrona di `get_http_client` per le chiamate `ainvoke`/`astream`.
+    
+    Con HTTP/2 le richieste parallele (es. consenso multi-modello) sono
+    multiplexate sulla stessa connessione.
+    """
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=60.0,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+    )
+
+
+def close_http_clients():
+    """Chiude i client HTTP condivisi (da chiamare allo shutdown)."""
+    if get_http_client.cache_info().currsize:
+        get_http_client().close()
+        get_http_client.cache_clear()
+
+
+async def aclose_http_clients():
+    """Chiude i client HTTP condivisi, sincrono e asincrono."""
+    close_http_clients()
+    if get_async_http_client.cache_info().currsize:
+        await get_async_http_client().aclose()
+        get_async_http_client.cache_clear()
+
 
 class TaskType(Enum):
     """Tipi di task per routing LLM."""
@@ -24,9 +85,61 @@ class TaskType(Enum):
     GENERAL_QUERY = "general_query"  # Query generiche
 
 
+class RateLimiter:
+    """Rate limiter thread-safe a finestra mobile (max richieste per periodo)."""
+    
+    def __init__(self, max_rate: int, period: float = 60.0):
+        """
+        Inizializza il limiter.
+        
+        Args:
+            max_rate: Numero massimo di richieste per periodo
+            period: Durata del periodo in secondi
+        """
+        self.max_rate = max_rate
+        self.period = period
+        self._timestamps = deque()
+        self._lock = threading.Lock()
+    
+    def acquire(self):
+        """Attende finché una nuova richiesta rientra nel limite."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._timestamps and now - self._timestamps[0] >= self.period:
+                    self._timestamps.popleft()
+                
+                if len(self._timestamps) < self.max_rate:
+                    self._timestamps.append(now)
+                    return
+                
+                wait = self.period - (now - self._timestamps[0])
+            
+            logger.debug(f"Rate limit LLM raggiunto, attesa {wait:.2f}s")
+            time.sleep(wait)
+
+
+@lru_cache(maxsize=1)
+def get_rate_limiter() -> RateLimiter:
+    """
+    Rate limiter condiviso da tutte le chiamate LLM del processo.
+    
+    Router e client usati direttamente (es. re-ranking del retriever)
+    consumano lo stesso budget di richieste al minuto.
+    """
+    return RateLimiter(get_settings().llm_requests_per_minute)
+
+
 class LLMRouter:
     """Router per selezione intelligente del modello LLM."""
     
+    # Chiamate concorrenti per i batch inviati senza Batch API
+    _BATCH_CONCURRENCY = 8
+    # Intervallo (secondi) di polling dello stato di un job Batch API
+    _BATCH_POLL_INTERVAL = 30.0
+    
+    _OPENAI_ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+    
     def __init__(self):
         """Inizializza i client per tutti i modelli LLM."""
         
@@ -36,13 +149,17 @@ class LLMRouter:
         self.gpt4 = ChatOpenAI(
             model=settings.primary_llm,
             temperature=0,
-            api_key=settings.openai_api_key
+            api_key=settings.openai_api_key,
+            http_client=get_http_client(),
+            http_async_client=get_async_http_client()
         )
         
         self.gpt4_turbo = ChatOpenAI(
             model="gpt-4-turbo-preview",
             temperature=0,
-            api_key=settings.openai_api_key
+            api_key=settings.openai_api_key,
+            http_client=get_http_client(),
+            http_async_client=get_async_http_client()
         )
         
         # Google Gemini
@@ -59,13 +176,39 @@ class LLMRouter:
             anthropic_api_key=settings.anthropic_api_key
         )
         
+        # Nome del modello vision configurato (per il logging nel routing)
+        self._primary_llm_name = settings.primary_llm
+        
         # Modello economico per task semplici
         self.gpt35 = ChatOpenAI(
             model="gpt-3.5-turbo",
             temperature=0,
-            api_key=settings.openai_api_key
+            api_key=settings.openai_api_key,
+            http_client=get_http_client(),
+            http_async_client=get_async_http_client()
         )
         
+        # Routing task → (modello, nome), costruito una volta sola
+        self._routing = {
+            # Claude eccelle nell'analisi di testi lunghi e legali
+            TaskType.NORMATIVE_ANALYSIS: (self.claude, settings.tertiary_llm),
+            # GPT-4 per reasoning complesso
+            TaskType.COMPLIANCE_CHECK: (self.gpt4_turbo, "gpt-4-turbo-preview"),
+            # Gemini per generazione testi lunghi
+            TaskType.REPORT_GENERATION: (self.gemini, settings.secondary_llm),
+            # GPT-4V per analisi visiva
+            TaskType.VISION_ANALYSIS: (self.gpt4, settings.primary_llm)
+        }
+        # Task generici: modello economico
+        self._default_route = (self.gpt35, "gpt-3.5-turbo")
+        
+        # Limite condiviso sulle chiamate ai provider
+        self.rate_limiter = get_rate_limiter()
+        
+        # Job massivi tramite Batch API OpenAI
+        self.use_batch_api = settings.use_batch_api
+        self._openai_api_key = settings.openai_api_key
+        
         logger.info("LLM Router inizializzato con tutti i modelli")
     
     def select_model(self, task_type: TaskType, has_images: bool = False):
@@ -80,36 +223,14 @@ class LLMRouter:
             Modello LLM selezionato
         """
         if has_images:
-            settings = get_settings()
             # Per task con immagini, usa vision models
-            logger.info(f"Task con immagini: usando {settings.primary_llm}")
+            logger.debug(f"Task con immagini: usando {self._primary_llm_name}")
             return self.gpt4  # GPT-4V
         
         # Routing basato sul tipo di task
-        if task_type == TaskType.NORMATIVE_ANALYSIS:
-            # Claude eccelle nell'analisi di testi lunghi e legali
-            logger.info("Task normative analysis: usando Claude")
-            return self.claude
-        
-        elif task_type == TaskType.COMPLIANCE_CHECK:
-            # GPT-4 per reasoning complesso
-            logger.info("Task compliance check: usando GPT-4")
-            return self.gpt4_turbo
-        
-        elif task_type == TaskType.REPORT_GENERATION:
-            # Gemini per generazione testi lunghi
-            logger.info("Task report generation: usando Gemini")
-            return self.gemini
-        
-        elif task_type == TaskType.VISION_ANALYSIS:
-            # GPT-4V per analisi visiva
-            logger.info("Task vision analysis: usando GPT-4V")
-            return self.gpt4
-        
-        else:
-            # Task generici: usa modello economico
-            logger.info("Task generico: usando GPT-3.5")
-            return self.gpt35
+        model, name = self._routing.get(task_type, self._default_route)
+        logger.debug(f"Task {task_type.value}: usando {name}")
+        return model
     
     def invoke_with_fallback(
         self,
@@ -139,7 +260,11 @@ class LLMRouter:
         # Prova con modello primario
         try:
             logger.debug(f"Invocazione modello primario")
-            response = primary_model.invoke(messages, **kwargs)
+            self.rate_limiter.acquire()
+            response = primary_model.invoke(
+                self._prepare_messages(primary_model, messages),
+                **kwargs
+            )
             return response.content
         
         except Exception as e:
@@ -149,7 +274,11 @@ class LLMRouter:
             for i, fallback_model in enumerate(fallback_models):
                 try:
                     logger.info(f"Tentativo fallback {i+1}/{len(fallback_models)}")
-                    response = fallback_model.invoke(messages, **kwargs)
+                    self.rate_limiter.acquire()
+                    response = fallback_model.invoke(
+                        self._prepare_messages(fallback_model, messages),
+                        **kwargs
+                    )
                     return response.content
                 
                 except Exception as e:
@@ -160,6 +289,81 @@ class LLMRouter:
             logger.error("Tutti i modelli hanno fallito")
             raise Exception("Impossibile ottenere risposta da nessun modello LLM")
     
+    async def astream_with_fallback(
+        self,
+        messages: List[BaseMessage],
+        task_type: TaskType,
+        has_images: bool = False,
+        **kwargs
+    ) -> AsyncIterator[str]:
+        """
+        Come `invoke_with_fallback`, ma restituisce la risposta in streaming
+        asincrono: i chunk escono appena il modello li produce e la
+        generazione si interrompe se il client si disconnette.
+        
+        Il fallback su un altro modello avviene solo se l'errore si verifica
+        prima che sia stato emesso il primo chunk.
+        
+        Args:
+            messages: Messaggi da inviare
+            task_type: Tipo di task
+            has_images: Se il task include immagini
+            **kwargs: Parametri aggiuntivi per LLM
+            
+        Yields:
+            Chunk di testo della risposta
+        """
+        primary_model = self.select_model(task_type, has_images)
+        models = [primary_model] + self._get_fallback_models(primary_model, has_images)
+        
+        for i, model in enumerate(models):
+            started = False
+            try:
+                logger.debug(f"Streaming con modello {i+1}/{len(models)}")
+                await asyncio.to_thread(self.rate_limiter.acquire)
+                async for chunk in model.astream(self._prepare_messages(model, messages), **kwargs):
+                    text = self._chunk_text(chunk.content)
+                    if text:
+                        started = True
+                        yield text
+                return
+            
+            except Exception as e:
+                if started:
+                    logger.error(f"Errore durante lo streaming: {e}")
+                    raise
+                logger.warning(f"Errore streaming con modello {i+1}: {e}")
+                continue
+        
+        logger.error("Tutti i modelli hanno fallito")
+        raise Exception("Impossibile ottenere risposta da nessun modello LLM")
+    
+    def _prepare_messages(self, model, messages: List[BaseMessage]) -> List[BaseMessage]:
+        """
+        Adatta i messaggi al provider del modello.
+        
+        I blocchi con `cache_control` sono supportati solo da Anthropic; per gli
+        altri provider i blocchi di testo vengono concatenati in un'unica
+        stringa, mantenendo il prefisso statico in testa (OpenAI applica il
+        prompt caching automaticamente sui prefissi lunghi).
+        """
+        if model is self.claude:
+            return messages
+        
+        prepared = []
+        for message in messages:
+            content = message.content
+            if isinstance(content, list) and all(
+                isinstance(block, dict) and block.get("type") == "text"
+                for block in content
+            ):
+                message = message.__class__(
+                    content="\n\n".join(block["text"] for block in content)
+                )
+            prepared.append(message)
+        
+        return prepared
+    
     def _get_fallback_models(self, primary_model, has_images: bool) -> List:
         """Ottiene lista di modelli fallback."""
         all_models = [self.gpt4_turbo, self.gemini, self.claude, self.gpt35]
@@ -203,6 +407,7 @@ class LLMRouter:
         for name, model in models:
             try:
                 logger.info(f"Richiesta consenso a {name}")
+                self.rate_limiter.acquire()
                 response = model.invoke(messages, **kwargs)
                 responses[name] = response.content
             except Exception as e:
@@ -211,31 +416,71 @@ class LLMRouter:
         
         return responses
     
+    async def amulti_model_consensus(
+        self,
+        messages: List[BaseMessage],
+        models: Optional[List] = None,
+        **kwargs
+    ) -> Dict[str, str]:
+        """
+        Variante asincrona di `multi_model_consensus`: i modelli vengono
+        interrogati in parallelo (latenza del più lento invece della somma).
+        """
+        if models is None:
+            models = [
+                ("GPT-4", self.gpt4_turbo),
+                ("Gemini", self.gemini),
+                ("Claude", self.claude)
+            ]
+        
+        async def _ask(name: str, model) -> str:
+            logger.info(f"Richiesta consenso a {name}")
+            # Il rate limiter può attendere: fuori dall'event loop
+            await asyncio.to_thread(self.rate_limiter.acquire)
+            response = await model.ainvoke(messages, **kwargs)
+            return response.content
+        
+        results = await asyncio.gather(
+            *(_ask(name, model) for name, model in models),
+            return_exceptions=True
+        )
+        
+        responses = {}
+        for (name, _), result in zip(models, results):
+            if isinstance(result, Exception):
+                logger.warning(f"Errore con {name}: {result}")
+                responses[name] = f"[ERRORE: {str(result)}]"
+            else:
+                responses[name] = result
+        
+        return responses
+    
     def analyze_with_best_model(
         self,
         prompt: str,
         task_type: TaskType,
         system_message: Optional[str] = None,
+        cached_context: Optional[str] = None,
         **kwargs
     ) -> str:
         """
         Analizza un prompt con il modello migliore per il task.
         
+        Il messaggio di sistema e il contesto statico (es. normative recuperate)
+        vengono inviati come prefisso cacheable, separati dal prompt utente
+        che contiene solo i dati variabili della singola chiamata.
+        
         Args:
-            prompt: Prompt utente
+            prompt: Prompt utente (parte variabile)
             task_type: Tipo di task
             system_message: Messaggio di sistema (opzionale)
+            cached_context: Contesto statico da mettere in cache (opzionale)
             **kwargs: Parametri aggiuntivi
             
         Returns:
             Risposta del modello
         """
-        messages = []
-        
-        if system_message:
-            messages.append(SystemMessage(content=system_message))
-        
-        messages.append(HumanMessage(content=prompt))
+        messages = self._build_messages(prompt, system_message, cached_context)
         
         return self.invoke_with_fallback(
             messages,
@@ -244,6 +489,236 @@ class LLMRouter:
         )
 
 
+    def analyze_with_best_model_stream(
+        self,
+        prompt: str,
+        task_type: TaskType,
+        system_message: Optional[str] = None,
+        cached_context: Optional[str] = None,
+        **kwargs
+    ) -> Iterator[str]:
+        """
+        Come `analyze_with_best_model`, ma restituisce la risposta in streaming.
+        
+        Il fallback su un altro modello avviene solo se l'errore si verifica
+        prima che sia stato emesso il primo chunk.
+        
+        Args:
+            prompt: Prompt utente (parte variabile)
+            task_type: Tipo di task
+            system_message: Messaggio di sistema (opzionale)
+            cached_context: Contesto statico da mettere in cache (opzionale)
+            **kwargs: Parametri aggiuntivi
+            
+        Yields:
+            Chunk di testo della risposta
+        """
+        messages = self._build_messages(prompt, system_message, cached_context)
+        
+        primary_model = self.select_model(task_type)
+        models = [primary_model] + self._get_fallback_models(primary_model, False)
+        
+        for i, model in enumerate(models):
+            started = False
+            try:
+                logger.debug(f"Streaming con modello {i+1}/{len(models)}")
+                self.rate_limiter.acquire()
+                for chunk in model.stream(self._prepare_messages(model, messages), **kwargs):
+                    text = self._chunk_text(chunk.content)
+                    if text:
+                        started = True
+                        yield text
+                return
+            
+            except Exception as e:
+                if started:
+                    logger.error(f"Errore durante lo streaming: {e}")
+                    raise
+                logger.warning(f"Errore streaming con modello {i+1}: {e}")
+                continue
+        
+        logger.error("Tutti i modelli hanno fallito")
+        raise Exception("Impossibile ottenere risposta da nessun modello LLM")
+    
+    def analyze_batch(
+        self,
+        prompts: List[str],
+        task_type: TaskType,
+        system_message: Optional[str] = None,
+        cached_contexts: Optional[List[Optional[str]]] = None,
+        **kwargs
+    ) -> List[str]:
+        """
+        Analizza più prompt dello stesso task (job di backoffice).
+        
+        Con `use_batch_api` le richieste vengono inviate alla Batch API OpenAI
+        (costo dimezzato, completamento entro 24h); altrimenti sono eseguite
+        in parallelo nel rispetto del rate limit.
+        
+        Args:
+            prompts: Prompt utente (parte variabile)
+            task_type: Tipo di task
+            system_message: Messaggio di sistema comune (opzionale)
+            cached_contexts: Contesto statico per ciascun prompt (opzionale)
+            **kwargs: Parametri aggiuntivi
+            
+        Returns:
+            Risposte nello stesso ordine dei prompt
+        """
+        contexts = cached_contexts or [None] * len(prompts)
+        message_lists = [
+            self._build_messages(prompt, system_message, context)
+            for prompt, context in zip(prompts, contexts)
+        ]
+        
+        if self.use_batch_api:
+            try:
+                return self._run_openai_batch(message_lists, task_type, **kwargs)
+            except Exception as e:
+                logger.warning(f"Batch API non disponibile, invio diretto: {e}")
+        
+        with ThreadPoolExecutor(max_workers=self._BATCH_CONCURRENCY) as executor:
+            return list(executor.map(
+                lambda messages: self.invoke_with_fallback(messages, task_type=task_type, **kwargs),
+                message_lists
+            ))
+    
+    def _run_openai_batch(
+        self,
+        message_lists: List[List[BaseMessage]],
+        task_type: TaskType,
+        **kwargs
+    ) -> List[str]:
+        """Invia le richieste alla Batch API OpenAI e attende i risultati."""
+        from openai import OpenAI
+        
+        model = self.select_model(task_type)
+        if not isinstance(model, ChatOpenAI):
+            model = self.gpt4_turbo
+        
+        lines = [
+            orjson.dumps({
+                "custom_id": str(i),
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": model.model_name,
+                    "temperature": 0,
+                    "messages": [
+                        {"role": self._OPENAI_ROLES[message.type], "content": message.content}
+                        for message in self._prepare_messages(model, messages)
+                    ]
+                }
+            })
+            for i, messages in enumerate(message_lists)
+        ]
+        
+        client = OpenAI(api_key=self._openai_api_key, http_client=get_http_client())
+        input_file = client.files.create(
+            file=("batch.jsonl", b"\n".join(lines)),
+            purpose="batch"
+        )
+        batch = client.batches.create(
+            input_file_id=input_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h"
+        )
+        logger.info(f"Job Batch API creato: {batch.id} ({len(lines)} richieste)")
+        
+        while batch.status not in ("completed", "failed", "expired", "cancelled"):
+            time.sleep(self._BATCH_POLL_INTERVAL)
+            batch = client.batches.retrieve(batch.id)
+        
+        if batch.status != "completed" or not batch.output_file_id:
+            raise Exception(f"Job Batch API {batch.id} terminato con stato {batch.status}")
+        
+        results: List[Optional[str]] = [None] * len(message_lists)
+        for line in client.files.content(batch.output_file_id).content.splitlines():
+            record = orjson.loads(line)
+            response = record.get("response") or {}
+            if response.get("status_code") == 200:
+                results[int(record["custom_id"])] = (
+                    response["body"]["choices"][0]["message"]["content"]
+                )
+        
+        # Le richieste fallite nel job vengono ripetute in modo sincrono
+        failed = [i for i, result in enumerate(results) if result is None]
+        if failed:
+            logger.warning(f"{len(failed)} richieste fallite nel job batch, invio diretto")
+            for i in failed:
+                results[i] = self.invoke_with_fallback(
+                    message_lists[i],
+                    task_type=task_type,
+                    **kwargs
+                )
+        
+        logger.success(f"Job Batch API {batch.id} completato")
+        return results
+    
+    @staticmethod
+    def _chunk_text(content: Any) -> str:
+        """Estrae il testo da un chunk (stringa o lista di blocchi)."""
+        if isinstance(content, str):
+            return content
+        return "".join(
+            block.get("text", "") if isinstance(block, dict) else str(block)
+            for block in content
+        )
+    
+    def _build_messages(
+        self,
+        prompt: str,
+        system_message: Optional[str] = None,
+        cached_context: Optional[str] = None
+    ) -> List[BaseMessage]:
+        """Costruisce i messaggi con prefisso statico marcato per il prompt caching."""
+        messages = []
+        
+        system_blocks = [
+            {
+                "type": "text",
+                "text": text,
+                "cache_control": {"type": "ephemeral"}
+            }
+            for text in (system_message, cached_context)
+            if text
+        ]
+        if system_blocks:
+            messages.append(SystemMessage(content=system_blocks))
+        
+        messages.append(HumanMessage(content=prompt))
+        return messages
+
+
+_IMAGE_MIME_TYPES = {
+    '.jpg': 'image/jpeg',
+    '.jpeg': 'image/jpeg',
+    '.png': 'image/png',
+    '.gif': 'image/gif',
+    '.webp': 'image/webp'
+}
+
+
+def _data_url(path: Path, image_data: bytes) -> str:
+    """Data URL base64 dei byte di un'immagine (MIME dedotto dall'estensione)."""
+    mime_type = _IMAGE_MIME_TYPES.get(path.suffix.lower(), 'image/jpeg')
+    return f"data:{mime_type};base64,{_b64encode_str(image_data)}"
+
+
+def _image_data_url(image_path: str) -> str:
+    """Legge un'immagine e la restituisce come data URL base64."""
+    path = Path(image_path)
+    return _data_url(path, path.read_bytes())
+
+
+async def _aimage_data_url(image_path: str) -> str:
+    """Come `_image_data_url`, ma senza bloccare l'event loop durante la lettura."""
+    path = Path(image_path)
+    async with aiofiles.open(path, 'rb') as f:
+        image_data = await f.read()
+    return _data_url(path, image_data)
+
+
 class VisionAnalyzer:
     """Analizzatore specializzato per documenti con immagini."""
     
@@ -257,6 +732,22 @@ class VisionAnalyzer:
         self.router = router
         logger.info("Vision Analyzer inizializzato")
     
+    @staticmethod
+    def _image_message(text: str, image_urls: List[str], detail_level: str) -> HumanMessage:
+        """Messaggio multimodale: testo seguito dalle immagini (data URL)."""
+        return HumanMessage(
+            content=[
+                {"type": "text", "text": text},
+                *(
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": url, "detail": detail_level}
+                    }
+                    for url in image_urls
+                )
+            ]
+        )
+    
     def analyze_image(
         self,
         image_path: str,
@@ -276,41 +767,8 @@ class VisionAnalyzer:
         """
         logger.info(f"Analisi immagine: {image_path}")
         
-        # Prepara messaggio con immagine
-        import base64
-        from pathlib import Path
-        
-        # Leggi e codifica immagine
-        image_data = Path(image_path).read_bytes()
-        base64_image = base64.b64encode(image_data).decode('utf-8')
-        
-        # Determina tipo MIME
-        suffix = Path(image_path).suffix.lower()
-        mime_types = {
-            '.jpg': 'image/jpeg',
-            '.jpeg': 'image/jpeg',
-            '.png': 'image/png',
-            '.gif': 'image/gif',
-            '.webp': 'image/webp'
-        }
-        mime_type = mime_types.get(suffix, 'image/jpeg')
-        
         # Crea messaggio con immagine
-        message = HumanMessage(
-            content=[
-                {
-                    "type": "text",
-                    "text": prompt
-                },
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:{mime_type};base64,{base64_image}",
-                        "detail": detail_level
-                    }
-                }
-            ]
-        )
+        message = self._image_message(prompt, [_image_data_url(image_path)], detail_level)
         
         # Usa GPT-4V
         try:
@@ -320,6 +778,29 @@ class VisionAnalyzer:
             logger.error(f"Errore nell'analisi immagine: {e}")
             raise
     
+    async def aanalyze_image(
+        self,
+        image_path: str,
+        prompt: str,
+        detail_level: str = "high"
+    ) -> str:
+        """
+        Variante asincrona di `analyze_image`: lettura del file e chiamata
+        al modello non bloccano l'event loop.
+        """
+        logger.info(f"Analisi immagine: {image_path}")
+        
+        message = self._image_message(
+            prompt, [await _aimage_data_url(image_path)], detail_level
+        )
+        
+        try:
+            response = await self.router.gpt4.ainvoke([message])
+            return response.content
+        except Exception as e:
+            logger.error(f"Errore nell'analisi immagine: {e}")
+            raise
+    
     def compare_images(
         self,
         image1_path: str,
@@ -339,33 +820,11 @@ class VisionAnalyzer:
         """
         logger.info(f"Confronto immagini: {image1_path} vs {image2_path}")
         
-        import base64
-        from pathlib import Path
-        
-        # Codifica entrambe le immagini
-        images_data = []
-        for img_path in [image1_path, image2_path]:
-            image_data = Path(img_path).read_bytes()
-            base64_image = base64.b64encode(image_data).decode('utf-8')
-            
-            suffix = Path(img_path).suffix.lower()
-            mime_type = 'image/jpeg' if suffix in ['.jpg', '.jpeg'] else 'image/png'
-            
-            images_data.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:{mime_type};base64,{base64_image}",
-                    "detail": "high"
-                }
-            })
-        
         # Crea messaggio con entrambe le immagini
-        message = HumanMessage(
-            content=[
-                {"type": "text", "text": comparison_prompt},
-                images_data[0],
-                images_data[1]
-            ]
+        message = self._image_message(
+            comparison_prompt,
+            [_image_data_url(image1_path), _image_data_url(image2_path)],
+            "high"
         )
         
         try:
@@ -374,3 +833,28 @@ class VisionAnalyzer:
         except Exception as e:
             logger.error(f"Errore nel confronto immagini: {e}")
             raise
+    
+    async def acompare_images(
+        self,
+        image1_path: str,
+        image2_path: str,
+        comparison_prompt: str
+    ) -> str:
+        """
+        Variante asincrona di `compare_images`: le due immagini vengono lette
+        in parallelo.
+        """
+        logger.info(f"Confronto immagini: {image1_path} vs {image2_path}")
+        
+        image_urls = await asyncio.gather(
+            _aimage_data_url(image1_path),
+            _aimage_data_url(image2_path)
+        )
+        message = self._image_message(comparison_prompt, list(image_urls), "high")
+        
+        try:
+            response = await self.router.gpt4.ainvoke([message])
+            return response.content
+        except Exception as e:
+            logger.error(f"Errore nel confronto immagini: {e}")
+            raise
@@ -1,20 +1,86 @@
 """
 Template di prompt specializzati per l'agente urbanistico.
 """
-from typing import Dict, List, Optional
+from functools import lru_cache
+from string import Formatter
+from typing import Any, ClassVar, Dict, FrozenSet, List, Mapping, Optional, Tuple
+
+import orjson
+from loguru import logger
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+
+# Oltre questa dimensione (caratteri) i prompt formattati non vengono messi in cache
+_FORMAT_CACHE_MAX_PAYLOAD = 16 * 1024
+
+# Stima caratteri/token usata quando il tokenizer non è disponibile
+_APPROX_CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=1)
+def _get_encoder():
+    """Tokenizer del modello primario, caricato una sola volta (None se non disponibile)."""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model("gpt-4o")
+    except Exception as e:
+        logger.warning(f"Tokenizer non disponibile, troncamento per caratteri: {e}")
+        return None
+
+
+_FORMATTER = Formatter()
+
+
+@lru_cache(maxsize=64)
+def _parse_template(template: str) -> Tuple[Tuple[str, Optional[str], str, Optional[str]], ...]:
+    """Frammenti (testo, campo, spec, conversione) di un template, analizzato una volta."""
+    return tuple(_FORMATTER.parse(template))
+
+
+def _render(template: str, kwargs: Mapping[str, Any]) -> str:
+    """
+    Equivalente di `template.format_map(kwargs)` sui frammenti pre-analizzati.
+    
+    Il testo letterale (diversi KB per i template lunghi) viene solo
+    concatenato con `str.join`, senza essere riscansionato a ogni chiamata.
+    """
+    parts = []
+    for literal, field, spec, conversion in _parse_template(template):
+        parts.append(literal)
+        if field is None:
+            continue
+        if field in kwargs and not spec and not conversion:
+            parts.append(str(kwargs[field]))
+            continue
+        # Campi composti (attributi/indici), conversioni o format spec
+        value = _FORMATTER.get_field(field, (), kwargs)[0]
+        value = _FORMATTER.convert_field(value, conversion)
+        parts.append(_FORMATTER.format_field(value, spec))
+    return "".join(parts)
+
+
+@lru_cache(maxsize=4096)
+def _format_cached(template: str, items: FrozenSet[Tuple[str, Any]]) -> str:
+    """Formattazione memoizzata per coppie (template, parametri) hashable."""
+    return _render(template, dict(items))
 
 
 class PromptTemplates:
     """Collezione di template prompt per diversi task."""
     
+    # I template con parametri iniziano con la parte statica (ruolo, istruzioni,
+    # struttura della risposta, `*_PREFIX`) e terminano con i dati della
+    # richiesta (`*_SUFFIX`): il prefisso resta identico tra le chiamate ed è
+    # riutilizzabile dal prompt caching dei provider.
+    
     # Analisi normativa
-    NORMATIVE_QUERY = """Sei un esperto di urbanistica e diritto edilizio italiano.
-Basandoti ESCLUSIVAMENTE sulle seguenti normative, rispondi alla domanda con precisione.
-
-Normative di riferimento:
-{context}
-
-Domanda: {question}
+    NORMATIVE_QUERY_PREFIX = """Sei un esperto di urbanistica e diritto edilizio italiano.
+Basandoti ESCLUSIVAMENTE sulle normative di riferimento riportate di seguito, rispondi alla domanda con precisione.
 
 Istruzioni:
 1. Cita SEMPRE gli articoli e commi specifici
@@ -22,16 +88,19 @@ Istruzioni:
 3. Distingui tra normativa nazionale, regionale e comunale
 4. Fornisci una risposta chiara e strutturata
 
-Risposta:"""
+"""
+    NORMATIVE_QUERY_SUFFIX = """Normative di riferimento:
+{context}
 
-    # Analisi normativa comparativa
-    COMPARATIVE_NORMATIVE_ANALYSIS = """Sei un esperto di urbanistica e diritto edilizio, specializzato in analisi comparata delle normative.
-Analizza la richiesta dell'utente confrontando le normative ai diversi livelli gerarchici recuperati.
+Domanda: {question}
 
-Domanda Utente: {question}
+Risposta:"""
+    NORMATIVE_QUERY = NORMATIVE_QUERY_PREFIX + NORMATIVE_QUERY_SUFFIX
 
-Contesto Normativo Recuperato:
-{context}
+    # Analisi normativa comparativa
+    COMPARATIVE_NORMATIVE_ANALYSIS_PREFIX = """Sei un esperto di urbanistica e diritto edilizio, specializzato in analisi comparata delle normative.
+Analizza la richiesta dell'utente riportata in fondo confrontando le normative ai diversi livelli gerarchici recuperati
+(riportate nel contesto normativo del messaggio di sistema).
 
 Istruzioni di Analisi:
 1. IDENTIFICAZIONE: Estrai le norme pertinenti per ogni livello (Nazionale, Regionale, Provinciale, Comunale).
@@ -47,23 +116,18 @@ Struttura della Risposta:
 - **Conclusione Operativa**: Risposta diretta alla domanda basata sulla norma prevalente applicabile.
 - **Riferimenti**: Elenco puntato delle leggi/articoli citati.
 
+"""
+    COMPARATIVE_NORMATIVE_ANALYSIS_SUFFIX = """Domanda Utente: {question}
+
 Risposta:"""
+    COMPARATIVE_NORMATIVE_ANALYSIS = (
+        COMPARATIVE_NORMATIVE_ANALYSIS_PREFIX + COMPARATIVE_NORMATIVE_ANALYSIS_SUFFIX
+    )
 
     # Verifica conformità
-    COMPLIANCE_CHECK = """Sei un tecnico esperto in conformità urbanistica ed edilizia.
-Analizza la seguente situazione e verifica la conformità alle normative applicabili.
-
-=== NORMATIVE APPLICABILI ===
-{normative}
-
-=== INFORMAZIONI IMMOBILE ===
-Comune: {municipality}
-Regione: {region}
-Tipologia: {property_type}
-Informazioni aggiuntive: {property_info}
-
-=== DOCUMENTI ANALIZZATI ===
-{documents}
+    COMPLIANCE_CHECK_PREFIX = """Sei un tecnico esperto in conformità urbanistica ed edilizia.
+Analizza la situazione descritta di seguito e verifica la conformità alle normative applicabili
+(riportate nel contesto normativo del messaggio di sistema).
 
 === VERIFICA RICHIESTA ===
 Analizza i seguenti aspetti:
@@ -79,20 +143,26 @@ Per ogni punto, fornisci:
 - Dettagli e motivazioni
 - Eventuali azioni correttive necessarie
 
-Risposta strutturata:"""
+"""
+    COMPLIANCE_CHECK_SUFFIX = """=== INFORMAZIONI IMMOBILE ===
+Comune: {municipality}
+Regione: {region}
+Tipologia: {property_type}
+Informazioni aggiuntive: {property_info}
 
-    # Rilevamento difformità
-    DIFFORMITA_DETECTION = """Sei un perito esperto in rilevamento di difformità edilizie.
-Analizza i documenti forniti e identifica eventuali difformità tra quanto autorizzato e lo stato di fatto.
+=== DOCUMENTI ANALIZZATI ===
+{documents}
 
-=== PLANIMETRIA CATASTALE ===
-{planimetria_info}
+Risposta strutturata:"""
+    COMPLIANCE_CHECK = COMPLIANCE_CHECK_PREFIX + COMPLIANCE_CHECK_SUFFIX
 
-=== PROGETTO URBANISTICO AUTORIZZATO ===
-{progetto_info}
+    # Contesto normativo (prefisso statico, inviato come cached_context)
+    NORMATIVE_CONTEXT = """=== NORMATIVE APPLICABILI ===
+{context}"""
 
-=== STATO DI FATTO (da foto/rilievi) ===
-{foto_info}
+    # Rilevamento difformità
+    DIFFORMITA_DETECTION_PREFIX = """Sei un perito esperto in rilevamento di difformità edilizie.
+Analizza i documenti riportati di seguito e identifica eventuali difformità tra quanto autorizzato e lo stato di fatto.
 
 === ANALISI RICHIESTA ===
 Per ogni difformità rilevata, specifica:
@@ -123,7 +193,18 @@ Per ogni difformità rilevata, specifica:
    - Tempi e costi stimati
    - Fattibilità (alta/media/bassa/impossibile)
 
+"""
+    DIFFORMITA_DETECTION_SUFFIX = """=== PLANIMETRIA CATASTALE ===
+{planimetria_info}
+
+=== PROGETTO URBANISTICO AUTORIZZATO ===
+{progetto_info}
+
+=== STATO DI FATTO (da foto/rilievi) ===
+{foto_info}
+
 Fornisci un'analisi completa e professionale:"""
+    DIFFORMITA_DETECTION = DIFFORMITA_DETECTION_PREFIX + DIFFORMITA_DETECTION_SUFFIX
 
     # Analisi planimetria
     PLANIMETRIA_ANALYSIS = """Analizza la planimetria fornita ed estrai le seguenti informazioni:
@@ -196,10 +277,8 @@ Fornisci un'analisi tecnica dettagliata:"""
 Descrivi dettagliatamente quanto osservato:"""
 
     # Generazione report
-    REPORT_GENERATION = """Genera un report professionale di conformità urbanistica basato sull'analisi effettuata.
-
-=== DATI ANALISI ===
-{analysis_data}
+    REPORT_GENERATION_PREFIX = """Genera un report professionale di conformità urbanistica basato sull'analisi effettuata
+(dati riportati in fondo) e sulle normative riportate nel contesto normativo del messaggio di sistema.
 
 === STRUTTURA REPORT ===
 
@@ -241,18 +320,20 @@ Descrivi dettagliatamente quanto osservato:"""
 Questo report è stato generato da un sistema di analisi automatica e non sostituisce una perizia tecnica professionale. Per decisioni legali o amministrative, consultare un tecnico abilitato.
 
 ---
-Data: {date}
+Data: [Data del report indicata sotto]
 Sistema: Agente AI Conformità Urbanistica
 
-Genera il report completo e professionale:"""
+"""
+    REPORT_GENERATION_SUFFIX = """=== DATI ANALISI ===
+{analysis_data}
 
-    # Estrazione info da OCR
-    OCR_EXTRACTION = """Analizza il testo estratto da OCR dal documento tecnico e identifica:
+Data del report: {date}
 
-Testo OCR:
-{ocr_text}
+Genera il report completo e professionale:"""
+    REPORT_GENERATION = REPORT_GENERATION_PREFIX + REPORT_GENERATION_SUFFIX
 
-Estrai:
+    # Estrazione info da OCR
+    OCR_EXTRACTION_PREFIX = """Analizza il testo estratto da OCR dal documento tecnico (riportato di seguito) ed estrai:
 1. Dati catastali (foglio, particella, subalterno)
 2. Dimensioni e misure (lunghezze, superfici, volumi)
 3. Date (rilascio permessi, autorizzazioni)
@@ -261,7 +342,37 @@ Estrai:
 6. Destinazioni d'uso
 7. Indici urbanistici calcolati
 
+"""
+    OCR_EXTRACTION_SUFFIX = """Testo OCR:
+{ocr_text}
+
 Fornisci i dati in formato strutturato:"""
+    OCR_EXTRACTION = OCR_EXTRACTION_PREFIX + OCR_EXTRACTION_SUFFIX
+
+    # Messaggi di sistema per ruolo (costruiti una volta, a livello di classe)
+    _SYSTEM_MESSAGES: ClassVar[Dict[str, str]] = {
+        "urbanistica_expert": """Sei un esperto di urbanistica ed edilizia con 20 anni di esperienza.
+Conosci perfettamente il Testo Unico dell'Edilizia (DPR 380/2001) e tutte le normative regionali e comunali italiane.
+Fornisci sempre risposte precise, citate con riferimenti normativi esatti.
+Usa un linguaggio tecnico ma comprensibile.
+Quando rilevi difformità, specifica sempre la gravità e le possibili soluzioni.""",
+
+        "perito_tecnico": """Sei un perito tecnico specializzato in rilievi e verifiche di conformità edilizia.
+Analizzi planimetrie, progetti e foto con occhio esperto.
+Rilevi anche le più piccole discrepanze tra documentazione e stato di fatto.
+Fornisci analisi tecniche dettagliate e misurate.""",
+
+        "legal_advisor": """Sei un consulente legale specializzato in diritto urbanistico ed edilizio.
+Interpreti le normative con rigore giuridico.
+Fornisci pareri su conformità, sanatorie e procedure amministrative.
+Citi sempre le fonti normative con precisione.""",
+
+        "report_writer": """Sei un redattore tecnico specializzato in report di conformità urbanistica.
+Scrivi report chiari, strutturati e professionali.
+Usi un linguaggio tecnico appropriato ma accessibile.
+Organizzi le informazioni in modo logico e completo."""
+    }
+    _DEFAULT_SYSTEM_MESSAGE: ClassVar[str] = _SYSTEM_MESSAGES["urbanistica_expert"]
 
     @staticmethod
     def format_prompt(template: str, **kwargs) -> str:
@@ -275,10 +386,81 @@ Fornisci i dati in formato strutturato:"""
         Returns:
             Prompt formattato
         """
-        return template.format(**kwargs)
+        # Payload grandi o non hashable: formattazione diretta
+        if sum(len(str(value)) for value in kwargs.values()) > _FORMAT_CACHE_MAX_PAYLOAD:
+            return _render(template, kwargs)
+        
+        try:
+            return _format_cached(template, frozenset(kwargs.items()))
+        except TypeError:
+            return _render(template, kwargs)
+    
+    @classmethod
+    def render(cls, name: str, **kwargs) -> str:
+        """
+        Formatta il template `name` (es. "COMPLIANCE_CHECK") con i parametri forniti.
+        
+        Args:
+            name: Nome del template
+            **kwargs: Parametri per il template
+            
+        Returns:
+            Prompt formattato
+        """
+        return cls.format_prompt(getattr(cls, name), **kwargs)
+    
+    @staticmethod
+    def cache_info():
+        """Statistiche della cache dei prompt formattati."""
+        return _format_cached.cache_info()
+    
+    @staticmethod
+    def to_prompt_json(obj: Any) -> str:
+        """
+        Serializza dati strutturati in JSON compatto per l'inserimento nel prompt.
+        
+        Rispetto a `str(dict)` produce un formato non ambiguo e con meno token;
+        i tipi non nativi (Path, datetime, array numpy) sono convertiti in stringa.
+        
+        Args:
+            obj: Oggetto da serializzare
+            
+        Returns:
+            Stringa JSON
+        """
+        return orjson.dumps(
+            obj,
+            default=str,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        ).decode("utf-8")
     
     @staticmethod
-    def get_system_message(role: str = "urbanistica_expert") -> str:
+    def truncate_tokens(text: str, max_tokens: int) -> str:
+        """
+        Tronca un testo a un numero massimo di token del modello.
+        
+        Args:
+            text: Testo da troncare
+            max_tokens: Numero massimo di token
+            
+        Returns:
+            Testo troncato
+        """
+        # Ogni token copre almeno un byte UTF-8: i testi corti non vanno tokenizzati
+        if len(text.encode("utf-8")) <= max_tokens:
+            return text
+        
+        encoder = _get_encoder()
+        if encoder is None:
+            return text[:max_tokens * _APPROX_CHARS_PER_TOKEN]
+        
+        ids = encoder.encode(text)
+        if len(ids) <= max_tokens:
+            return text
+        return encoder.decode(ids[:max_tokens])
+    
+    @classmethod
+    def get_system_message(cls, role: str = "urbanistica_expert") -> str:
         """
         Ottiene il messaggio di sistema per un ruolo specifico.
         
@@ -288,27 +470,11 @@ Fornisci i dati in formato strutturato:"""
         Returns:
             System message
         """
-        system_messages = {
-            "urbanistica_expert": """Sei un esperto di urbanistica ed edilizia con 20 anni di esperienza.
-Conosci perfettamente il Testo Unico dell'Edilizia (DPR 380/2001) e tutte le normative regionali e comunali italiane.
-Fornisci sempre risposte precise, citate con riferimenti normativi esatti.
-Usa un linguaggio tecnico ma comprensibile.
-Quando rilevi difformità, specifica sempre la gravità e le possibili soluzioni.""",
+        return cls._SYSTEM_MESSAGES.get(role, cls._DEFAULT_SYSTEM_MESSAGE)
 
-            "perito_tecnico": """Sei un perito tecnico specializzato in rilievi e verifiche di conformità edilizia.
-Analizzi planimetrie, progetti e foto con occhio esperto.
-Rilevi anche le più piccole discrepanze tra documentazione e stato di fatto.
-Fornisci analisi tecniche dettagliate e misurate.""",
 
-            "legal_advisor": """Sei un consulente legale specializzato in diritto urbanistico ed edilizio.
-Interpreti le normative con rigore giuridico.
-Fornisci pareri su conformità, sanatorie e procedure amministrative.
-Citi sempre le fonti normative con precisione.""",
-
-            "report_writer": """Sei un redattore tecnico specializzato in report di conformità urbanistica.
-Scrivi report chiari, strutturati e professionali.
-Usi un linguaggio tecnico appropriato ma accessibile.
-Organizzi le informazioni in modo logico e completo."""
-        }
-        
-        return system_messages.get(role, system_messages["urbanistica_expert"])
+# Frammenti dei template analizzati all'import: nessun template viene
+# riscansionato alla prima richiesta
+for _name, _template in vars(PromptTemplates).items():
+    if _name.isupper() and isinstance(_template, str):
+        _parse_template(_template)
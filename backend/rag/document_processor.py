@@ -1,34 +1,138 @@
 """
 Processore documenti normativi con chunking intelligente.
 """
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any, Optional
+from typing import Iterator, List, Dict, Any, Optional, Tuple
 from datetime import datetime
+import os
+import queue
 import re
+import threading
+import xxhash
 from loguru import logger
 
-from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import (
     PyPDFLoader,
+    PyPDFium2Loader,
     UnstructuredHTMLLoader,
     TextLoader
 )
 from langchain_core.documents import Document
 
 from backend.config import CHUNKING_CONFIG
+from backend.rag.text_splitter import SinglePassTextSplitter
+
+
+# Pattern compilati una volta sola (usati su ogni pagina/chunk)
+# Normalizzazioni di riferimenti ad articoli/commi e caratteri nulli in una
+# sola scansione: il gruppo che ha fatto match sceglie la sostituzione
+_NORMALIZE_RE = re.compile(r'(art\.\s*)|(comma\s+)|\x00', re.IGNORECASE)
+_NORMALIZE_REPL = {1: 'Articolo ', 2: 'comma ', None: ''}
+# Intestazione di articolo: a inizio riga o, nel testo preprocessato (senza
+# a capo), subito dopo la fine di una frase; i richiami nel testo
+# ("ai sensi dell'articolo 5") non sono confini. Serve solo l'inizio del match
+_ARTICLE_HEAD_RE = re.compile(
+    r'(?:^|(?<=[.:;]\s))[ \t]*Art(?:icolo)?\s+\d+',
+    re.IGNORECASE | re.MULTILINE
+)
+_ARTICLE_NUM_RE = re.compile(r'Art(?:icolo)?\s+(\d+)', re.IGNORECASE)
+_LAW_RE = re.compile(
+    r'(L\.R\.|Legge Regionale|D\.P\.R\.|Decreto)\s+n?\s*(\d+)[/\s]+(\d{4})',
+    re.IGNORECASE
+)
+
+
+# Estensioni dei file normativi supportati
+_EXTS = frozenset({".pdf", ".html", ".htm", ".txt"})
+
+
+def _normalize_token(match: re.Match) -> str:
+    return _NORMALIZE_REPL[match.lastindex]
+
+
+def _preprocess(
+    text: str,
+    _normalize=_NORMALIZE_RE.sub,
+    _token=_normalize_token,
+    _join=' '.join
+) -> str:
+    """Implementazione di `preprocess_text` (metodi già risolti come default)."""
+    # Normalizza riferimenti ad articoli ("art." → "Articolo") e commi,
+    # rimuovendo i caratteri nulli: una sola passata sul testo
+    text = _normalize(_token, text)
+    
+    # Rimuovi whitespace multipli (e iniziali/finali) per ultimo, così da
+    # comprimere anche gli spazi lasciati dalle sostituzioni
+    return _join(text.split())
+
+
+def _scan_normative_files(directory: Path, recursive: bool = True) -> Iterator[Path]:
+    """
+    File normativi in una directory, con una sola `os.scandir` per livello.
+    
+    `DirEntry.is_file`/`is_dir` usano il tipo restituito dalla scansione:
+    nessuna `stat` aggiuntiva per file, e i file con altre estensioni sono
+    scartati senza ulteriori controlli.
+    """
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                if recursive:
+                    yield from _scan_normative_files(Path(entry.path), recursive)
+            elif (
+                os.path.splitext(entry.name)[1].lower() in _EXTS
+                and entry.is_file(follow_symlinks=False)
+            ):
+                yield Path(entry.path)
 
 
 class NormativeDocumentProcessor:
     """Processore per documenti normativi."""
     
     def __init__(self):
-        self.text_splitter = RecursiveCharacterTextSplitter(
+        # Tutti i separatori trovati con una sola scansione per documento
+        self.text_splitter = SinglePassTextSplitter(
             chunk_size=CHUNKING_CONFIG["chunk_size"],
             chunk_overlap=CHUNKING_CONFIG["chunk_overlap"],
             separators=CHUNKING_CONFIG["separators"],
             keep_separator=CHUNKING_CONFIG["keep_separator"]
         )
         
+    @staticmethod
+    def _get_loader(file_path: Path):
+        """Loader LangChain adatto al formato del file."""
+        suffix = file_path.suffix.lower()
+        
+        if suffix == ".pdf":
+            # pdfium (C++) estrae il testo molto più velocemente di pypdf
+            return PyPDFium2Loader(str(file_path))
+        elif suffix in [".html", ".htm"]:
+            return UnstructuredHTMLLoader(str(file_path))
+        elif suffix == ".txt":
+            return TextLoader(str(file_path), encoding="utf-8")
+        else:
+            raise ValueError(f"Formato file non supportato: {suffix}")
+    
+    def _lazy_load(self, file_path: Path) -> Iterator[Document]:
+        """Pagine del file, con fallback a pypdf se pdfium non apre il PDF."""
+        loader = self._get_loader(file_path)
+        if not isinstance(loader, PyPDFium2Loader):
+            yield from loader.lazy_load()
+            return
+        
+        pages = loader.lazy_load()
+        try:
+            first = next(pages, None)
+        except Exception as e:
+            logger.warning(f"pdfium non riesce ad aprire {file_path.name} ({e}), uso pypdf")
+            yield from PyPDFLoader(str(file_path)).lazy_load()
+            return
+        
+        if first is not None:
+            yield first
+            yield from pages
+    
     def load_document(self, file_path: Path) -> List[Document]:
         """
         Carica un documento normativo.
@@ -41,19 +145,8 @@ class NormativeDocumentProcessor:
         """
         logger.info(f"Caricamento documento: {file_path}")
         
-        suffix = file_path.suffix.lower()
-        
         try:
-            if suffix == ".pdf":
-                loader = PyPDFLoader(str(file_path))
-            elif suffix in [".html", ".htm"]:
-                loader = UnstructuredHTMLLoader(str(file_path))
-            elif suffix == ".txt":
-                loader = TextLoader(str(file_path), encoding="utf-8")
-            else:
-                raise ValueError(f"Formato file non supportato: {suffix}")
-            
-            documents = loader.load()
+            documents = list(self._lazy_load(file_path))
             logger.success(f"Caricati {len(documents)} documenti da {file_path.name}")
             return documents
             
@@ -61,13 +154,36 @@ class NormativeDocumentProcessor:
             logger.error(f"Errore nel caricamento di {file_path}: {e}")
             raise
     
+    def iter_documents(self, file_path: Path) -> Iterator[Document]:
+        """
+        Come `load_document`, ma restituisce le pagine una alla volta.
+        
+        Con `lazy_load` le pagine di un PDF non vengono materializzate tutte
+        insieme: la memoria resta costante anche per documenti di centinaia
+        di pagine.
+        
+        Args:
+            file_path: Path al file da caricare
+            
+        Yields:
+            Documenti LangChain (una pagina per i PDF)
+        """
+        logger.info(f"Caricamento documento: {file_path}")
+        
+        try:
+            yield from self._lazy_load(file_path)
+        except Exception as e:
+            logger.error(f"Errore nel caricamento di {file_path}: {e}")
+            raise
+    
     def extract_metadata(
         self,
         document: Document,
         normative_level: str,
         region: Optional[str] = None,
         province: Optional[str] = None,
-        municipality: Optional[str] = None
+        municipality: Optional[str] = None,
+        processed_date: Optional[str] = None
     ) -> Dict[str, Any]:
         """
         Estrae metadati da un documento normativo.
@@ -78,6 +194,7 @@ class NormativeDocumentProcessor:
             region: Regione (per normative regionali/comunali)
             province: Provincia (per normative provinciali/comunali)
             municipality: Comune (per normative comunali)
+            processed_date: Timestamp ISO del processing (default: adesso)
             
         Returns:
             Dizionario con metadati estratti
@@ -87,21 +204,17 @@ class NormativeDocumentProcessor:
             "region": region,
             "province": province,
             "municipality": municipality,
-            "processed_date": datetime.now().isoformat()
+            "processed_date": processed_date or datetime.now().isoformat()
         }
         
         # Estrai numero articolo se presente
         text = document.page_content
-        article_match = re.search(r'Art(?:icolo)?\s+(\d+)', text, re.IGNORECASE)
+        article_match = _ARTICLE_NUM_RE.search(text)
         if article_match:
             metadata["article"] = article_match.group(1)
         
         # Estrai riferimenti a leggi
-        law_match = re.search(
-            r'(L\.R\.|Legge Regionale|D\.P\.R\.|Decreto)\s+n?\s*(\d+)[/\s]+(\d{4})',
-            text,
-            re.IGNORECASE
-        )
+        law_match = _LAW_RE.search(text)
         if law_match:
             metadata["law_type"] = law_match.group(1)
             metadata["law_number"] = law_match.group(2)
@@ -151,35 +264,38 @@ class NormativeDocumentProcessor:
         """
         text = document.page_content
         
-        # Pattern per identificare inizio articoli
-        article_pattern = r'(Art(?:icolo)?\s+\d+[^\n]*)'
+        # Prefiltro senza motore regex: servono almeno due intestazioni,
+        # ognuna contiene "art" (frontespizi e pagine vuote escono qui)
+        if text.lower().count("art") < 2:
+            return []
         
-        # Trova tutti gli articoli
-        matches = list(re.finditer(article_pattern, text, re.IGNORECASE))
+        # Inizi di articolo più la fine del testo: ogni articolo è la fetta
+        # tra due posizioni consecutive
+        positions = [match.start() for match in _ARTICLE_HEAD_RE.finditer(text)]
         
-        if len(matches) < 2:
+        if len(positions) < 2:
             return []  # Non abbastanza articoli, usa chunking standard
         
+        positions.append(len(text))
+        
+        # Metadati della pagina condivisi dai chunk degli articoli interi (non
+        # vengono modificati nel percorso di indicizzazione); un nuovo dict
+        # solo per le parti di articolo, che aggiungono `article_part`
+        parent_meta = document.metadata
+        
         chunks = []
-        for i, match in enumerate(matches):
-            start = match.start()
-            end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
-            
+        for start, end in zip(positions, positions[1:]):
             article_text = text[start:end].strip()
             
             # Se l'articolo è troppo lungo, dividilo ulteriormente
             if len(article_text) > CHUNKING_CONFIG["chunk_size"] * 1.5:
-                sub_chunks = self.text_splitter.create_documents([article_text])
-                for j, sub_chunk in enumerate(sub_chunks):
-                    sub_chunk.metadata = document.metadata.copy()
-                    sub_chunk.metadata["article_part"] = j + 1
-                    chunks.append(sub_chunk)
+                for j, part in enumerate(self.text_splitter.split_text(article_text)):
+                    chunks.append(Document(
+                        page_content=part,
+                        metadata={**parent_meta, "article_part": j + 1}
+                    ))
             else:
-                chunk = Document(
-                    page_content=article_text,
-                    metadata=document.metadata.copy()
-                )
-                chunks.append(chunk)
+                chunks.append(Document(page_content=article_text, metadata=parent_meta))
         
         return chunks
     
@@ -193,47 +309,37 @@ class NormativeDocumentProcessor:
         Returns:
             Testo preprocessato
         """
-        # Rimuovi whitespace multipli
-        text = re.sub(r'\s+', ' ', text)
-        
-        # Normalizza riferimenti ad articoli
-        text = re.sub(r'art\.\s*', 'Articolo ', text, flags=re.IGNORECASE)
-        
-        # Normalizza riferimenti a commi
-        text = re.sub(r'comma\s+', 'comma ', text, flags=re.IGNORECASE)
-        
-        # Rimuovi caratteri speciali problematici
-        text = text.replace('\x00', '')
-        
-        return text.strip()
+        return _preprocess(text)
     
-    def process_normative_file(
+    def iter_process_normative_file(
         self,
         file_path: Path,
         normative_level: str,
         region: Optional[str] = None,
         municipality: Optional[str] = None,
         province: Optional[str] = None
-    ) -> List[Document]:
+    ) -> Iterator[Document]:
         """
-        Processa completamente un file normativo.
+        Come `process_normative_file`, ma restituisce i chunk man mano.
         
         Args:
             file_path: Path al file
             normative_level: Livello normativo
             region: Regione (opzionale)
             municipality: Comune (opzionale)
+            province: Provincia (opzionale)
             
-        Returns:
-            Lista di chunk processati e pronti per l'indicizzazione
+        Yields:
+            Chunk processati e pronti per l'indicizzazione
         """
         logger.info(f"Inizio processing di {file_path.name}")
         
-        # Carica documento
-        documents = self.load_document(file_path)
+        # Un solo timestamp per tutte le pagine del file
+        processed_date = datetime.now().isoformat()
         
-        all_chunks = []
-        for doc in documents:
+        seen = set()
+        # Pagine caricate e processate una alla volta
+        for doc in self.iter_documents(file_path):
             # Preprocessa testo
             doc.page_content = self.preprocess_text(doc.page_content)
             
@@ -242,13 +348,45 @@ class NormativeDocumentProcessor:
                 doc,
                 normative_level,
                 region,
-                municipality
+                province=province,
+                municipality=municipality,
+                processed_date=processed_date
             )
             doc.metadata = metadata
             
-            # Chunking
-            chunks = self.chunk_document(doc)
-            all_chunks.extend(chunks)
+            # Chunking, scartando i chunk identici a uno già emesso
+            # (intestazioni, avvertenze ripetute): non vanno re-indicizzati
+            for chunk in self.chunk_document(doc):
+                digest = xxhash.xxh3_64_intdigest(chunk.page_content)
+                if digest in seen:
+                    continue
+                seen.add(digest)
+                yield chunk
+    
+    def process_normative_file(
+        self,
+        file_path: Path,
+        normative_level: str,
+        region: Optional[str] = None,
+        municipality: Optional[str] = None,
+        province: Optional[str] = None
+    ) -> List[Document]:
+        """
+        Processa completamente un file normativo.
+        
+        Args:
+            file_path: Path al file
+            normative_level: Livello normativo
+            region: Regione (opzionale)
+            municipality: Comune (opzionale)
+            province: Provincia (opzionale)
+            
+        Returns:
+            Lista di chunk processati e pronti per l'indicizzazione
+        """
+        all_chunks = list(self.iter_process_normative_file(
+            file_path, normative_level, region, municipality, province
+        ))
         
         logger.success(
             f"Processing completato: {len(all_chunks)} chunk da {file_path.name}"
@@ -256,6 +394,55 @@ class NormativeDocumentProcessor:
         
         return all_chunks
     
+    def _iter_directory_chunks(
+        self,
+        directory: Path,
+        normative_level: str,
+        region: Optional[str] = None,
+        municipality: Optional[str] = None,
+        recursive: bool = True
+    ) -> Iterator[List[Document]]:
+        """
+        Processa i file di una directory in parallelo.
+        
+        Yields:
+            Chunk di ciascun file, nell'ordine dei file
+        """
+        files = list(_scan_normative_files(directory, recursive))
+        
+        if not files:
+            logger.info("Nessun file normativo da processare")
+            return
+        
+        # Parsing PDF e regex sono CPU-bound e indipendenti per file: un
+        # processo per core aggira il GIL
+        max_workers = min(os.cpu_count() or 1, len(files))
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    self.process_normative_file,
+                    file_path,
+                    normative_level,
+                    region,
+                    municipality
+                )
+                for file_path in files
+            ]
+            
+            # Risultati restituiti nell'ordine dei file
+            try:
+                for file_path, future in zip(files, futures):
+                    try:
+                        yield future.result()
+                    except Exception as e:
+                        logger.error(f"Errore nel processing di {file_path}: {e}")
+                        continue
+            finally:
+                # Generatore chiuso in anticipo: i file non ancora avviati
+                # non vanno processati
+                for future in futures:
+                    future.cancel()
+    
     def process_directory(
         self,
         directory: Path,
@@ -279,25 +466,135 @@ class NormativeDocumentProcessor:
         """
         logger.info(f"Processing directory: {directory}")
         
-        pattern = "**/*" if recursive else "*"
         all_chunks = []
-        
-        for file_path in directory.glob(pattern):
-            if file_path.is_file() and file_path.suffix.lower() in [".pdf", ".html", ".htm", ".txt"]:
-                try:
-                    chunks = self.process_normative_file(
-                        file_path,
-                        normative_level,
-                        region,
-                        municipality
-                    )
-                    all_chunks.extend(chunks)
-                except Exception as e:
-                    logger.error(f"Errore nel processing di {file_path}: {e}")
-                    continue
+        for chunks in self._iter_directory_chunks(
+            directory, normative_level, region, municipality, recursive
+        ):
+            all_chunks.extend(chunks)
         
         logger.success(
             f"Directory processing completato: {len(all_chunks)} chunk totali"
         )
         
         return all_chunks
+    
+    def iter_chunks_batched(
+        self,
+        directory: Path,
+        normative_level: str,
+        region: Optional[str] = None,
+        municipality: Optional[str] = None,
+        recursive: bool = True,
+        batch_size: Optional[int] = None
+    ) -> Iterator[List[Document]]:
+        """
+        Come `process_directory`, ma restituisce i chunk a batch di dimensione fissa.
+        
+        Ogni batch è pensato per un solo forward pass di embedding, ad esempio
+        `embeddings.embed_documents([c.page_content for c in batch])`, senza
+        materializzare tutti i chunk della directory.
+        
+        Args:
+            directory: Directory da processare
+            normative_level: Livello normativo
+            region: Regione (opzionale)
+            municipality: Comune (opzionale)
+            recursive: Se True, processa anche le sottodirectory
+            batch_size: Chunk per batch (default: CHUNKING_CONFIG["batch_size"])
+            
+        Yields:
+            Batch di chunk (l'ultimo può essere più corto)
+        """
+        batch_size = batch_size or CHUNKING_CONFIG["batch_size"]
+        logger.info(f"Processing directory a batch di {batch_size}: {directory}")
+        
+        buf: List[Document] = []
+        for chunks in self._iter_directory_chunks(
+            directory, normative_level, region, municipality, recursive
+        ):
+            buf.extend(chunks)
+            while len(buf) >= batch_size:
+                yield buf[:batch_size]
+                buf = buf[batch_size:]
+        
+        if buf:
+            yield buf
+    
+    def stream_to_embedder(
+        self,
+        directory: Path,
+        embedder,
+        normative_level: str,
+        region: Optional[str] = None,
+        municipality: Optional[str] = None,
+        recursive: bool = True,
+        batch_size: Optional[int] = None,
+        max_pending: int = 4
+    ) -> Iterator[Tuple[List[Document], List[List[float]]]]:
+        """
+        Processa una directory e calcola gli embedding dei chunk in pipeline.
+        
+        Un thread produttore esegue `iter_chunks_batched` e accoda i batch;
+        il chiamante li codifica con `embedder.embed_documents` mentre i file
+        successivi vengono ancora processati. L'encoding rilascia il GIL
+        (PyTorch/ONNX Runtime), quindi le due fasi si sovrappongono; la coda
+        limitata tiene in memoria al più `max_pending` batch.
+        
+        Args:
+            directory: Directory da processare
+            embedder: Modello di embedding LangChain (`embed_documents`)
+            normative_level: Livello normativo
+            region: Regione (opzionale)
+            municipality: Comune (opzionale)
+            recursive: Se True, processa anche le sottodirectory
+            batch_size: Chunk per batch (default: CHUNKING_CONFIG["batch_size"])
+            max_pending: Batch processati in attesa di encoding
+            
+        Yields:
+            Coppie (batch di chunk, embedding del batch)
+        """
+        batches: queue.Queue = queue.Queue(maxsize=max_pending)
+        stop = threading.Event()
+        done = object()
+        
+        def _put(item) -> bool:
+            # Attesa interrompibile: il consumatore può smettere di leggere
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+        
+        def _produce():
+            try:
+                for batch in self.iter_chunks_batched(
+                    directory, normative_level, region, municipality,
+                    recursive, batch_size
+                ):
+                    if not _put(batch):
+                        return
+            except Exception as e:
+                _put(e)
+                return
+            _put(done)
+        
+        producer = threading.Thread(target=_produce, name="chunk-producer", daemon=True)
+        producer.start()
+        
+        try:
+            while True:
+                batch = batches.get()
+                if batch is done:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                
+                embeddings = embedder.embed_documents(
+                    [chunk.page_content for chunk in batch]
+                )
+                yield batch, embeddings
+        finally:
+            stop.set()
+            producer.join()
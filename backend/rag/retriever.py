@@ -2,7 +2,13 @@
 Sistema di retrieval avanzato per normative.
 Implementa hybrid search e re-ranking.
 """
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, FrozenSet, Optional
+from concurrent.futures import ThreadPoolExecutor
+from itertools import zip_longest
+import re
+import numpy as np
+import orjson
+import xxhash
 from loguru import logger
 
 from langchain_core.documents import Document
@@ -12,6 +18,54 @@ from langchain_openai import ChatOpenAI
 
 from backend.rag.vector_store import MultiLevelVectorStore
 from backend.config import get_settings, RETRIEVAL_CONFIG
+from backend.models.llm_router import get_async_http_client, get_http_client, get_rate_limiter
+
+
+# Parole (lettere/cifre) per il keyword matching
+_WORD_RE = re.compile(r"\w+")
+
+# Stopwords italiane comuni, escluse dalle keyword della query
+_STOPWORDS = frozenset({
+    'il', 'lo', 'la', 'i', 'gli', 'le', 'un', 'uno', 'una',
+    'di', 'a', 'da', 'in', 'con', 'su', 'per', 'tra', 'fra',
+    'è', 'sono', 'sia', 'come', 'quale', 'quali', 'che', 'cosa'
+})
+_MIN_KEYWORD_LEN = 3
+
+# Caratteri per documento inviati al re-ranking (contesto limitato)
+_RERANK_MAX_CHARS = 500
+
+_RERANK_PROMPT = PromptTemplate.from_template(
+    """Valuta la pertinenza di ciascun documento normativo rispetto alla query.
+
+Query: {query}
+
+Documenti:
+{documents}
+
+Rispondi SOLO con un array JSON con un elemento per documento, nella forma
+[{{"id": <numero del documento>, "score": <pertinenza da 0 a 1>}}]"""
+)
+
+
+def _top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indici dei `k` score più alti, in ordine decrescente e stabile.
+    
+    Equivale a `np.argsort(-scores, kind="stable")[:k]`, ma ordina solo i
+    candidati selezionati da `argpartition` (O(n) invece di O(n log n)).
+    """
+    n = len(scores)
+    if k >= n:
+        return np.argsort(-scores, kind="stable")
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    
+    # Soglia del k-esimo score: tutti i pari merito restano candidati,
+    # così l'ordine a parità è quello originale come con l'ordinamento stabile
+    threshold = scores[np.argpartition(-scores, k - 1)[:k]].min()
+    candidates = np.flatnonzero(scores >= threshold)
+    return candidates[np.argsort(-scores[candidates], kind="stable")][:k]
 
 
 class NormativeRetriever:
@@ -32,7 +86,9 @@ class NormativeRetriever:
         self.llm = ChatOpenAI(
             model="gpt-3.5-turbo",
             temperature=0,
-            api_key=settings.openai_api_key
+            api_key=settings.openai_api_key,
+            http_client=get_http_client(),
+            http_async_client=get_async_http_client()
         )
         
         logger.info("Normative retriever inizializzato")
@@ -45,7 +101,8 @@ class NormativeRetriever:
         province: Optional[str] = None,
         normative_level: Optional[str] = None,
         top_k: Optional[int] = None,
-        use_rerank: Optional[bool] = None
+        use_rerank: Optional[bool] = None,
+        query_embedding: Optional[List[float]] = None
     ) -> List[Document]:
         """
         Recupera documenti normativi rilevanti.
@@ -58,6 +115,7 @@ class NormativeRetriever:
             normative_level: Livello specifico (se None, cerca gerarchicamente)
             top_k: Numero di risultati (default da config)
             use_rerank: Se True, applica re-ranking (default da config)
+            query_embedding: Embedding della query già calcolato (opzionale)
             
         Returns:
             Lista di documenti rilevanti ordinati per rilevanza
@@ -76,7 +134,8 @@ class NormativeRetriever:
                 municipality,
                 region,
                 province,
-                top_k
+                top_k,
+                query_embedding
             )
         else:
             # Ricerca gerarchica
@@ -85,7 +144,8 @@ class NormativeRetriever:
                 municipality=municipality,
                 region=region,
                 province=province,
-                k=top_k * 2  # Recupera più documenti per il re-ranking
+                k=top_k * 2,  # Recupera più documenti per il re-ranking
+                embedding=query_embedding
             )
         
         # Hybrid search (combina semantico + keyword)
@@ -100,10 +160,90 @@ class NormativeRetriever:
         if self.config["score_threshold"]:
             documents = self._filter_by_score(documents)
         
-        self.last_retrieved_docs = documents[:top_k]
         logger.success(f"Recuperati {len(documents)} documenti rilevanti")
         return documents[:top_k]
     
+    def retrieve_batch(
+        self,
+        queries: List[str],
+        municipality: Optional[str] = None,
+        region: Optional[str] = None,
+        province: Optional[str] = None,
+        top_k: Optional[int] = None
+    ) -> List[List[Document]]:
+        """
+        Esegue più retrieval con un unico encoding batch delle query.
+        
+        Gli embedding di tutte le query sono calcolati con un solo forward
+        pass del modello; le ricerche vettoriali (indipendenti) sono poi
+        eseguite in parallelo.
+        
+        Args:
+            queries: Lista di query di ricerca
+            municipality: Comune per ricerca gerarchica
+            region: Regione per ricerca gerarchica
+            province: Provincia per ricerca gerarchica
+            top_k: Numero di risultati per query
+            
+        Returns:
+            Lista di risultati, uno per query, nello stesso ordine
+        """
+        if not queries:
+            return []
+        
+        embeddings = self.vector_store.embed_queries(queries)
+        
+        def _run(query: str, embedding: List[float]) -> List[Document]:
+            return self.retrieve(
+                query,
+                municipality=municipality,
+                region=region,
+                province=province,
+                top_k=top_k,
+                query_embedding=embedding
+            )
+        
+        with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+            return list(executor.map(_run, queries, embeddings))
+    
+    def merge_results(
+        self,
+        results: List[List[Document]],
+        max_docs: Optional[int] = None
+    ) -> List[Document]:
+        """
+        Unisce i risultati di più query eliminando i chunk duplicati.
+        
+        I documenti sono ordinati per miglior posizione ottenuta in una
+        qualsiasi delle query; i duplicati (stesso inizio del contenuto,
+        hash xxh64 dei primi 512 caratteri) vengono scartati.
+        
+        Args:
+            results: Liste di documenti, una per query, ordinate per rilevanza
+            max_docs: Numero massimo di documenti restituiti (opzionale)
+            
+        Returns:
+            Lista unica di documenti senza duplicati
+        """
+        seen = set()
+        merged = []
+        
+        # Scansione per rango: prima tutti i primi risultati, poi i secondi, ...
+        for rank_docs in zip_longest(*results):
+            for doc in rank_docs:
+                if doc is None:
+                    continue
+                key = xxhash.xxh64_intdigest(doc.page_content[:512])
+                if key in seen:
+                    continue
+                seen.add(key)
+                merged.append(doc)
+        
+        if len(merged) < sum(len(docs) for docs in results):
+            logger.debug(f"Deduplicazione: {len(merged)} documenti unici")
+        
+        return merged[:max_docs] if max_docs else merged
+    
     def _search_specific_level(
         self,
         query: str,
@@ -111,7 +251,8 @@ class NormativeRetriever:
         municipality: Optional[str],
         region: Optional[str],
         province: Optional[str],
-        k: int
+        k: int,
+        embedding: Optional[List[float]] = None
     ) -> List[Document]:
         """Ricerca su un livello normativo specifico."""
         filter_dict = {}
@@ -135,9 +276,9 @@ class NormativeRetriever:
 
         
         if filter_dict:
-            return store.search(query, k=k, filter_dict=filter_dict)
+            return store.search(query, k=k, filter_dict=filter_dict, embedding=embedding)
         else:
-            return store.search(query, k=k)
+            return store.search(query, k=k, embedding=embedding)
     
     def _hybrid_search(
         self,
@@ -156,61 +297,67 @@ class NormativeRetriever:
         Returns:
             Risultati combinati
         """
-        # Estrai keyword dalla query
-        keywords = self._extract_keywords(query)
+        if not semantic_results:
+            return []
         
-        # Score semantico (normalizzato)
-        semantic_scores = {
-            i: 1.0 - (i / len(semantic_results))
-            for i in range(len(semantic_results))
-        }
+        # Estrai keyword dalla query (insieme: match con un'intersezione)
+        keywords = frozenset(self._extract_keywords(query))
+        
+        n = len(semantic_results)
+        
+        # Score semantico (normalizzato sul rango)
+        semantic_scores = 1.0 - np.arange(n, dtype=np.float32) / n
         
         # Score keyword
-        keyword_scores = {}
-        for i, doc in enumerate(semantic_results):
-            score = self._keyword_match_score(doc.page_content, keywords)
-            keyword_scores[i] = score
+        keyword_scores = np.fromiter(
+            (self._keyword_match_score(doc.page_content, keywords) for doc in semantic_results),
+            dtype=np.float32,
+            count=n
+        )
         
-        # Combina score
+        # Combina score in un'unica operazione vettoriale
         keyword_weight = self.config["keyword_weight"]
-        semantic_weight = 1.0 - keyword_weight
-        
-        combined_scores = {
-            i: (semantic_weight * semantic_scores[i] + 
-                keyword_weight * keyword_scores[i])
-            for i in range(len(semantic_results))
-        }
-        
-        # Ordina per score combinato
-        sorted_indices = sorted(
-            combined_scores.keys(),
-            key=lambda i: combined_scores[i],
-            reverse=True
-        )
+        if self.config.get("fusion") == "rrf":
+            # Reciprocal rank fusion: conta solo la posizione in ciascuna lista
+            ranks = np.arange(n, dtype=np.float32)
+            keyword_ranks = np.empty(n, dtype=np.float32)
+            keyword_ranks[np.argsort(-keyword_scores, kind="stable")] = ranks
+            rrf_k = self.config.get("rrf_k", 60)
+            combined_scores = (
+                (1.0 - keyword_weight) / (rrf_k + ranks)
+                + keyword_weight / (rrf_k + keyword_ranks)
+            )
+        else:
+            combined_scores = (1.0 - keyword_weight) * semantic_scores + keyword_weight * keyword_scores
         
-        return [semantic_results[i] for i in sorted_indices[:top_k]]
+        # Ordina per score combinato (stabile: a parità resta l'ordine semantico)
+        sorted_indices = _top_k_indices(combined_scores, top_k)
+        
+        return [semantic_results[i] for i in sorted_indices]
     
     def _extract_keywords(self, query: str) -> List[str]:
         """Estrae keyword rilevanti dalla query."""
-        # Rimuovi stopwords italiane comuni
-        stopwords = {
-            'il', 'lo', 'la', 'i', 'gli', 'le', 'un', 'uno', 'una',
-            'di', 'a', 'da', 'in', 'con', 'su', 'per', 'tra', 'fra',
-            'è', 'sono', 'sia', 'come', 'quale', 'quali', 'che', 'cosa'
-        }
-        
-        words = query.lower().split()
-        keywords = [w for w in words if w not in stopwords and len(w) > 2]
+        # Rimuovi stopwords italiane comuni e parole troppo corte
+        words = _WORD_RE.findall(query.lower())
+        keywords = [
+            w for w in words
+            if len(w) >= _MIN_KEYWORD_LEN and w not in _STOPWORDS
+        ]
         
         return keywords
     
-    def _keyword_match_score(self, text: str, keywords: List[str]) -> float:
-        """Calcola score di match per keyword."""
+    def _keyword_match_score(self, text: str, keywords: FrozenSet[str]) -> float:
+        """Calcola score di match per keyword (frazione di keyword trovate nel testo)."""
         if not keywords:
             return 0.0
         
         text_lower = text.lower()
-        matches = sum(1 for kw in keywords if kw in text_lower)
+        if self.config.get("keyword_match") == "token":
+            # Solo parole intere: una tokenizzazione del testo e un lookup
+            # hash per parola, invece di una ricerca di sottostringa per keyword
+            matches = len(keywords.intersection(_WORD_RE.findall(text_lower)))
+        else:
+            matches = sum(1 for kw in keywords if kw in text_lower)
         
         return matches / len(keywords)
     
@@ -234,31 +381,32 @@ class NormativeRetriever:
         logger.debug(f"Re-ranking {len(documents)} documenti")
         
         try:
-            # Usa LLMChainExtractor per compressione contestuale
-            compressor = LLMChainExtractor.from_llm(self.llm)
-            
-            # Crea retriever base (mock)
-            from langchain.retrievers import BaseRetriever
-            
-            class MockRetriever(BaseRetriever):
-                def __init__(self, docs):
-                    self.docs = docs
-                
-                def _get_relevant_documents(self, query: str) -> List[Document]:
-                    return self.docs
+            # Un solo prompt con tutti i candidati (troncati) invece di una
+            # chiamata LLM per documento
+            candidates = "\n".join(
+                f"[{i}] {doc.page_content[:_RERANK_MAX_CHARS]}"
+                for i, doc in enumerate(documents)
+            )
+            get_rate_limiter().acquire()
+            response = self.llm.invoke(
+                _RERANK_PROMPT.format(query=query, documents=candidates)
+            )
             
-            base_retriever = MockRetriever(documents)
+            content = response.content
+            ranking = orjson.loads(content[content.index("["):content.rindex("]") + 1])
             
-            # Applica compressione
-            compression_retriever = ContextualCompressionRetriever(
-                base_compressor=compressor,
-                base_retriever=base_retriever
-            )
+            # Documenti senza punteggio in coda, nell'ordine originale
+            scores = [0.0] * len(documents)
+            for item in ranking:
+                i = int(item["id"])
+                if 0 <= i < len(documents):
+                    scores[i] = float(item["score"])
             
-            reranked = compression_retriever.get_relevant_documents(query)
+            order = sorted(range(len(documents)), key=lambda i: -scores[i])
+            reranked = [documents[i] for i in order[:top_k]]
             
             logger.debug(f"Re-ranking completato: {len(reranked)} documenti")
-            return reranked[:top_k]
+            return reranked
             
         except Exception as e:
             logger.warning(f"Errore nel re-ranking, uso ordine originale: {e}")
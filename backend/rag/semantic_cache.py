@@ -0,0 +1,253 @@
+"""
+Cache semantica delle risposte basata sugli embeddings delle domande.
+Restituisce la risposta già generata per domande quasi identiche (parafrasi).
+"""
+import atexit
+import os
+import pickle
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+
+# Token "volatili" (date, numeri, misure): la risposta dipende dal valore esatto
+_VOLATILE_RE = re.compile(r"\d")
+
+
+class SemanticCache:
+    """Cache domanda → risposta con lookup per similarità coseno."""
+
+    def __init__(
+        self,
+        embeddings: Any,
+        threshold: float = 0.95,
+        max_entries: int = 1000,
+        cache_file: Optional[Path] = None,
+        ttl: float = 86_400,
+        generation: Optional[Callable[[], int]] = None,
+        save_delay: float = 5.0
+    ):
+        """
+        Inizializza la cache.
+
+        Args:
+            embeddings: Modello embeddings (interfaccia LangChain `embed_query`)
+            threshold: Similarità coseno minima per considerare un hit
+            max_entries: Numero massimo di risposte in cache
+            cache_file: File di persistenza (opzionale)
+            ttl: Durata massima di una risposta in cache (secondi)
+            generation: Contatore delle modifiche all'indice normativo;
+                quando cambia la cache viene svuotata
+            save_delay: Attesa prima di scrivere su disco, per raggruppare
+                più risposte in un solo salvataggio (secondi)
+        """
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.generation = generation
+        self.save_delay = save_delay
+
+        self._lock = threading.RLock()
+        self._vectors: Optional[np.ndarray] = None
+        self._entries: List[Tuple[Tuple[Optional[str], Optional[str]], str]] = []
+        # Istante di inserimento (epoch) di ogni voce, in ordine crescente
+        self._created = np.empty(0, dtype=np.float64)
+        self._seen_generation = generation() if generation else 0
+        self._save_timer: Optional[threading.Timer] = None
+
+        self._load()
+        if cache_file:
+            # Le risposte non ancora scritte non vanno perse all'uscita
+            atexit.register(self.flush)
+
+    @staticmethod
+    def is_cacheable(question: str) -> bool:
+        """Le domande con numeri o date non vengono messe in cache."""
+        return not _VOLATILE_RE.search(question)
+
+    def lookup(
+        self,
+        question: str,
+        municipality: Optional[str] = None,
+        region: Optional[str] = None
+    ) -> Optional[str]:
+        """
+        Cerca una risposta per una domanda semanticamente equivalente.
+
+        Args:
+            question: Domanda dell'utente
+            municipality: Comune
+            region: Regione
+
+        Returns:
+            Risposta in cache o None
+        """
+        if not self.is_cacheable(question):
+            return None
+
+        try:
+            vector = self._embed(question)
+        except Exception as e:
+            logger.warning(f"Cache semantica non disponibile: {e}")
+            return None
+
+        scope = (municipality, region)
+        with self._lock:
+            self._drop_stale()
+            if self._vectors is None:
+                return None
+
+            scores = self._vectors @ vector
+            for i in np.argsort(-scores):
+                if scores[i] < self.threshold:
+                    break
+                entry_scope, answer = self._entries[i]
+                if entry_scope == scope:
+                    logger.info(f"Cache semantica hit (similarità {scores[i]:.3f})")
+                    return answer
+
+        return None
+
+    def add(
+        self,
+        question: str,
+        answer: str,
+        municipality: Optional[str] = None,
+        region: Optional[str] = None
+    ):
+        """
+        Aggiunge una risposta alla cache.
+
+        Args:
+            question: Domanda dell'utente
+            answer: Risposta generata
+            municipality: Comune
+            region: Regione
+        """
+        if not self.is_cacheable(question):
+            return
+
+        try:
+            vector = self._embed(question)
+        except Exception as e:
+            logger.warning(f"Cache semantica non disponibile: {e}")
+            return
+
+        with self._lock:
+            self._drop_stale()
+            if self._vectors is None:
+                self._vectors = vector[np.newaxis, :]
+            else:
+                self._vectors = np.vstack([self._vectors, vector])
+            self._entries.append(((municipality, region), answer))
+            self._created = np.append(self._created, time.time())
+
+            # Evict delle voci più vecchie
+            if len(self._entries) > self.max_entries:
+                self._drop_oldest(len(self._entries) - self.max_entries)
+
+            self._schedule_save()
+
+    def clear(self):
+        """Svuota la cache (es. dopo un aggiornamento delle normative)."""
+        with self._lock:
+            self._vectors = None
+            self._entries = []
+            self._created = np.empty(0, dtype=np.float64)
+            self._schedule_save()
+
+    def flush(self):
+        """Scrive subito su disco le modifiche in attesa di salvataggio."""
+        with self._lock:
+            if self._save_timer is None:
+                return
+            self._save_timer.cancel()
+            self._save_timer = None
+            self._save()
+
+    def _drop_stale(self):
+        """Scarta le voci scadute o precedenti all'ultima modifica dell'indice."""
+        if self.generation is not None:
+            current = self.generation()
+            if current != self._seen_generation:
+                self._seen_generation = current
+                if self._entries:
+                    logger.info("Normative aggiornate: cache semantica svuotata")
+                    self.clear()
+                return
+
+        # Voci in ordine di inserimento: quelle scadute sono un prefisso
+        expired = int(np.searchsorted(self._created, time.time() - self.ttl, side="right"))
+        if expired:
+            self._drop_oldest(expired)
+            self._schedule_save()
+
+    def _drop_oldest(self, count: int):
+        """Rimuove le `count` voci più vecchie."""
+        if count >= len(self._entries):
+            self._vectors = None
+            self._entries = []
+            self._created = np.empty(0, dtype=np.float64)
+            return
+        self._vectors = self._vectors[count:]
+        self._entries = self._entries[count:]
+        self._created = self._created[count:]
+
+    def _schedule_save(self):
+        """Programma un salvataggio: le modifiche ravvicinate ne generano uno solo."""
+        if not self.cache_file or self._save_timer is not None:
+            return
+        self._save_timer = threading.Timer(self.save_delay, self._deferred_save)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+
+    def _deferred_save(self):
+        """Salvataggio eseguito dal timer."""
+        with self._lock:
+            self._save_timer = None
+            self._save()
+
+    def _embed(self, text: str) -> np.ndarray:
+        """Calcola l'embedding normalizzato di un testo."""
+        vector = np.asarray(self.embeddings.embed_query(text), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _load(self):
+        """Carica la cache dal file di persistenza."""
+        if not self.cache_file or not self.cache_file.exists():
+            return
+
+        try:
+            with self.cache_file.open("rb") as f:
+                self._vectors, self._entries, self._created = pickle.load(f)
+            logger.info(f"Cache semantica caricata: {len(self._entries)} voci")
+        except Exception as e:
+            logger.warning(f"Errore caricamento cache semantica: {e}")
+            self._vectors, self._entries = None, []
+            self._created = np.empty(0, dtype=np.float64)
+
+    def _save(self):
+        """Salva la cache sul file di persistenza (scrittura atomica)."""
+        if not self.cache_file:
+            return
+
+        # File temporaneo + rename: un lettore non vede mai un pickle a metà
+        tmp_file = self.cache_file.with_name(self.cache_file.name + ".tmp")
+        try:
+            with tmp_file.open("wb") as f:
+                pickle.dump(
+                    (self._vectors, self._entries, self._created),
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL
+                )
+            os.replace(tmp_file, self.cache_file)
+        except Exception as e:
+            logger.warning(f"Errore salvataggio cache semantica: {e}")
@@ -0,0 +1,156 @@
+"""
+Splitter di testo a passata singola per il chunking delle normative.
+"""
+from bisect import bisect_left, bisect_right
+from typing import Any, Dict, List, Optional
+import re
+
+from langchain_core.documents import Document
+
+
+class SinglePassTextSplitter:
+    """
+    Divide il testo in chunk con una sola scansione regex.
+
+    Tutti i separatori sono compilati in un'unica alternanza: una passata
+    trova ogni confine candidato con la sua priorità (l'ordine nella lista
+    dei separatori). I chunk vengono poi tagliati, entro `chunk_size`, sul
+    confine di priorità più alta nella seconda metà della finestra (così da
+    non produrre chunk troppo corti); senza confini si taglia a `chunk_size`
+    caratteri. Stessa configurazione di `RecursiveCharacterTextSplitter`,
+    senza le scansioni ripetute per separatore.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int,
+        chunk_overlap: int,
+        separators: List[str],
+        keep_separator: bool = True
+    ):
+        """
+        Inizializza lo splitter.
+
+        Args:
+            chunk_size: Lunghezza massima di un chunk (caratteri)
+            chunk_overlap: Sovrapposizione massima tra chunk consecutivi
+            separators: Separatori in ordine di priorità ("" = taglio netto)
+            keep_separator: Se True il separatore apre il chunk successivo
+        """
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+        self.keep_separator = keep_separator
+        # Un gruppo per separatore: `lastindex` ne dà la priorità
+        self._pattern = re.compile(
+            "|".join(f"({re.escape(sep)})" for sep in separators if sep)
+        )
+
+    def _boundaries(self, text: str) -> tuple[List[int], List[int]]:
+        """Posizioni di taglio candidate (ordinate) e relative priorità."""
+        positions = []
+        priorities = []
+        for match in self._pattern.finditer(text):
+            positions.append(match.start() if self.keep_separator else match.end())
+            priorities.append(match.lastindex)
+        return positions, priorities
+
+    def _best_cut(
+        self,
+        positions: List[int],
+        priorities: List[int],
+        start: int,
+        limit: int
+    ) -> int:
+        """Confine migliore in (start, limit], o `limit` se non ce ne sono."""
+        lo = bisect_right(positions, start)
+        hi = bisect_right(positions, limit)
+        if lo == hi:
+            return limit
+
+        mid = bisect_right(positions, start + self.chunk_size // 2, lo, hi)
+        if mid == hi:
+            mid = lo
+
+        # Priorità più alta; a parità, il confine più lontano
+        best = min(range(mid, hi), key=lambda i: (priorities[i], -positions[i]))
+        return positions[best]
+
+    def _next_start(self, positions: List[int], start: int, cut: int) -> int:
+        """Inizio del chunk successivo: primo confine nella zona di overlap."""
+        if not self.chunk_overlap:
+            return cut
+
+        i = bisect_left(positions, cut - self.chunk_overlap)
+        if i < len(positions) and start < positions[i] < cut:
+            return positions[i]
+        return cut
+
+    def split_text(self, text: str) -> List[str]:
+        """
+        Divide un testo in chunk.
+
+        Args:
+            text: Testo da dividere
+
+        Returns:
+            Lista di chunk (senza spazi iniziali/finali, vuoti esclusi)
+        """
+        length = len(text)
+        if length <= self.chunk_size:
+            text = text.strip()
+            return [text] if text else []
+
+        positions, priorities = self._boundaries(text)
+
+        chunks = []
+        start = 0
+        while start < length:
+            limit = start + self.chunk_size
+            cut = length if limit >= length else self._best_cut(positions, priorities, start, limit)
+
+            chunk = text[start:cut].strip()
+            if chunk:
+                chunks.append(chunk)
+            if cut >= length:
+                break
+
+            start = self._next_start(positions, start, cut)
+
+        return chunks
+
+    def create_documents(
+        self,
+        texts: List[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None
+    ) -> List[Document]:
+        """
+        Crea documenti chunk da una lista di testi.
+
+        Args:
+            texts: Testi da dividere
+            metadatas: Metadati per testo (copiati in ogni chunk)
+
+        Returns:
+            Lista di documenti chunk
+        """
+        metadatas = metadatas or [{}] * len(texts)
+        return [
+            Document(page_content=chunk, metadata=dict(metadata))
+            for text, metadata in zip(texts, metadatas)
+            for chunk in self.split_text(text)
+        ]
+
+    def split_documents(self, documents: List[Document]) -> List[Document]:
+        """
+        Divide documenti in chunk mantenendone i metadati.
+
+        Args:
+            documents: Documenti da dividere
+
+        Returns:
+            Lista di documenti chunk
+        """
+        return self.create_documents(
+            [doc.page_content for doc in documents],
+            [doc.metadata for doc in documents]
+        )
@@ -1,52 +1,322 @@
 """
 Vector store manager con ChromaDB per normative multi-livello.
 """
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
+import asyncio
+import threading
+import time
+import uuid
+import numpy as np
+import orjson
+from cachetools import TTLCache
 from loguru import logger
 
 import chromadb
-import chromadb
-# from chromadb.config import Settings as ChromaSettings (Removed)
 from langchain_community.vectorstores import Chroma
 from langchain_community.embeddings import HuggingFaceEmbeddings
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 
 from backend.config import get_settings
 
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+# Ricerche sui livelli normativi eseguite in parallelo (I/O Chroma ed encoding
+# rilasciano il GIL)
+_SEARCH_EXECUTOR = ThreadPoolExecutor(max_workers=8, thread_name_prefix="level-search")
+
+
+@lru_cache(maxsize=1)
+def get_chroma_client():
+    """
+    Client ChromaDB condiviso da tutte le collection del processo.
+    
+    Con `chroma_host` configurato gli indici vivono nel server Chroma (una
+    sola copia in RAM per tutti i worker, scritture senza lock sul file
+    SQLite locale); altrimenti usa il database persistente in-process.
+    """
+    settings = get_settings()
+    if settings.chroma_host:
+        logger.info(f"Connessione a Chroma server {settings.chroma_host}:{settings.chroma_port}")
+        return chromadb.HttpClient(host=settings.chroma_host, port=settings.chroma_port)
+    return chromadb.PersistentClient(path=str(settings.vector_db_path))
+
+
+def _load_embeddings(settings) -> HuggingFaceEmbeddings:
+    """
+    Modello embeddings configurato.
+    
+    Con `embedding_backend="onnx"` sentence-transformers usa ONNX Runtime con
+    il modello quantizzato int8 (`embedding_onnx_file`), 2-4 volte più veloce
+    su CPU; se non disponibile torna al backend PyTorch.
+    """
+    # sentence-transformers ordina già i testi per lunghezza prima di dividerli
+    # in batch (padding al più lungo del batch): batch più grandi del default
+    # (32) riducono le chiamate al modello in ingestion
+    encode_kwargs = {'normalize_embeddings': True, 'batch_size': 64}
+    
+    if settings.embedding_backend == "onnx":
+        try:
+            return HuggingFaceEmbeddings(
+                model_name=settings.embedding_model,
+                model_kwargs={
+                    'device': 'cpu',
+                    'backend': 'onnx',
+                    'model_kwargs': {'file_name': settings.embedding_onnx_file}
+                },
+                encode_kwargs=encode_kwargs
+            )
+        except Exception as e:
+            logger.warning(f"Encoder ONNX non disponibile ({e}), uso PyTorch")
+    
+    return HuggingFaceEmbeddings(
+        model_name=settings.embedding_model,
+        model_kwargs={'device': 'cpu'},
+        encode_kwargs=encode_kwargs
+    )
+
+
+class CachedQueryEmbeddings(Embeddings):
+    """
+    Embeddings con cache (LRU + TTL) degli embedding delle query.
+    
+    La stessa query viene codificata una volta sola anche se cercata su più
+    livelli o ripetuta; gli embedding dei documenti non passano dalla cache.
+    """
+    
+    def __init__(self, embeddings: Embeddings, maxsize: int = 1000, ttl: float = 300):
+        """
+        Inizializza la cache.
+        
+        Args:
+            embeddings: Modello embeddings da avvolgere
+            maxsize: Numero massimo di query in cache
+            ttl: Durata di una voce in cache (secondi)
+        """
+        self.embeddings = embeddings
+        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.RLock()
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.embeddings.embed_documents(texts)
+    
+    def embed_query(self, text: str) -> List[float]:
+        with self._lock:
+            embedding = self._cache.get(text)
+        if embedding is None:
+            embedding = self.embeddings.embed_query(text)
+            with self._lock:
+                self._cache[text] = embedding
+        return embedding
+
+
+@lru_cache(maxsize=1)
+def get_embeddings() -> CachedQueryEmbeddings:
+    """
+    Modello embeddings condiviso da tutti i vector store del processo.
+    
+    I pesi del modello (centinaia di MB) vengono caricati una volta sola, e la
+    cache delle query vale per tutti i livelli normativi.
+    """
+    settings = get_settings()
+    
+    logger.info(f"Caricamento modello embeddings: {settings.embedding_model}")
+    try:
+        embeddings = _load_embeddings(settings)
+        logger.info("Modello embeddings caricato con successo")
+    except Exception as e:
+        logger.warning(f"Errore caricamento embeddings: {e}. Uso FakeEmbeddings per modalità offline")
+        from langchain_community.embeddings import FakeEmbeddings
+        embeddings = FakeEmbeddings(size=768)
+    
+    return CachedQueryEmbeddings(embeddings)
+
+
+def _copy_documents(documents) -> List[Document]:
+    """Copie dei documenti: i risultati in cache non vanno modificati dai chiamanti."""
+    return [
+        Document(page_content=doc.page_content, metadata=dict(doc.metadata))
+        for doc in documents
+    ]
+
+
+def _normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Normalizza a norma unitaria un vettore o le righe di una matrice."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+# Quantizzazioni supportate per l'indice FAISS (scalar quantizer)
+_FAISS_QUANTIZATION = {"fp16": "QT_fp16", "int8": "QT_8bit"}
+
+
+def _build_faiss_index(matrix: np.ndarray, quantization: str = "none"):
+    """
+    Indice FAISS a prodotto scalare sui vettori dati.
+    
+    Con `quantization` "fp16"/"int8" i vettori sono memorizzati a 2/1 byte
+    per componente (`IndexScalarQuantizer`): la scansione, limitata dalla
+    banda di memoria, legge 2-4 volte meno dati. Su vettori normalizzati la
+    perdita di recall è tipicamente sotto lo 0,5% (fp16).
+    """
+    dim = matrix.shape[1]
+    qtype = _FAISS_QUANTIZATION.get(quantization)
+    if qtype is None:
+        index = faiss.IndexFlatIP(dim)
+    else:
+        index = faiss.IndexScalarQuantizer(
+            dim,
+            getattr(faiss.ScalarQuantizer, qtype),
+            faiss.METRIC_INNER_PRODUCT
+        )
+        index.train(matrix)
+    index.add(matrix)
+    return index
+
+
+class FlatIndex:
+    """
+    Indice esatto in memoria sugli embedding di una collection.
+    
+    Gli embedding sono normalizzati, quindi il prodotto scalare coincide con
+    la similarità coseno dell'indice HNSW di Chroma, ma senza approssimazione.
+    Usa FAISS se installato (opzionalmente con vettori quantizzati),
+    altrimenti un prodotto matrice-vettore NumPy (BLAS).
+    """
+    
+    def __init__(self, collection, quantization: str = "none"):
+        """
+        Carica gli embedding della collection.
+        
+        Args:
+            collection: Collection ChromaDB
+            quantization: "none", "fp16" o "int8" (solo con FAISS)
+        """
+        data = collection.get(include=["embeddings", "documents", "metadatas"])
+        self.documents = data["documents"]
+        self.metadatas = data["metadatas"]
+        self.size = len(self.documents)
+        matrix = _normalize_rows(np.asarray(data["embeddings"], dtype=np.float32))
+        
+        self._faiss_index = None
+        self.matrix = None
+        if faiss is not None and self.size:
+            # I vettori restano solo nell'indice (eventualmente quantizzati)
+            self._faiss_index = _build_faiss_index(matrix, quantization)
+        else:
+            self.matrix = matrix
+    
+    def search(
+        self,
+        embedding: List[float],
+        k: int,
+        filter_dict: Optional[Dict[str, Any]] = None
+    ) -> List[Document]:
+        """
+        Top-k documenti per prodotto scalare con l'embedding della query.
+        
+        Args:
+            embedding: Embedding (normalizzato) della query
+            k: Numero di risultati
+            filter_dict: Filtri di uguaglianza sui metadati (opzionale)
+            
+        Returns:
+            Lista di documenti ordinati per similarità
+        """
+        if not self.size:
+            return []
+        
+        query = _normalize_rows(np.asarray(embedding, dtype=np.float32))
+        
+        candidates = None
+        if filter_dict:
+            candidates = np.fromiter(
+                (
+                    i for i, metadata in enumerate(self.metadatas)
+                    if all((metadata or {}).get(key) == value for key, value in filter_dict.items())
+                ),
+                dtype=np.int64
+            )
+            if not len(candidates):
+                return []
+        
+        if self._faiss_index is not None:
+            params = None
+            if candidates is not None:
+                # Ricerca ristretta ai documenti che soddisfano il filtro
+                params = faiss.SearchParameters(
+                    sel=faiss.IDSelectorBatch(len(candidates), faiss.swig_ptr(candidates))
+                )
+            _, indices = self._faiss_index.search(query[None, :], k, params=params)
+            return [self._document(i) for i in indices[0] if i >= 0]
+        
+        if candidates is not None:
+            scores = self.matrix[candidates] @ query
+        else:
+            scores = self.matrix @ query
+        
+        k = min(k, len(scores))
+        if k == 0:
+            return []
+        
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        if candidates is not None:
+            top = candidates[top]
+        
+        return [self._document(i) for i in top]
+    
+    def _document(self, i: int) -> Document:
+        return Document(page_content=self.documents[i], metadata=dict(self.metadatas[i] or {}))
+
 
 class VectorStoreManager:
     """Gestisce il vector database per le normative."""
     
-    def __init__(self, collection_name: str = "normative"):
+    def __init__(
+        self,
+        collection_name: str = "normative",
+        flat_index: bool = False,
+        embeddings: Optional[Embeddings] = None
+    ):
         """
         Inizializza il vector store.
         
         Args:
             collection_name: Nome della collection ChromaDB
+            flat_index: Se True, sotto `flat_index_max_docs` documenti la
+                ricerca usa un indice esatto in memoria invece di HNSW
+            embeddings: Modello embeddings (default: quello condiviso del processo)
         """
         self.collection_name = collection_name
+        self.flat_index = flat_index
+        # (generazione, istante di costruzione, indice o None se sopra soglia)
+        self._flat_index_state: Optional[Tuple[int, float, Optional[FlatIndex]]] = None
+        self._flat_index_lock = threading.Lock()
+        
+        # Risultati delle ricerche recenti; la generazione nella chiave li
+        # invalida a ogni modifica della collection
+        self._search_cache = TTLCache(maxsize=1000, ttl=300)
+        self._search_cache_lock = threading.RLock()
+        self._generation = 0
         
         settings = get_settings()
         
-        # Inizializza embeddings (modello multilingua per italiano)
-        logger.info(f"Caricamento modello embeddings: {settings.embedding_model}")
-        try:
-            self.embeddings = HuggingFaceEmbeddings(
-                model_name=settings.embedding_model,
-                model_kwargs={'device': 'cpu'},
-                encode_kwargs={'normalize_embeddings': True}
-            )
-            logger.info("Modello embeddings caricato con successo")
-        except Exception as e:
-            logger.warning(f"Errore caricamento embeddings: {e}. Uso FakeEmbeddings per modalità offline")
-            from langchain_community.embeddings import FakeEmbeddings
-            self.embeddings = FakeEmbeddings(size=768)
+        # Embeddings (modello multilingua per italiano), caricati una volta sola
+        self.embeddings = embeddings if embeddings is not None else get_embeddings()
         
-        # Inizializza ChromaDB (Nuova API)
-        self.client = chromadb.PersistentClient(
-            path=str(settings.vector_db_path)
-        )
+        # Inizializza ChromaDB (client condiviso tra le collection)
+        self.client = get_chroma_client()
+        self.embedding_model = settings.embedding_model
+        self.flat_index_max_docs = settings.flat_index_max_docs
+        self.flat_index_quantization = settings.flat_index_quantization
+        self.flat_index_ttl = settings.flat_index_ttl
         
         # Inizializza vector store LangChain
         self.vector_store = Chroma(
@@ -61,7 +331,7 @@ class VectorStoreManager:
     def add_documents(
         self,
         documents: List[Document],
-        batch_size: int = 100
+        batch_size: int = 200
     ) -> List[str]:
         """
         Aggiunge documenti al vector store.
@@ -75,28 +345,126 @@ class VectorStoreManager:
         """
         logger.info(f"Aggiunta di {len(documents)} documenti al vector store")
         
-        all_ids = []
+        ids = [str(uuid.uuid4()) for _ in documents]
+        texts = [doc.page_content for doc in documents]
+        metadatas = [doc.metadata for doc in documents]
         
-        # Inserisci in batch per efficienza
-        for i in range(0, len(documents), batch_size):
-            batch = documents[i:i + batch_size]
-            
-            try:
-                ids = self.vector_store.add_documents(batch)
-                all_ids.extend(ids)
-                logger.debug(f"Batch {i//batch_size + 1}: {len(ids)} documenti inseriti")
-            except Exception as e:
-                logger.error(f"Errore nell'inserimento batch {i//batch_size + 1}: {e}")
-                raise
+        all_ids = self.add_embedded(ids, texts, None, metadatas, batch_size)
         
         logger.success(f"Inseriti {len(all_ids)} documenti nel vector store")
         return all_ids
     
+    def add_embedded(
+        self,
+        ids: List[str],
+        docs: List[str],
+        embeddings: Optional[List[List[float]]],
+        metadatas: List[Dict[str, Any]],
+        batch_size: int = 200
+    ) -> List[str]:
+        """
+        Inserisce testi nella collection, a blocchi.
+        
+        Gli embedding vengono calcolati con un'unica chiamata al modello
+        (sentence-transformers li ordina per lunghezza e li codifica a batch
+        con padding minimo); `batch_size` riguarda solo gli inserimenti in
+        Chroma, ognuno una sola `collection.add`.
+        
+        Args:
+            ids: ID dei testi
+            docs: Testi
+            embeddings: Embedding dei testi (se None, calcolati qui)
+            metadatas: Metadati dei testi
+            batch_size: Numero di testi per inserimento
+            
+        Returns:
+            Lista di ID inseriti
+        """
+        if not ids:
+            return []
+        
+        if embeddings is None:
+            embeddings = self.embeddings.embed_documents(list(docs))
+        
+        # Vettori unitari: la similarità coseno diventa un prodotto scalare
+        embeddings = _normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        
+        collection = self.client.get_collection(self.collection_name)
+        
+        try:
+            for i in range(0, len(ids), batch_size):
+                end = i + batch_size
+                collection.add(
+                    ids=ids[i:end],
+                    documents=docs[i:end],
+                    embeddings=embeddings[i:end],
+                    metadatas=metadatas[i:end]
+                )
+                logger.debug(f"Batch {i//batch_size + 1}: {len(ids[i:end])} documenti inseriti")
+        except Exception as e:
+            logger.error(f"Errore nell'inserimento batch {i//batch_size + 1}: {e}")
+            raise
+        finally:
+            self._invalidate()
+        
+        return ids
+    
+    @property
+    def generation(self) -> int:
+        """Numero di modifiche della collection (cresce a ogni invalidazione)."""
+        return self._generation
+    
+    def _invalidate(self):
+        """Scarta indice esatto e risultati in cache dopo una modifica della collection."""
+        self._flat_index_state = None
+        with self._search_cache_lock:
+            self._generation += 1
+            self._search_cache.clear()
+    
+    def _get_flat_index(self) -> Optional[FlatIndex]:
+        """
+        Indice esatto della collection, se abilitato e sotto soglia.
+        
+        Ricostruito dopo ogni modifica locale (generazione) e comunque ogni
+        `flat_index_ttl` secondi, per includere inserimenti e upsert fatti da
+        altri worker sul server Chroma senza interrogarlo a ogni ricerca.
+        """
+        if not self.flat_index:
+            return None
+        
+        state = self._flat_index_state
+        if state is not None and self._flat_index_fresh(state):
+            return state[2]
+        
+        with self._flat_index_lock:
+            state = self._flat_index_state
+            if state is None or not self._flat_index_fresh(state):
+                # Generazione letta prima della costruzione: una modifica
+                # concorrente rende subito superato l'indice appena creato
+                generation = self._generation
+                collection = self.client.get_collection(self.collection_name)
+                index = None
+                if collection.count() <= self.flat_index_max_docs:
+                    index = FlatIndex(collection, self.flat_index_quantization)
+                    logger.info(f"Indice esatto {self.collection_name}: {index.size} documenti")
+                state = (generation, time.monotonic(), index)
+                self._flat_index_state = state
+        return state[2]
+    
+    def _flat_index_fresh(self, state: Tuple[int, float, Optional[FlatIndex]]) -> bool:
+        """Indica se l'indice esatto riflette ancora la collection."""
+        generation, built_at, _ = state
+        return (
+            generation == self._generation
+            and time.monotonic() - built_at < self.flat_index_ttl
+        )
+    
     def search(
         self,
         query: str,
         k: int = 5,
-        filter_dict: Optional[Dict[str, Any]] = None
+        filter_dict: Optional[Dict[str, Any]] = None,
+        embedding: Optional[List[float]] = None
     ) -> List[Document]:
         """
         Ricerca semantica nel vector store.
@@ -105,14 +473,39 @@ class VectorStoreManager:
             query: Query di ricerca
             k: Numero di risultati da restituire
             filter_dict: Filtri sui metadati (es. {"normative_level": "comunale"})
+            embedding: Embedding della query già calcolato (opzionale)
             
         Returns:
             Lista di documenti rilevanti
         """
         logger.info(f"Ricerca: '{query}' (top {k})")
         
+        cache_key = (
+            self._generation,
+            query,
+            orjson.dumps(filter_dict, option=orjson.OPT_SORT_KEYS) if filter_dict else None,
+            k
+        )
+        with self._search_cache_lock:
+            cached = self._search_cache.get(cache_key)
+        if cached is not None:
+            logger.debug(f"Ricerca in cache: {len(cached)} risultati")
+            return _copy_documents(cached)
+        
         try:
-            if filter_dict:
+            flat_index = self._get_flat_index()
+            if flat_index is not None:
+                if embedding is None:
+                    embedding = self.embeddings.embed_query(query)
+                results = flat_index.search(embedding, k, filter_dict)
+            elif embedding is not None:
+                # Embedding precalcolato (es. batch di query): nessun nuovo encoding
+                results = self.vector_store.similarity_search_by_vector(
+                    embedding,
+                    k=k,
+                    filter=filter_dict or None
+                )
+            elif filter_dict:
                 results = self.vector_store.similarity_search(
                     query,
                     k=k,
@@ -122,12 +515,35 @@ class VectorStoreManager:
                 results = self.vector_store.similarity_search(query, k=k)
             
             logger.debug(f"Trovati {len(results)} risultati")
+            with self._search_cache_lock:
+                self._search_cache[cache_key] = _copy_documents(results)
             return results
             
         except Exception as e:
             logger.error(f"Errore nella ricerca: {e}")
             raise
     
+    async def asearch(
+        self,
+        query: str,
+        k: int = 5,
+        filter_dict: Optional[Dict[str, Any]] = None,
+        embedding: Optional[List[float]] = None
+    ) -> List[Document]:
+        """
+        Versione asincrona di `search` (eseguita in un thread).
+        
+        Args:
+            query: Query di ricerca
+            k: Numero di risultati da restituire
+            filter_dict: Filtri sui metadati (es. {"normative_level": "comunale"})
+            embedding: Embedding della query già calcolato (opzionale)
+            
+        Returns:
+            Lista di documenti rilevanti
+        """
+        return await asyncio.to_thread(self.search, query, k, filter_dict, embedding)
+    
     def search_with_score(
         self,
         query: str,
@@ -192,6 +608,7 @@ class VectorStoreManager:
             
             if ids_to_delete:
                 collection.delete(ids=ids_to_delete)
+                self._invalidate()
                 logger.success(f"Eliminati {len(ids_to_delete)} documenti")
                 return len(ids_to_delete)
             else:
@@ -216,7 +633,7 @@ class VectorStoreManager:
             stats = {
                 "collection_name": self.collection_name,
                 "total_documents": count,
-                "embedding_model": settings.embedding_model
+                "embedding_model": self.embedding_model
             }
             
             logger.info(f"Statistiche collection: {count} documenti")
@@ -232,6 +649,7 @@ class VectorStoreManager:
         
         try:
             self.client.delete_collection(self.collection_name)
+            self._invalidate()
             logger.success("Collection eliminata")
             
             # Ricrea collection vuota
@@ -255,13 +673,26 @@ class MultiLevelVectorStore:
     
     def __init__(self):
         """Inizializza vector store per ogni livello normativo."""
+        # Livelli piccoli (regionale/comunale): ricerca esatta in memoria;
+        # il nazionale, più grande, resta su HNSW
+        # Un solo modello embeddings per i tre livelli
+        embeddings = get_embeddings()
         self.stores = {
-            "nazionale": VectorStoreManager("normative_nazionale"),
-            "regionale": VectorStoreManager("normative_regionale"),
-            "comunale": VectorStoreManager("normative_comunale")
+            "nazionale": VectorStoreManager("normative_nazionale", embeddings=embeddings),
+            "regionale": VectorStoreManager(
+                "normative_regionale", flat_index=True, embeddings=embeddings
+            ),
+            "comunale": VectorStoreManager(
+                "normative_comunale", flat_index=True, embeddings=embeddings
+            )
         }
         logger.info("Multi-level vector store inizializzato")
     
+    @property
+    def generation(self) -> int:
+        """Numero complessivo di modifiche dei livelli (cresce a ogni invalidazione)."""
+        return sum(store.generation for store in self.stores.values())
+    
     def add_documents(
         self,
         documents: List[Document],
@@ -282,6 +713,67 @@ class MultiLevelVectorStore:
         
         return self.stores[level].add_documents(documents)
     
+    def add_batch(
+        self,
+        level: str,
+        ids: List[str],
+        docs: List[str],
+        embeddings: Optional[List[List[float]]],
+        metadatas: List[Dict[str, Any]],
+        batch_size: int = 200
+    ) -> List[str]:
+        """
+        Inserisce chunk nel livello indicato, a blocchi.
+        
+        Ogni blocco è una sola `collection.add` (una transazione SQLite in
+        Chroma) invece di un inserimento per documento.
+        
+        Args:
+            level: Livello normativo (nazionale/regionale/comunale)
+            ids: ID dei chunk
+            docs: Testi dei chunk
+            embeddings: Embedding dei chunk (se None, calcolati qui con un
+                unico encoding ordinato per lunghezza)
+            metadatas: Metadati dei chunk
+            batch_size: Numero di chunk per inserimento
+            
+        Returns:
+            Lista di ID inseriti
+        """
+        if level not in self.stores:
+            raise ValueError(f"Livello non valido: {level}")
+        
+        self.stores[level].add_embedded(ids, docs, embeddings, metadatas, batch_size)
+        
+        logger.success(f"Inseriti {len(ids)} chunk nel livello {level}")
+        return ids
+    
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        Calcola gli embedding di più query con un unico forward pass.
+        
+        Args:
+            queries: Query da codificare
+            
+        Returns:
+            Lista di embedding, uno per query
+        """
+        embeddings = self.stores["nazionale"].embeddings
+        return embeddings.embed_documents(list(queries))
+    
+    def _search_level(
+        self,
+        level: str,
+        query: str,
+        k: int
+    ) -> List[Document]:
+        """Ricerca in un livello; in caso di errore restituisce una lista vuota."""
+        try:
+            return self.stores[level].search(query, k=k)
+        except Exception as e:
+            logger.error(f"Errore nella ricerca livello {level}: {e}")
+            return []
+    
     def search_all_levels(
         self,
         query: str,
@@ -290,6 +782,9 @@ class MultiLevelVectorStore:
         """
         Ricerca in tutti i livelli normativi.
         
+        Le ricerche sui livelli sono indipendenti e vengono eseguite in
+        parallelo: il tempo totale è quello della più lenta.
+        
         Args:
             query: Query di ricerca
             k_per_level: Numero di risultati per livello
@@ -297,15 +792,76 @@ class MultiLevelVectorStore:
         Returns:
             Dizionario con risultati per livello
         """
-        results = {}
+        futures = {
+            level: _SEARCH_EXECUTOR.submit(self._search_level, level, query, k_per_level)
+            for level in self.stores
+        }
+        return {level: future.result() for level, future in futures.items()}
+    
+    async def asearch_all_levels(
+        self,
+        query: str,
+        k_per_level: int = 3
+    ) -> Dict[str, List[Document]]:
+        """
+        Versione asincrona di `search_all_levels`.
         
-        for level, store in self.stores.items():
-            try:
-                results[level] = store.search(query, k=k_per_level)
-            except Exception as e:
-                logger.error(f"Errore nella ricerca livello {level}: {e}")
-                results[level] = []
+        Args:
+            query: Query di ricerca
+            k_per_level: Numero di risultati per livello
+            
+        Returns:
+            Dizionario con risultati per livello
+        """
+        levels = list(self.stores)
+        results = await asyncio.gather(*(
+            asyncio.to_thread(self._search_level, level, query, k_per_level)
+            for level in levels
+        ))
+        return dict(zip(levels, results))
+    
+    @staticmethod
+    def _hierarchy_tiers(
+        municipality: Optional[str],
+        province: Optional[str],
+        region: Optional[str]
+    ) -> List[tuple]:
+        """Livelli da interrogare, in ordine di priorità: (store, filtro, livello, ambito)."""
+        tiers = []
+        if municipality:
+            tiers.append(("comunale", {"municipality": municipality}, "Comunale", municipality))
+        # Il provinciale è mappato sullo store regionale
+        if province:
+            tiers.append(("regionale", {"province": province}, "Provinciale", province))
+        if region:
+            tiers.append(("regionale", {"region": region}, "Regionale", region))
+        # Il nazionale sempre
+        tiers.append(("nazionale", None, "Nazionale", "Italia"))
+        return tiers
+    
+    def _search_tier(
+        self,
+        tier: tuple,
+        query: str,
+        k: int,
+        embedding: Optional[List[float]]
+    ) -> List[Document]:
+        """Ricerca in un livello gerarchico, annotando i risultati con livello e ambito."""
+        store_level, filter_dict, hierarchy_level, scope = tier
+        try:
+            results = self.stores[store_level].search(
+                query,
+                k=k,
+                filter_dict=filter_dict,
+                embedding=embedding
+            )
+        except Exception as e:
+            logger.warning(f"Errore ricerca {hierarchy_level.lower()}: {e}")
+            return []
         
+        for doc in results:
+            doc.metadata["hierarchy_level"] = hierarchy_level
+            doc.metadata["context_scope"] = scope
         return results
     
     def search_hierarchical(
@@ -314,80 +870,63 @@ class MultiLevelVectorStore:
         municipality: Optional[str] = None,
         province: Optional[str] = None,
         region: Optional[str] = None,
-        k: int = 3
+        k: int = 3,
+        embedding: Optional[List[float]] = None
     ) -> List[Document]:
         """
         Ricerca gerarchica comparativa: recupera documenti da TUTTI i livelli rilevanti.
         
+        I livelli (comunale, provinciale, regionale, nazionale) vengono
+        interrogati in parallelo; i risultati sono uniti in ordine di priorità.
+        
         Args:
             query: Query di ricerca
             municipality: Comune (se specificato, cerca anche qui)
             province: Provincia (se specificato, cerca anche qui)
             region: Regione (se specificato, cerca anche qui)
             k: Numero di risultati PER LIVELLO
+            embedding: Embedding della query già calcolato (opzionale)
             
         Returns:
             Lista unica di documenti con metadati sul livello
         """
-        all_results = []
+        futures = [
+            _SEARCH_EXECUTOR.submit(self._search_tier, tier, query, k, embedding)
+            for tier in self._hierarchy_tiers(municipality, province, region)
+        ]
+        all_results = [doc for future in futures for doc in future.result()]
         
-        # 1. Livello Comunale (se applicabile)
-        if municipality:
-            try:
-                comunale_results = self.stores["comunale"].search(
-                    query,
-                    k=k,
-                    filter_dict={"municipality": municipality}
-                )
-                for doc in comunale_results:
-                    doc.metadata["hierarchy_level"] = "Comunale"
-                    doc.metadata["context_scope"] = municipality
-                all_results.extend(comunale_results)
-            except Exception as e:
-                logger.warning(f"Errore ricerca comunale: {e}")
-
-        # 2. Livello Provinciale (se applicabile - mappato su store regionale)
-        if province:
-            try:
-                provinciale_results = self.stores["regionale"].search(
-                    query,
-                    k=k,
-                    filter_dict={"province": province}
-                )
-                for doc in provinciale_results:
-                    doc.metadata["hierarchy_level"] = "Provinciale"
-                    doc.metadata["context_scope"] = province
-                all_results.extend(provinciale_results)
-            except Exception as e:
-                logger.warning(f"Errore ricerca provinciale: {e}")
-
-        # 3. Livello Regionale (se applicabile)
-        if region:
-            try:
-                regionale_results = self.stores["regionale"].search(
-                    query,
-                    k=k,
-                    filter_dict={"region": region}
-                )
-                for doc in regionale_results:
-                    doc.metadata["hierarchy_level"] = "Regionale"
-                    doc.metadata["context_scope"] = region
-                all_results.extend(regionale_results)
-            except Exception as e:
-                logger.warning(f"Errore ricerca regionale: {e}")
-        
-        # 4. Livello Nazionale (Sempre)
-        try:
-            nazionale_results = self.stores["nazionale"].search(
-                query,
-                k=k
-            )
-            for doc in nazionale_results:
-                doc.metadata["hierarchy_level"] = "Nazionale"
-                doc.metadata["context_scope"] = "Italia"
-            all_results.extend(nazionale_results)
-        except Exception as e:
-            logger.warning(f"Errore ricerca nazionale: {e}")
+        logger.info(f"Ricerca gerarchica comparativa: {len(all_results)} documenti totali")
+        return all_results
+    
+    async def asearch_hierarchical(
+        self,
+        query: str,
+        municipality: Optional[str] = None,
+        province: Optional[str] = None,
+        region: Optional[str] = None,
+        k: int = 3,
+        embedding: Optional[List[float]] = None
+    ) -> List[Document]:
+        """
+        Versione asincrona di `search_hierarchical`.
+        
+        Args:
+            query: Query di ricerca
+            municipality: Comune (se specificato, cerca anche qui)
+            province: Provincia (se specificato, cerca anche qui)
+            region: Regione (se specificato, cerca anche qui)
+            k: Numero di risultati PER LIVELLO
+            embedding: Embedding della query già calcolato (opzionale)
+            
+        Returns:
+            Lista unica di documenti con metadati sul livello
+        """
+        results = await asyncio.gather(*(
+            asyncio.to_thread(self._search_tier, tier, query, k, embedding)
+            for tier in self._hierarchy_tiers(municipality, province, region)
+        ))
+        all_results = [doc for docs in results for doc in docs]
         
         logger.info(f"Ricerca gerarchica comparativa: {len(all_results)} documenti totali")
         return all_results
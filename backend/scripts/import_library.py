@@ -1,5 +1,6 @@
 import asyncio
 import os
+import uuid
 from pathlib import Path
 from loguru import logger
 from typing import List
@@ -15,6 +16,44 @@ DIRS = {
     "comunale": LIBRARY_DIR / "comunale"
 }
 
+# Chunk accumulati prima di un inserimento (un encoding + blocchi `collection.add`)
+INDEX_BATCH_SIZE = 200
+
+
+def _flush_chunks(
+    vector_store: MultiLevelVectorStore,
+    level: str,
+    chunks: List,
+    file_names: List[str]
+) -> int:
+    """
+    Indicizza i chunk in attesa tramite `add_batch`.
+    
+    Args:
+        vector_store: Vector store multi-livello
+        level: Livello normativo
+        chunks: Chunk da indicizzare
+        file_names: File a cui appartengono i chunk
+        
+    Returns:
+        Numero di file indicizzati (0 se l'inserimento fallisce)
+    """
+    try:
+        ids = vector_store.add_batch(
+            level,
+            [str(uuid.uuid4()) for _ in chunks],
+            [chunk.page_content for chunk in chunks],
+            None,
+            [chunk.metadata for chunk in chunks]
+        )
+    except Exception as e:
+        logger.error(f"Errore indicizzazione {', '.join(file_names)}: {e}")
+        return 0
+    
+    logger.success(f"Indicizzati {len(ids)} chunks in {level} ({len(file_names)} file)")
+    return len(file_names)
+
+
 async def import_library():
     """Importa tutti i documenti presenti nella cartella library."""
     logger.info("Avvio importazione libreria normativa...")
@@ -36,6 +75,11 @@ async def import_library():
             
         logger.info(f"Trovati {len(files)} file in {level}")
         
+        # Chunk in attesa: indicizzati a blocchi di INDEX_BATCH_SIZE, così
+        # in memoria resta al più un blocco (più l'ultimo file letto)
+        pending_chunks = []
+        pending_files = []
+        
         for file_path in files:
             try:
                 logger.info(f"Processando: {file_path.name}")
@@ -60,14 +104,23 @@ async def import_library():
                     municipality=municipality
                 )
                 
-                ids = vector_store.add_documents(chunks, level=level)
-                logger.success(f"Indicizzato {file_path.name}: {len(ids)} chunks")
-                total_files += 1
+                logger.info(f"Processato {file_path.name}: {len(chunks)} chunks")
                 
             except Exception as e:
                 logger.error(f"Errore su {file_path.name}: {e}")
+                continue
+            
+            pending_chunks.extend(chunks)
+            pending_files.append(file_path.name)
+            
+            if len(pending_chunks) >= INDEX_BATCH_SIZE:
+                total_files += _flush_chunks(vector_store, level, pending_chunks, pending_files)
+                pending_chunks, pending_files = [], []
+        
+        if pending_files:
+            total_files += _flush_chunks(vector_store, level, pending_chunks, pending_files)
                 
-    logger.info(f"Importazione completata. Totale file processati: {total_files}")
+    logger.info(f"Importazione completata. Totale file indicizzati: {total_files}")
 
 if __name__ == "__main__":
     # Configura logger per script
@@ -51,3 +51,23 @@ async def test_agent_flow(mock_settings, mock_llm_chain, mock_vector_store):
             # Assertions
             assert "Analisi" in response
             mock_vector_store.search_hierarchical.assert_called_once()
+
+def test_location_extraction_cache_keeps_original_query(mock_settings):
+    """La query normalizzata è solo la chiave di cache: al modello va l'originale."""
+    
+    with patch('backend.agents.urban_compliance_agent.LLMRouter') as MockLLMRouter:
+        with patch('backend.agents.urban_compliance_agent.MultiLevelVectorStore'):
+            
+            mock_router_instance = MockLLMRouter.return_value
+            mock_router_instance.gpt35.invoke.return_value.content = '{"municipality": "Tarquinia", "region": "Lazio"}'
+            
+            agent = UrbanComplianceAgent()
+            
+            first = agent._extract_location_from_query("  Quali sono i vincoli a Tarquinia? ")
+            second = agent._extract_location_from_query("quali sono  i vincoli a tarquinia?")
+            
+            # Una sola chiamata LLM, con le maiuscole della query originale
+            mock_router_instance.gpt35.invoke.assert_called_once()
+            prompt = mock_router_instance.gpt35.invoke.call_args.args[0]
+            assert "Quali sono i vincoli a Tarquinia?" in prompt
+            assert first == second == {"municipality": "Tarquinia", "region": "Lazio"}
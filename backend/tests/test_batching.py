@@ -0,0 +1,49 @@
+import asyncio
+import pytest
+
+from backend.api.batching import QueryEmbeddingBatcher
+
+
+def _fake_embed(calls):
+    """Encoder fittizio: l'embedding di una query è [len(query)]; registra i batch."""
+    def embed(queries):
+        calls.append(list(queries))
+        return [[float(len(q))] for q in queries]
+    return embed
+
+
+@pytest.mark.asyncio
+async def test_concurrent_queries_share_one_batch_in_order():
+    calls = []
+    batcher = QueryEmbeddingBatcher(_fake_embed(calls), max_wait=0.05)
+    queries = ["vincoli paesaggistici", "PRG", "distanze tra edifici"]
+
+    results = await asyncio.gather(*(batcher.embed(q) for q in queries))
+    batcher._worker.cancel()
+
+    # Ogni chiamante riceve il proprio embedding nonostante il riordino per lunghezza
+    assert results == [[float(len(q))] for q in queries]
+    assert calls == [sorted(queries, key=len)]
+
+
+@pytest.mark.asyncio
+async def test_encoding_error_propagates_to_every_waiter():
+    def failing_embed(queries):
+        raise RuntimeError("modello non disponibile")
+
+    batcher = QueryEmbeddingBatcher(failing_embed, max_wait=0.05)
+
+    results = await asyncio.gather(
+        batcher.embed("vincoli"),
+        batcher.embed("volumetria"),
+        return_exceptions=True
+    )
+
+    assert len(results) == 2
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+    # Il worker sopravvive all'errore e serve le richieste successive
+    assert not batcher._worker.done()
+    batcher._embed_fn = _fake_embed([])
+    assert await batcher.embed("PRG") == [3.0]
+    batcher._worker.cancel()
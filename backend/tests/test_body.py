@@ -0,0 +1,52 @@
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+from backend.api.body import json_body
+
+
+class _Payload(BaseModel):
+    municipality: str
+    region: str = "Lazio"
+
+
+@pytest.fixture
+def client():
+    """App minimale con una route che valida il body tramite `json_body`."""
+    app = FastAPI()
+
+    @app.post("/echo")
+    async def echo(payload: _Payload = Depends(json_body(_Payload))):
+        return payload.model_dump()
+
+    return TestClient(app)
+
+
+def test_valid_body(client):
+    response = client.post("/echo", content=b'{"municipality": "Tarquinia"}')
+
+    assert response.status_code == 200
+    assert response.json() == {"municipality": "Tarquinia", "region": "Lazio"}
+
+
+def test_malformed_bytes_return_422(client):
+    response = client.post(
+        "/echo",
+        content=b'{"municipality": "Tarquinia",',
+        headers={"Content-Type": "application/json"}
+    )
+
+    assert response.status_code == 422
+    error = response.json()["detail"][0]
+    assert error["type"] == "json_invalid"
+    assert error["loc"][0] == "body"
+
+
+def test_missing_field_returns_422(client):
+    response = client.post("/echo", content=b'{"region": "Lazio"}')
+
+    assert response.status_code == 422
+    error = response.json()["detail"][0]
+    assert error["type"] == "missing"
+    assert error["loc"] == ["body", "municipality"]
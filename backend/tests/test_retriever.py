@@ -0,0 +1,81 @@
+import pytest
+from unittest.mock import MagicMock
+from langchain_core.documents import Document
+
+from backend.config import RETRIEVAL_CONFIG
+from backend.rag.retriever import NormativeRetriever
+
+
+@pytest.fixture
+def retriever(mock_settings):
+    """Retriever con vector store mockato e config modificabile per test."""
+    retriever = NormativeRetriever(MagicMock())
+    retriever.config = dict(RETRIEVAL_CONFIG)
+    return retriever
+
+
+def test_keyword_match_substring_vs_token(retriever):
+    """"substring" (default) conta anche le keyword dentro parole più lunghe."""
+    keywords = frozenset({"costruzione"})
+    text = "È ammessa la ricostruzione dell'edificio"
+
+    assert retriever.config["keyword_match"] == "substring"
+    assert retriever._keyword_match_score(text, keywords) == 1.0
+
+    retriever.config["keyword_match"] = "token"
+    assert retriever._keyword_match_score(text, keywords) == 0.0
+
+
+def test_keyword_match_ranking_effect(retriever):
+    """La modalità di match cambia l'ordine prodotto dalla ricerca ibrida."""
+    generic = Document(page_content="Norme generali di attuazione del piano")
+    rebuild = Document(page_content="È ammessa la ricostruzione dell'edificio")
+    semantic_results = [generic, rebuild]
+
+    retriever.config["fusion"] = "weighted"
+    retriever.config["keyword_weight"] = 0.5
+
+    # "costruzione" è sottostringa di "ricostruzione": il secondo documento sale
+    ranked = retriever._hybrid_search("costruzione", semantic_results, top_k=2)
+    assert ranked == [rebuild, generic]
+
+    # Solo parole intere: nessun match, resta l'ordine semantico
+    retriever.config["keyword_match"] = "token"
+    ranked = retriever._hybrid_search("costruzione", semantic_results, top_k=2)
+    assert ranked == [generic, rebuild]
+
+
+@pytest.fixture
+def fusion_candidates():
+    """Candidati in ordine semantico: solo l'ultimo contiene le keyword della query."""
+    return [
+        Document(page_content="Norme generali sulle zone agricole"),
+        Document(page_content="Area soggetta a tutela idrogeologica"),
+        Document(page_content="Vincolo paesaggistico sulla fascia costiera"),
+    ]
+
+
+def test_weighted_fusion_uses_score_magnitude(retriever, fusion_candidates):
+    """Con la somma pesata un match keyword pieno porta l'ultimo documento in testa."""
+    retriever.config["fusion"] = "weighted"
+    retriever.config["keyword_weight"] = 0.5
+
+    ranked = retriever._hybrid_search("vincolo paesaggistico", fusion_candidates, top_k=3)
+
+    generic, other, match = fusion_candidates
+    assert ranked == [match, generic, other]
+
+
+def test_rrf_fusion_uses_rank_only(retriever, fusion_candidates):
+    """Con RRF conta solo il rango: il match keyword sale di una posizione."""
+    retriever.config["fusion"] = "rrf"
+    retriever.config["keyword_weight"] = 0.5
+    retriever.config["rrf_k"] = 60
+
+    ranked = retriever._hybrid_search("vincolo paesaggistico", fusion_candidates, top_k=3)
+
+    generic, other, match = fusion_candidates
+    assert ranked == [generic, match, other]
+
+    # top_k tronca dopo la fusione
+    assert retriever._hybrid_search("vincolo paesaggistico", fusion_candidates, top_k=1) == [generic]
@@ -0,0 +1,93 @@
+import pytest
+from unittest.mock import MagicMock
+
+from backend.rag import semantic_cache
+from backend.rag.semantic_cache import SemanticCache
+
+# Embeddings fittizi: parafrasi con lo stesso vettore, domande diverse ortogonali
+_VECTORS = {
+    "Quali sono i vincoli a Tarquinia?": [1.0, 0.0, 0.0],
+    "Che vincoli ci sono a Tarquinia?": [0.99, 0.01, 0.0],
+    "Come si calcola la volumetria?": [0.0, 1.0, 0.0],
+    "Distanze minime tra edifici?": [0.0, 0.0, 1.0],
+}
+
+
+@pytest.fixture
+def mock_embeddings():
+    """Modello embeddings mockato (interfaccia `embed_query`)."""
+    mock = MagicMock()
+    mock.embed_query.side_effect = lambda text: _VECTORS[text]
+    return mock
+
+
+def test_hit_on_paraphrase_and_miss(mock_embeddings):
+    cache = SemanticCache(mock_embeddings)
+    cache.add("Quali sono i vincoli a Tarquinia?", "Vincolo paesaggistico", "Tarquinia", "Lazio")
+
+    assert cache.lookup("Che vincoli ci sono a Tarquinia?", "Tarquinia", "Lazio") == "Vincolo paesaggistico"
+    assert cache.lookup("Come si calcola la volumetria?", "Tarquinia", "Lazio") is None
+
+
+def test_scope_isolation(mock_embeddings):
+    cache = SemanticCache(mock_embeddings)
+    cache.add("Quali sono i vincoli a Tarquinia?", "Vincolo paesaggistico", "Tarquinia", "Lazio")
+
+    assert cache.lookup("Quali sono i vincoli a Tarquinia?", "Montalto di Castro", "Lazio") is None
+    assert cache.lookup("Quali sono i vincoli a Tarquinia?") is None
+
+
+def test_eviction_of_oldest_entries(mock_embeddings):
+    cache = SemanticCache(mock_embeddings, max_entries=2)
+    cache.add("Quali sono i vincoli a Tarquinia?", "A")
+    cache.add("Come si calcola la volumetria?", "B")
+    cache.add("Distanze minime tra edifici?", "C")
+
+    assert cache.lookup("Quali sono i vincoli a Tarquinia?") is None
+    assert cache.lookup("Come si calcola la volumetria?") == "B"
+    assert cache.lookup("Distanze minime tra edifici?") == "C"
+
+
+def test_volatile_tokens_bypass_cache(mock_embeddings):
+    cache = SemanticCache(mock_embeddings)
+    question = "Vincoli per una sopraelevazione di 3 metri?"
+
+    cache.add(question, "Risposta")
+    assert cache.lookup(question) is None
+    mock_embeddings.embed_query.assert_not_called()
+
+
+def test_entries_expire_after_ttl(mock_embeddings, monkeypatch):
+    now = [1_000.0]
+    monkeypatch.setattr(semantic_cache.time, "time", lambda: now[0])
+    cache = SemanticCache(mock_embeddings, ttl=60)
+    cache.add("Quali sono i vincoli a Tarquinia?", "Vincolo paesaggistico")
+
+    now[0] += 30
+    assert cache.lookup("Quali sono i vincoli a Tarquinia?") == "Vincolo paesaggistico"
+
+    now[0] += 31
+    assert cache.lookup("Quali sono i vincoli a Tarquinia?") is None
+
+
+def test_generation_change_clears_cache(mock_embeddings):
+    generation = [0]
+    cache = SemanticCache(mock_embeddings, generation=lambda: generation[0])
+    cache.add("Quali sono i vincoli a Tarquinia?", "Vincolo paesaggistico")
+
+    generation[0] += 1
+    assert cache.lookup("Quali sono i vincoli a Tarquinia?") is None
+
+
+def test_persistence_roundtrip(mock_embeddings, tmp_path):
+    cache_file = tmp_path / "semantic_cache.pkl"
+    cache = SemanticCache(mock_embeddings, cache_file=cache_file, save_delay=60)
+    cache.add("Quali sono i vincoli a Tarquinia?", "Vincolo paesaggistico")
+
+    # Salvataggio differito: nessuna scrittura finché non scatta il timer
+    assert not cache_file.exists()
+    cache.flush()
+    assert cache_file.exists()
+
+    reloaded = SemanticCache(mock_embeddings, cache_file=cache_file)
+    assert reloaded.lookup("Quali sono i vincoli a Tarquinia?") == "Vincolo paesaggistico"
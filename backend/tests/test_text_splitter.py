@@ -0,0 +1,80 @@
+import pytest
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from backend.config import CHUNKING_CONFIG
+from backend.rag.text_splitter import SinglePassTextSplitter
+
+_PERIODO = (
+    "Nella zona {zona}, comma {comma}, periodo {periodo}, gli interventi di nuova "
+    "costruzione sono ammessi nel rispetto degli indici di zona e delle distanze "
+    "previste dal D.M. 1444/1968. "
+)
+
+
+def _nta_sample() -> str:
+    """Testo di esempio con la struttura delle NTA (articoli, commi, periodi)."""
+    articles = []
+    for zona in range(1, 9):
+        commi = "\n".join(
+            f"{comma}. " + "".join(
+                _PERIODO.format(zona=zona, comma=comma, periodo=periodo)
+                for periodo in range(1, 2 + (zona + comma) % 6)
+            )
+            for comma in range(1, 4)
+        )
+        articles.append(f"Art. {zona} - Zona omogenea {zona}\n\n{commi}")
+    return "Norme Tecniche di Attuazione del PRG\n\n" + "\n\n".join(articles)
+
+
+def _spans(text: str, chunks):
+    """Posizioni (inizio, fine) dei chunk nel testo, verificando che ne siano estratti."""
+    spans = []
+    search_from = 0
+    for chunk in chunks:
+        start = text.find(chunk, search_from)
+        assert start >= 0
+        spans.append((start, start + len(chunk)))
+        search_from = start + 1
+    return spans
+
+
+@pytest.fixture
+def splitters():
+    """Splitter a passata singola e riferimento LangChain con la stessa configurazione."""
+    kwargs = {
+        "chunk_size": CHUNKING_CONFIG["chunk_size"],
+        "chunk_overlap": CHUNKING_CONFIG["chunk_overlap"],
+        "separators": CHUNKING_CONFIG["separators"],
+        "keep_separator": CHUNKING_CONFIG["keep_separator"],
+    }
+    return SinglePassTextSplitter(**kwargs), RecursiveCharacterTextSplitter(**kwargs)
+
+
+def test_chunk_size_and_overlap_parity(splitters):
+    single_pass, reference = splitters
+    text = _nta_sample()
+    chunk_size = CHUNKING_CONFIG["chunk_size"]
+    chunk_overlap = CHUNKING_CONFIG["chunk_overlap"]
+
+    for chunks in (single_pass.split_text(text), reference.split_text(text)):
+        assert all(len(chunk) <= chunk_size for chunk in chunks)
+
+        spans = _spans(text, chunks)
+        covered = 0
+        for start, end in spans:
+            # Overlap limitato e nessun contenuto saltato tra chunk consecutivi
+            assert covered - start <= chunk_overlap
+            assert text[covered:start].strip() == ""
+            covered = max(covered, end)
+        assert text[covered:].strip() == ""
+
+    # Stessa granularità del riferimento (tagli su confini diversi ammessi)
+    expected = len(reference.split_text(text))
+    assert abs(len(single_pass.split_text(text)) - expected) <= max(1, expected // 5)
+
+
+def test_short_text_is_a_single_chunk(splitters):
+    single_pass, reference = splitters
+    text = "  Art. 1 - Ambito di applicazione\n\nLe presenti norme disciplinano il territorio comunale.  "
+
+    assert single_pass.split_text(text) == reference.split_text(text) == [text.strip()]
@@ -0,0 +1,37 @@
+from unittest.mock import MagicMock
+
+from backend.rag.vector_store import FlatIndex
+
+
+def _collection(metadatas):
+    """Collection Chroma mockata con embedding ortogonali."""
+    collection = MagicMock()
+    collection.get.return_value = {
+        "documents": [f"Documento {i}" for i in range(len(metadatas))],
+        "metadatas": metadatas,
+        "embeddings": [[1.0 if j == i else 0.0 for j in range(3)] for i in range(len(metadatas))],
+    }
+    return collection
+
+
+def test_flat_index_filter_skips_documents_without_metadata():
+    """Le voci senza metadati (None in Chroma) non soddisfano il filtro, senza errori."""
+    index = FlatIndex(_collection([
+        None,
+        {"municipality": "Tarquinia", "region": "Lazio"},
+        {"municipality": "Montalto di Castro", "region": "Lazio"},
+    ]))
+
+    results = index.search([0.0, 1.0, 0.0], k=3, filter_dict={"municipality": "Tarquinia"})
+
+    assert [doc.page_content for doc in results] == ["Documento 1"]
+    assert results[0].metadata["municipality"] == "Tarquinia"
+
+
+def test_flat_index_search_without_filter_returns_empty_metadata():
+    index = FlatIndex(_collection([None, {"region": "Lazio"}]))
+
+    results = index.search([1.0, 0.0, 0.0], k=1)
+
+    assert [doc.page_content for doc in results] == ["Documento 0"]
+    assert results[0].metadata == {}
@@ -40,6 +40,33 @@ class DocumentComparator:
         Returns:
             Analisi completa con difformità rilevate
         """
+        results = self.analyze_documents(
+            planimetria_catastale=planimetria_catastale,
+            progetto_urbanistico=progetto_urbanistico,
+            foto_immobile=foto_immobile
+        )
+        return self.detect_difformita(results, normative_context)
+    
+    def analyze_documents(
+        self,
+        planimetria_catastale: Optional[Path] = None,
+        progetto_urbanistico: Optional[Path] = None,
+        foto_immobile: Optional[List[Path]] = None
+    ) -> Dict[str, Any]:
+        """
+        Analizza i documenti e i confronti incrociati (senza contesto normativo).
+        
+        Non dipende dalle normative, quindi può essere eseguita in parallelo
+        al loro recupero.
+        
+        Args:
+            planimetria_catastale: Path planimetria catastale
+            progetto_urbanistico: Path progetto urbanistico
+            foto_immobile: Lista foto immobile
+            
+        Returns:
+            Risultati delle analisi dei documenti
+        """
         logger.info("Confronto completo documenti")
         
         results = {
@@ -91,6 +118,23 @@ class DocumentComparator:
                     "facciata"
                 )
         
+        return results
+    
+    def detect_difformita(
+        self,
+        results: Dict[str, Any],
+        normative_context: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Completa i risultati di `analyze_documents` con le difformità rilevate.
+        
+        Args:
+            results: Risultati delle analisi dei documenti
+            normative_context: Contesto normativo
+            
+        Returns:
+            Analisi completa con difformità rilevate
+        """
         # Genera analisi difformità completa
         difformita_analysis = self._generate_difformita_report(
             results,
@@ -154,14 +198,15 @@ Analisi Foto:
             foto=foto_info
         )
         
-        if normative_context:
-            prompt += f"\n\nNormative applicabili:\n{normative_context}"
-        
-        # Genera analisi con LLM
+        # Genera analisi con LLM (normative come prefisso cacheable)
         difformita_text = self.router.analyze_with_best_model(
             prompt,
             TaskType.COMPLIANCE_CHECK,
-            system_message=PromptTemplates.get_system_message("perito_tecnico")
+            system_message=PromptTemplates.get_system_message("perito_tecnico"),
+            cached_context=PromptTemplates.format_prompt(
+                PromptTemplates.NORMATIVE_CONTEXT,
+                context=normative_context
+            ) if normative_context else None
         )
         
         # Parsing strutturato (semplificato)